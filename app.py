@@ -1,10 +1,28 @@
 import streamlit as st
 import pandas as pd
 import os
-from datetime import datetime, date, timezone, timedelta
+from datetime import datetime, date, timezone, timedelta, time as dt_time
+import contextlib
+import functools
+import gzip
+import hashlib
+import inspect
 import io
+import json
 import math
+import numpy as np
+import queue
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+from streamlit.errors import StreamlitAPIException
 
 KST = timezone(timedelta(hours=9))
 
@@ -58,6 +76,29 @@ PRODUCTION_FILE = "production.xlsx"    # 자사: 작업번호 → 로트/제조
 MOVE_LOG_CSV = "bulk_move_log.csv"     # 이동 이력
 RECEIVE_FILE = "receive.xlsx"          # 사급: 입하번호 기반
 STOCK_FILE = "stock.xlsx"              # 전산 재고
+ARCHIVE_CSV = "bulk_drums_archive.csv" # 보관 원장 (소진 통)
+LEDGER_LOCK_PATH = "bulk_ledger"       # 원장/이력 쓰기 잠금 (bulk_ledger.lock)
+
+# ==============================
+# CSV 본문 압축 (S3 객체 / 세션 바이트)
+#  - 원장/이력 CSV는 한글 품명·위치·시간이 반복되어 gzip으로 5~10배 줄어든다
+#  - 읽을 때는 gzip 헤더를 보고 판단하므로 예전 평문 객체/세션 값도 그대로 읽힌다
+# ==============================
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def pack_bytes(data: bytes) -> bytes:
+    # mtime=0 → 같은 내용이면 같은 압축 결과
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def unpack_bytes(data):
+    """gzip이면 풀고, 아니면 그대로."""
+    if data is not None and data[:2] == _GZIP_MAGIC:
+        return gzip.decompress(data)
+    return data
+
 
 # ==============================
 # S3 연동 설정
@@ -65,6 +106,14 @@ STOCK_FILE = "stock.xlsx"              # 전산 재고
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "bulk-system-enc")
 S3_PREFIX = os.getenv("S3_PREFIX", "bulk-app/")  # 폴더 경로
 
+# 전송 설정 (환경변수로 조정)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None              # MinIO 등 S3 호환 서버 (로컬 테스트용)
+S3_MAX_POOL = int(os.getenv("S3_MAX_POOL", "20"))                   # 커넥션 풀 크기
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", "3"))    # 초
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", "15"))         # 초
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))            # 재시도 포함 총 시도 횟수
+S3_RETRY_INTERVAL = int(os.getenv("S3_RETRY_INTERVAL", "60"))       # 실패한 업로드 재전송 간격 (초)
+
 
 def s3_enabled() -> bool:
     return bool(S3_BUCKET_NAME)
@@ -74,12 +123,97 @@ def s3_enabled() -> bool:
 def get_s3_client():
     try:
         session = boto3.session.Session()
-        client = session.client("s3")
+        config = BotoConfig(
+            max_pool_connections=S3_MAX_POOL,
+            connect_timeout=S3_CONNECT_TIMEOUT,
+            read_timeout=S3_READ_TIMEOUT,
+            # adaptive: 지수 백오프 + 지터, 스로틀링 응답이 오면 전송률 자동 조절
+            retries={"total_max_attempts": S3_MAX_ATTEMPTS, "mode": "adaptive"},
+        )
+        client = session.client("s3", endpoint_url=S3_ENDPOINT_URL, config=config)
         return client
     except Exception:
         return None
 
 
+# ----- S3 호출 지연시간 / 오류 집계 (프로세스 공용) -----
+@st.cache_resource(show_spinner=False)
+def _s3_metrics() -> dict:
+    return {"lock": threading.Lock(), "ops": {}}
+
+
+@contextlib.contextmanager
+def _s3_timed(op: str):
+    """with _s3_timed("put_object"): ... → 호출 수 / 오류 수 / 지연시간(ms) 기록."""
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metrics = _s3_metrics()
+        with metrics["lock"]:
+            m = metrics["ops"].setdefault(
+                op, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+            )
+            m["calls"] += 1
+            m["errors"] += int(failed)
+            m["total_ms"] += elapsed_ms
+            m["max_ms"] = max(m["max_ms"], elapsed_ms)
+            m["last_ms"] = elapsed_ms
+
+
+def s3_metrics_frame() -> pd.DataFrame:
+    metrics = _s3_metrics()
+    with metrics["lock"]:
+        rows = [
+            {
+                "호출": op,
+                "횟수": m["calls"],
+                "오류": m["errors"],
+                "평균 ms": round(m["total_ms"] / m["calls"], 1) if m["calls"] else None,
+                "최대 ms": round(m["max_ms"], 1),
+                "최근 ms": round(m["last_ms"], 1),
+            }
+            for op, m in sorted(metrics["ops"].items())
+        ]
+    return pd.DataFrame(rows)
+
+
+# ----- 실패한 업로드 대기열 (파일별 최신 내용만 보관, 프로세스 공용) -----
+@st.cache_resource(show_spinner=False)
+def _s3_pending_writes() -> dict:
+    return {"lock": threading.Lock(), "items": OrderedDict(), "next_retry": 0.0}
+
+
+def s3_pending_filenames() -> list:
+    pending = _s3_pending_writes()
+    with pending["lock"]:
+        return list(pending["items"])
+
+
+def flush_s3_pending(force: bool = False) -> int:
+    """
+    대기 중인 업로드를 다시 전송. S3_RETRY_INTERVAL마다 한 번만 시도 (force면 바로).
+    return: 아직 남은 건수
+    """
+    pending = _s3_pending_writes()
+    with pending["lock"]:
+        if not pending["items"]:
+            return 0
+        if not force and time.time() < pending["next_retry"]:
+            return len(pending["items"])
+        pending["next_retry"] = time.time() + S3_RETRY_INTERVAL
+        items = list(pending["items"].items())
+
+    for filename, data in items:
+        s3_upload_bytes(filename, data, notify=False)
+    return len(s3_pending_filenames())
+
+
 def _s3_key(filename: str) -> str:
     """
     S3에서 저장되는 경로를 결정.
@@ -89,31 +223,59 @@ def _s3_key(filename: str) -> str:
     return f"{prefix}/{filename}" if prefix else filename
 
 
-def s3_upload_bytes(filename: str, data: bytes):
+def s3_upload_bytes(filename: str, data: bytes, notify: bool = True) -> bool:
     """
     업로드된 파일 바이트를 S3에 저장.
     filename: 로컬에서 사용하는 파일명을 그대로 넘기면 _s3_key로 S3 경로 변환.
+    재시도(adaptive)까지 실패하면 앱은 계속 동작하되, 대기열에 넣어 나중에 다시 올리고 화면에 알린다.
+    return: 업로드 성공 여부
     """
     if not s3_enabled():
-        return
+        return False
     client = get_s3_client()
     if not client:
-        return
+        return False
+
+    # CSV는 gzip으로 올리고 Content-Encoding 표시 (xlsx는 이미 zip 압축이라 그대로)
+    body, extra = data, {}
+    if filename.endswith(".csv"):
+        body = pack_bytes(data)
+        extra = {"ContentType": "text/csv; charset=utf-8", "ContentEncoding": "gzip"}
+
+    pending = _s3_pending_writes()
     try:
-        client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=_s3_key(filename),
-            Body=data,
-        )
-    except Exception:
-        # S3 오류가 나더라도 앱 전체는 죽지 않게 조용히 무시
-        pass
+        with _s3_timed("put_object"):
+            client.put_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=_s3_key(filename),
+                Body=body,
+                **extra,
+            )
+    except Exception as e:
+        with pending["lock"]:
+            pending["items"][filename] = data
+            pending["items"].move_to_end(filename)
+            pending["next_retry"] = time.time() + S3_RETRY_INTERVAL
+        if notify:
+            st.warning(
+                f"S3 저장 실패: {filename} ({type(e).__name__}). "
+                "세션/로컬에는 저장되었고, S3에는 잠시 후 다시 올립니다."
+            )
+        ok = False
+    else:
+        # 더 최신 내용이 올라갔으므로 대기 중인 이전 내용은 버린다
+        with pending["lock"]:
+            pending["items"].pop(filename, None)
+        ok = True
+
+    s3_metadata_snapshot.clear()
+    return ok
 
 
 def s3_download_bytes(filename: str):
     """
     S3에서 파일을 읽어와서 bytes로 반환.
-    없거나 오류면 None 반환.
+    없으면 None, 그 외 오류(타임아웃 등)는 화면에 알리고 None 반환.
     """
     if not s3_enabled():
         return None
@@ -121,609 +283,2500 @@ def s3_download_bytes(filename: str):
     if not client:
         return None
     try:
-        resp = client.get_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=_s3_key(filename),
-        )
-        return resp["Body"].read()
-    except Exception:
+        with _s3_timed("get_object"):
+            resp = client.get_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=_s3_key(filename),
+            )
+            return unpack_bytes(resp["Body"].read())
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+            st.warning(f"S3 읽기 실패: {filename} ({e.response.get('Error', {}).get('Code')})")
+        return None
+    except Exception as e:
+        st.warning(f"S3 읽기 실패: {filename} ({type(e).__name__})")
         return None
 
 
-# ==============================
-# 공통 유틸 (업로드/로컬/S3 겸용)
-# ==============================
-@st.cache_data(show_spinner=False)
-def _load_drums_core(bulk_bytes):
-    """bulk_drums_extended.csv 로드 (세션 업로드 > 로컬 > S3 순서)."""
-    # 1) 세션 업로드 우선
-    if bulk_bytes is not None:
-        try:
-            df = pd.read_csv(io.BytesIO(bulk_bytes))
-        except Exception as e:
-            st.error(f"업로드한 bulk_drums_extended.csv를 읽는 중 오류가 발생했습니다: {e}")
-            return pd.DataFrame(
-                columns=[
-                    "품목코드", "품명", "로트번호", "제품라인", "제조일자",
-                    "상태", "통번호", "통용량", "현재위치",
-                ]
-            )
+S3_ETAG_TTL = int(os.getenv("S3_ETAG_TTL", "30"))  # 초. 다른 곳에서 올린 S3 파일 확인 주기
 
-    # 2) 로컬
-    elif os.path.exists(CSV_PATH):
-        try:
-            df = pd.read_csv(CSV_PATH)
-        except Exception as e:
-            st.error(f"CSV 파일을 읽는 중 오류가 발생했습니다: {e}")
-            return pd.DataFrame(
-                columns=[
-                    "품목코드", "품명", "로트번호", "제품라인", "제조일자",
-                    "상태", "통번호", "통용량", "현재위치",
-                ]
-            )
 
-    # 3) S3
-    else:
-        s3_bytes = s3_download_bytes(CSV_PATH)
-        if s3_bytes is not None:
-            try:
-                df = pd.read_csv(io.BytesIO(s3_bytes))
-            except Exception as e:
-                st.error(f"S3의 bulk_drums_extended.csv를 읽는 중 오류가 발생했습니다: {e}")
-                return pd.DataFrame(
-                    columns=[
-                        "품목코드", "품명", "로트번호", "제품라인", "제조일자",
-                        "상태", "통번호", "통용량", "현재위치",
-                    ]
-                )
-        else:
-            return pd.DataFrame(
-                columns=[
-                    "품목코드", "품명", "로트번호", "제품라인", "제조일자",
-                    "상태", "통번호", "통용량", "현재위치",
-                ]
-            )
+@st.cache_data(show_spinner=False, ttl=S3_ETAG_TTL)
+def s3_metadata_snapshot() -> dict:
+    """
+    S3_PREFIX 바로 아래 파일들의 메타데이터를 목록 조회 1번으로 가져온다.
+    (하위 폴더 ledger_checkpoints/ 등은 제외)
+    return: {파일명: {"LastModified": datetime, "Size": int, "ETag": str}}
+    업로드 시간 표시 / has_data / ETag 확인이 모두 이 스냅샷을 같이 쓴다.
+    """
+    if not s3_enabled():
+        return {}
+    client = get_s3_client()
+    if not client:
+        return {}
+    prefix = _s3_key("")
+    meta = {}
+    try:
+        with _s3_timed("list_objects_v2"):
+            paginator = client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix, Delimiter="/"):
+                for obj in page.get("Contents", []):
+                    name = obj["Key"][len(prefix):]
+                    if name:
+                        meta[name] = {
+                            "LastModified": obj["LastModified"],
+                            "Size": obj["Size"],
+                            "ETag": obj["ETag"],
+                        }
+    except Exception:
+        return {}
+    return meta
 
-    # 필수 컬럼 체크
-    required_cols = [
-        "품목코드", "품명", "로트번호", "제품라인", "제조일자",
-        "상태", "통번호", "통용량", "현재위치",
-    ]
-    for c in required_cols:
-        if c not in df.columns:
-            st.error(f"CSV에 '{c}' 열이 없습니다. 엑셀에서 다시 추출해 주세요.")
-            return pd.DataFrame(columns=required_cols)
 
-    # 타입 보정
-    df["통번호"] = pd.to_numeric(df["통번호"], errors="coerce").fillna(0).astype(int)
-    df["통용량"] = pd.to_numeric(df["통용량"], errors="coerce").fillna(0.0).astype(float)
+def s3_etag(filename: str):
+    """S3 파일의 ETag (메타데이터 스냅샷 기준). 없으면 None."""
+    return s3_metadata_snapshot().get(filename, {}).get("ETag")
+
+
+def s3_list_objects(folder: str) -> dict:
+    """
+    S3의 folder(예: "ledger_checkpoints") 아래 {파일명: LastModified}.
+    없거나 오류면 빈 dict.
+    """
+    if not s3_enabled():
+        return {}
+    client = get_s3_client()
+    if not client:
+        return {}
+    prefix = _s3_key(folder.rstrip("/") + "/")
+    objects = {}
+    try:
+        with _s3_timed("list_objects_v2"):
+            paginator = client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    name = obj["Key"][len(prefix):]
+                    if name:
+                        objects[name] = obj["LastModified"]
+    except Exception:
+        return {}
+    return objects
+
+
+def s3_list_filenames(folder: str) -> list:
+    """S3의 folder 아래 파일명 목록. 없거나 오류면 빈 리스트."""
+    return list(s3_list_objects(folder))
+
+
+def s3_delete(filename: str):
+    """S3에서 파일 삭제 (없거나 오류면 조용히 무시)."""
+    if not s3_enabled():
+        return
+    client = get_s3_client()
+    if not client:
+        return
+    try:
+        with _s3_timed("delete_object"):
+            client.delete_object(Bucket=S3_BUCKET_NAME, Key=_s3_key(filename))
+    except Exception:
+        pass
+    s3_metadata_snapshot.clear()
 
-    # 현재위치 정규화
-    def norm_loc(x) -> str:
-        if pd.isna(x):
-            return ""
-        s = str(x).strip()
-        if not s:
-            return ""
 
-        # 특수 구역: 그대로 (보관 붙이면 안 됨)
-        if s in ["외주", "폐기", "소진", "창고"]:
-            return s
+DRUM_COLUMNS = [
+    "품목코드", "품명", "로트번호", "제품라인", "제조일자",
+    "상태", "통번호", "통용량", "현재위치",
+]
 
-        # 예전 데이터 호환: "4층-A1" -> "4층 A1"
-        if "-" in s:
-            s = s.replace("-", " ", 1).strip()
 
-        # 층만 들어온 경우 -> "X층 보관"
-        if s in ["2층", "4층", "5층", "6층"]:
-            return f"{s} 보관"
+def normalize_location(x) -> str:
+    """현재위치 정규화 (예전 데이터 호환 포함)."""
+    if pd.isna(x):
+        return ""
+    s = str(x).strip()
+    if not s:
+        return ""
 
+    # 특수 구역: 그대로 (보관 붙이면 안 됨)
+    if s in ["외주", "폐기", "소진", "창고"]:
         return s
 
-    df["현재위치"] = df["현재위치"].apply(norm_loc)
+    # 예전 데이터 호환: "4층-A1" -> "4층 A1"
+    if "-" in s:
+        s = s.replace("-", " ", 1).strip()
 
-    return df
+    # 층만 들어온 경우 -> "X층 보관"
+    if s in ["2층", "4층", "5층", "6층"]:
+        return f"{s} 보관"
 
+    return s
 
-def load_drums() -> pd.DataFrame:
-    """세션 상태를 감안해서 bulk DF를 가져오는 외부용 함수."""
-    ss = st.session_state
-    bulk_bytes = ss.get("bulk_csv_bytes", None)
-    return _load_drums_core(bulk_bytes)
 
+_MFG_DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",   # 엑셀 날짜 셀을 str()로 옮긴 경우
+    "%Y.%m.%d",
+    "%Y. %m. %d",
+    "%Y/%m/%d",
+    "%Y%m%d",
+]
 
-def save_drums(df: pd.DataFrame):
+
+@functools.lru_cache(maxsize=8192)
+def normalize_mfg_date(value: str) -> str:
     """
-    현재 DF를 bulk_drums_extended.csv로 저장.
-    - 세션 메모리(업로드 방식) 갱신
-    - 로컬 파일도 있으면 덮어쓰기 (로컬 실행용)
-    - S3에도 업로드
+    제조일자 문자열을 'YYYY-MM-DD'로 통일 (허용 포맷을 명시적으로 순서대로 시도).
+    어느 포맷에도 맞지 않으면 원래 문자열 그대로 반환.
     """
-    # 1) 세션 메모리 갱신
-    buf = io.BytesIO()
-    df.to_csv(buf, index=False, encoding="utf-8-sig")
-    data = buf.getvalue()
-    st.session_state["bulk_csv_bytes"] = data
+    s = str(value).strip()
+    if s.endswith(".0") and s[:-2].isdigit():   # CSV에서 20240115.0 처럼 읽힌 경우
+        s = s[:-2]
+    for fmt in _MFG_DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return s
 
-    # 캐시 무효화
-    _load_drums_core.clear()
 
-    # 2) 로컬 CSV로도 저장 (있으면)
-    try:
-        df.to_csv(CSV_PATH, index=False, encoding="utf-8-sig")
-    except Exception:
-        # Cloud 환경에서는 보통 권한/경로가 없으니 조용히 무시
-        pass
+def _normalize_mfg_dates(col: pd.Series) -> pd.Series:
+    """제조일자 컬럼 전체 정규화 (고유값 단위로만 파싱)."""
+    uniq = col.dropna().unique()
+    mapping = {v: normalize_mfg_date(v) for v in uniq}
+    return col.map(mapping).fillna("")
+
+
+def normalize_drums(df: pd.DataFrame) -> pd.DataFrame:
+    """통 원장 DF 타입 보정 + 현재위치/제조일자 정규화 (CSV/체크포인트 공통)."""
+    df["통번호"] = pd.to_numeric(df["통번호"], errors="coerce").fillna(0).astype(int)
+    df["통용량"] = pd.to_numeric(df["통용량"], errors="coerce").fillna(0.0).astype(float)
+    df["현재위치"] = df["현재위치"].apply(normalize_location)
+    df["제조일자"] = _normalize_mfg_dates(df["제조일자"])
+    return df
 
-    # 3) S3 업로드
-    s3_upload_bytes(CSV_PATH, data)
 
 # ==============================
-# 위치 카테고리 (지도/이동 공통)
+# 세션 파일 바이트 + 버전 토큰
+#  - 로더 캐시 키는 작은 버전 토큰(내용 해시)으로 하고 바이트는 따로 넘긴다
+#    (바이트를 인자로 넘기면 rerun마다 수 MB를 해시해야 캐시를 찾을 수 있음)
+#  - 토큰은 업로드/저장 시 한 번만 계산
 # ==============================
-FLOOR_ZONES = {
-    "2층": ["A", "B", "C", "D", "E", "보관"],
-    "4층": ["블리스터", "로터리", "덕용", "보관"],
-    "5층": ["기초", "덕용", "보관"],
-    "6층": ["스틱&파우치", "스킨팩", "보관"],
+def content_version(data):
+    """바이트 내용 해시 (없으면 None)."""
+    if data is None:
+        return None
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# 세션에 gzip으로 보관하는 CSV 키 (xlsx는 이미 압축되어 있어 제외)
+SESSION_GZIP_KEYS = {"bulk_csv_bytes", "move_log_csv_bytes", "archive_csv_bytes"}
+
+# 원장 파일 → 세션 키 (다른 세션/프로세스가 로컬 파일을 바꿨는지 확인하는 대상)
+LEDGER_SESSION_KEYS = {
+    CSV_PATH: "bulk_csv_bytes",
+    ARCHIVE_CSV: "archive_csv_bytes",
+    MOVE_LOG_CSV: "move_log_csv_bytes",
 }
-SPECIAL_AREAS = ["외주", "폐기", "소진", "창고"]  # 보관 붙이지 않음
 
-def location_picker(key_prefix: str) -> str:
+
+def set_session_bytes(sess_key: str, data: bytes):
+    """세션에 파일 바이트와 버전 토큰을 함께 저장. (토큰은 압축 전 내용 기준)"""
+    ss = st.session_state
+    ss[sess_key + "_ver"] = content_version(data)
+    ss[sess_key] = pack_bytes(data) if sess_key in SESSION_GZIP_KEYS else data
+    # 로컬 파일에 쓰기 전까지는 파일 버전과 비교하지 않는다 (persist_file이 다시 기록)
+    ss.pop(sess_key + "_disk", None)
+
+
+def drop_session_bytes(sess_key: str):
+    ss = st.session_state
+    for suffix in ["", "_ver", "_disk"]:
+        ss.pop(sess_key + suffix, None)
+
+
+def session_bytes(sess_key: str):
+    """세션 바이트를 원래 내용(평문)으로. 없으면 None."""
+    return unpack_bytes(st.session_state.get(sess_key, None))
+
+
+def local_file_version(path: str):
+    """로컬 파일 버전 토큰: mtime + 크기 (os.stat 1회). 파일이 없으면 None."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"local:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def backing_file_version(path: str):
     """
-    지도 탭과 동일한 카테고리로 '현재위치' 문자열을 만든다.
-    - 특수구역: 외주 / 폐기 / 소진 / 창고 → 그대로 반환
-    - 층 선택 시: 세부구역 선택, 없으면 '보관'
-    - 층 변경 시 세부구역 자동 리셋
+    세션 바이트가 없을 때의 버전 토큰 (로더와 같은 순서: 로컬 → S3).
+    - 로컬: mtime + 크기 (os.stat 1회)
+    - S3: ETag (S3_ETAG_TTL초 동안 캐시)
+    다른 프로세스/세션이 파일을 바꾸면 토큰이 바뀌어 다음 로드 때 다시 읽는다.
     """
+    version = local_file_version(path)
+    if version:
+        return version
+    etag = s3_etag(path)
+    return f"s3:{etag}" if etag else None
 
-    # 1️⃣ 최상위 선택 (층 + 특수구역 통합)
-    top_options = list(FLOOR_ZONES.keys()) + SPECIAL_AREAS
-
-    top_key = f"{key_prefix}_top"
-    zone_key = f"{key_prefix}_zone"
-    last_top_key = f"{key_prefix}_last_top"
 
-    top = st.selectbox(
-        "이동하실 위치를 선택해 주세요.",
-        top_options,
-        key=top_key,
-    )
+def session_source(sess_key: str, path: str):
+    """
+    (버전 토큰, 바이트).
+    세션 바이트가 없으면 (파일 버전 토큰, None) → 로컬/S3에서 로드.
+    세션 바이트를 로컬에 쓴 뒤 다른 세션/프로세스(scan_intake, bulk_cli)가 파일을 바꿨으면
+    세션 바이트를 버리고 파일을 다시 읽는다 (오래된 원장/이력으로 덮어쓰지 않도록).
+    토큰이 없는 예전 세션 값이면 이때 한 번만 계산해 둔다.
+    """
+    ss = st.session_state
+    data = ss.get(sess_key, None)
+    disk = ss.get(sess_key + "_disk")
+    if data is not None and disk is not None and local_file_version(path) != disk:
+        drop_session_bytes(sess_key)
+        data = None
+    if data is None:
+        return backing_file_version(path), None
+    version = ss.get(sess_key + "_ver", None)
+    if version is None:
+        version = content_version(data)
+        ss[sess_key + "_ver"] = version
+    return version, data
 
-    # 2️⃣ 특수구역이면 바로 반환
-    if top in SPECIAL_AREAS:
-        return top
 
-    # 3️⃣ 층이 바뀌면 세부구역 선택값 리셋
-    prev_top = st.session_state.get(last_top_key)
-    if prev_top != top:
-        st.session_state.pop(zone_key, None)
-        st.session_state[last_top_key] = top
+# ==============================
+# 파일 잠금 (같은 데이터 폴더를 쓰는 프로세스 간: 앱 / bulk_cli / scan_intake)
+#  - path + ".lock" 파일에 fcntl 배타 잠금, 같은 프로세스 안에서는 스레드 간 RLock
+#  - 같은 스레드는 다시 잡을 수 있다 (잠금 파일은 가장 바깥에서만 잠그고 푼다)
+#  - 잠금 파일을 만들 수 없는 환경(읽기 전용 디스크, Windows)에서는 프로세스 안 잠금만
+# ==============================
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-    # 4️⃣ 세부구역 선택
-    zones = FLOOR_ZONES.get(top, ["보관"])
-    zone = st.selectbox(
-        "세부구역 선택",
-        zones,
-        key=zone_key,
-    )
 
-    # 5️⃣ fallback
-    z = (zone or "").strip()
-    if not z:
-        z = "보관"
+@st.cache_resource(show_spinner=False)
+def _file_locks() -> dict:
+    return {"lock": threading.Lock(), "by_path": {}}
 
-    return f"{top} {z}"
 
+@contextlib.contextmanager
+def file_lock(path: str):
+    registry = _file_locks()
+    with registry["lock"]:
+        state = registry["by_path"].setdefault(path, {"lock": threading.RLock(), "depth": 0, "file": None})
 
-@st.cache_data(show_spinner=False)
-def _load_production_core(prod_bytes):
-    if prod_bytes is not None:
-        try:
-            df = pd.read_excel(io.BytesIO(prod_bytes))
-        except Exception:
-            return pd.DataFrame()
-    elif os.path.exists(PRODUCTION_FILE):
-        try:
-            df = pd.read_excel(PRODUCTION_FILE)
-        except Exception:
-            return pd.DataFrame()
-    else:
-        # 로컬도 없으면 S3 시도
-        s3_bytes = s3_download_bytes(PRODUCTION_FILE)
-        if s3_bytes is not None:
+    with state["lock"]:
+        if state["depth"] == 0 and fcntl is not None:
             try:
-                df = pd.read_excel(io.BytesIO(s3_bytes))
-            except Exception:
-                return pd.DataFrame()
-        else:
-            return pd.DataFrame()
+                f = open(path + ".lock", "a")
+            except OSError:
+                f = None
+            if f is not None:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    state["file"] = f
+                except OSError:
+                    f.close()
+        state["depth"] += 1
+        try:
+            yield
+        finally:
+            state["depth"] -= 1
+            if state["depth"] == 0 and state["file"] is not None:
+                state["file"].close()   # 닫으면 잠금도 풀린다
+                state["file"] = None
 
-    required = ["작업번호", "품번", "품명", "LOTNO", "지시수량", "제조량", "작업일자"]
-    for c in required:
-        if c not in df.columns:
-            return pd.DataFrame()
-    return df[required].copy()
 
+def ledger_lock():
+    """원장/보관 원장/이동 이력의 읽기 → 계산 → 쓰기를 다른 세션/프로세스와 겹치지 않게 묶는다."""
+    return file_lock(LEDGER_LOCK_PATH)
 
-def load_production():
-    ss = st.session_state
-    prod_bytes = ss.get("prod_xlsx_bytes", None)
-    return _load_production_core(prod_bytes)
 
+# ==============================
+# 이동 이력 WAL (로컬 append-only 저널) + 백그라운드 저장
+#  - 이력 행을 WAL에 한 줄(JSON)로 쓰고 fsync한 뒤 사용자에게 완료 표시
+#  - 원장/이력 CSV의 로컬 파일은 원장 잠금 안에서 바로 쓰고 (다른 프로세스가 최신 파일을 보도록)
+#    S3 반영은 백그라운드 스레드가 순서대로 처리 (같은 파일이 여러 번 쌓이면 마지막 내용만 저장)
+#  - WAL 쓰기/정리는 WAL 파일 잠금으로 프로세스 간에도 한 번에 하나씩
+#  - 이력이 로컬/S3에 반영되면 해당 WAL 기록을 정리
+#  - 프로세스 시작 후 첫 세션에서 WAL에 남은 기록(반영 전 종료)을 이력에 다시 넣는다
+# ==============================
+WAL_PATH = "bulk_move_log.wal"
 
-@st.cache_data(show_spinner=False)
-def _load_receive_core(recv_bytes):
+
+@st.cache_resource(show_spinner=False)
+def _wal_state() -> dict:
+    return {"recovered": False}
+
+
+def wal_append(rows: pd.DataFrame, commit_id: str) -> bool:
+    """이력 행을 WAL에 기록하고 fsync. 디스크에 쓸 수 없으면 False."""
+    record = {"커밋ID": commit_id, "rows": json.loads(rows.to_json(orient="records", force_ascii=False))}
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    try:
+        with file_lock(WAL_PATH):
+            with open(WAL_PATH, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+    except Exception:
+        return False
+    return True
+
+
+def wal_records() -> list:
+    """WAL 기록 목록. (쓰다 만 마지막 줄은 건너뜀)"""
+    if not os.path.exists(WAL_PATH):
+        return []
+    records = []
+    try:
+        with open(WAL_PATH, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except Exception:
+        return []
+    return records
+
+
+def _wal_rewrite(keep):
+    """WAL 기록을 keep(기록 목록) 결과로 교체 (남는 기록이 없으면 파일 삭제)."""
+    with file_lock(WAL_PATH):
+        remaining = keep(wal_records())
+        try:
+            if not remaining:
+                if os.path.exists(WAL_PATH):
+                    os.remove(WAL_PATH)
+                return
+            tmp = WAL_PATH + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for r in remaining:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, WAL_PATH)
+        except Exception:
+            pass
+
+
+def _wal_trim(persisted_ids: set):
+    """이미 이력 파일에 반영된 커밋의 WAL 기록 제거."""
+    _wal_rewrite(lambda records: [r for r in records if r.get("커밋ID") not in persisted_ids])
+
+
+def _wal_row_key(lot, drum) -> tuple:
+    return str(lot).strip().lower(), pd.to_numeric(drum, errors="coerce")
+
+
+def wal_discard(rows: pd.DataFrame):
+    """
+    롤백으로 이력에서 지운 행을 WAL 기록에서도 뺀다.
+    (이력 저장 전에 종료되거나 커밋과 롤백이 한 번에 저장되면 복구 때 다시 살아나므로)
+    """
+    if not os.path.exists(WAL_PATH) or "커밋ID" not in rows.columns:
+        return
+    removed = {}
+    for cid, lot, drum in zip(rows["커밋ID"], rows["로트번호"], rows["통번호"]):
+        if pd.notna(cid):
+            removed.setdefault(str(cid), set()).add(_wal_row_key(lot, drum))
+    if not removed:
+        return
+
+    def keep(records):
+        out = []
+        for r in records:
+            gone = removed.get(r.get("커밋ID"))
+            if gone:
+                r = dict(r, rows=[
+                    row for row in r.get("rows", [])
+                    if _wal_row_key(row.get("로트번호"), row.get("통번호")) not in gone
+                ])
+                if not r["rows"]:
+                    continue
+            out.append(r)
+        return out
+
+    _wal_rewrite(keep)
+
+
+def wal_clear():
+    """WAL 기록 전부 삭제 (백업 복원처럼 이력을 통째로 바꿀 때)."""
+    _wal_rewrite(lambda records: [])
+
+
+def _write_local_atomic(path: str, data: bytes) -> bool:
+    try:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return True
+    except Exception:
+        # Cloud 환경에서는 보통 권한/경로가 없으니 조용히 무시
+        return False
+
+
+def _persist_now(filename: str, data: bytes, local_ok: bool):
+    """
+    S3 저장. 이동 이력이면 반영된 커밋의 WAL 기록 정리.
+    로컬에 써 둔 파일이면 그 사이 다른 프로세스가 더 새 내용을 썼을 수 있으므로 로컬 파일을 올린다.
+    """
+    if local_ok:
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            pass
+    s3_ok = s3_upload_bytes(filename, data, notify=False) if s3_enabled() else local_ok
+    if filename == MOVE_LOG_CSV and s3_ok and os.path.exists(WAL_PATH):
+        try:
+            ids = pd.read_csv(io.BytesIO(data), usecols=["커밋ID"])["커밋ID"]
+            _wal_trim(set(ids.dropna().astype(str)))
+        except Exception:
+            pass
+
+
+def _persist_loop(jobs: queue.Queue):
+    while True:
+        batch = [jobs.get()]
+        while True:
+            try:
+                batch.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+
+        latest = OrderedDict()
+        for filename, data, local_ok in batch:
+            latest[filename] = (data, local_ok)
+            latest.move_to_end(filename)
+        for filename, (data, local_ok) in latest.items():
+            try:
+                _persist_now(filename, data, local_ok)
+            except Exception:
+                pass
+
+        for _ in batch:
+            jobs.task_done()
+
+
+@st.cache_resource(show_spinner=False)
+def _persist_queue() -> queue.Queue:
+    jobs = queue.Queue()
+    threading.Thread(target=_persist_loop, args=(jobs,), daemon=True, name="bulk-persist").start()
+    return jobs
+
+
+def persist_file(filename: str, data: bytes):
+    """
+    원장/이력 CSV 저장: 로컬 파일은 원장 잠금 안에서 바로 쓰고, S3 업로드는 백그라운드 큐로. (같은 파일은 순서 보장)
+    세션 바이트와 같은 내용을 썼으면 그때의 파일 버전을 세션에 남긴다 → 다른 세션/프로세스가
+    파일을 바꾸면 session_source가 세션 바이트를 버리고 다시 읽는다.
+    """
+    ss = st.session_state
+    with ledger_lock():
+        local_ok = _write_local_atomic(filename, data)
+        sess_key = LEDGER_SESSION_KEYS.get(filename)
+        if local_ok and sess_key and ss.get(sess_key + "_ver") == content_version(data):
+            ss[sess_key + "_disk"] = local_file_version(filename)
+    _persist_queue().put((filename, data, local_ok))
+
+
+def wait_for_persist():
+    """대기 중인 백그라운드 저장이 모두 끝날 때까지 대기 (CLI/종료 직전용)."""
+    _persist_queue().join()
+
+
+def recover_move_log_wal() -> int:
+    """
+    WAL에는 있는데 이동 이력에 없는 커밋(반영 전 종료)을 이력 뒤에 다시 붙인다.
+    프로세스당 1번만 실행. return: 복구한 행 수
+    """
+    state = _wal_state()
+    if state["recovered"]:
+        return 0
+    state["recovered"] = True
+
+    with ledger_lock():
+        records = wal_records()
+        if not records:
+            return 0
+
+        log_df = load_move_log()
+        known = set(log_df["커밋ID"].dropna().astype(str))
+        missing = [row for r in records if r.get("커밋ID") not in known for row in r.get("rows", [])]
+
+        if missing:
+            log_df = pd.concat([log_df, pd.DataFrame(missing)], ignore_index=True)[MOVE_LOG_COLUMNS]
+            _load_move_log_core.clear()
+
+        buf = io.BytesIO()
+        log_df.to_csv(buf, index=False, encoding="utf-8-sig")
+        data = buf.getvalue()
+        if missing:
+            set_session_bytes("move_log_csv_bytes", data)
+        # 반영된 기록은 저장이 끝나면 WAL에서 정리된다
+        persist_file(MOVE_LOG_CSV, data)
+    return len(missing)
+
+
+# ==============================
+# 로더 캐시 (LRU + 데이터셋별 용량 제한 + 통계)
+#  - st.cache_data는 항목 수/메모리 제한이 없어 업로드·저장 버전마다 DF가 계속 쌓인다
+#  - 데이터셋별로 max_entries / max_mb를 넘으면 가장 오래 안 쓴 항목부터 제거
+#  - hit / miss / eviction / 상주 바이트는 데이터 탭의 캐시 상태 패널에서 확인
+# ==============================
+def _value_nbytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return 0
+
+
+class LoaderCache:
+    """
+    _load_*_core 전용 프로세스 공용 LRU 캐시.
+    인자 중 '_'로 시작하는 것은 키에서 제외 (st.cache_data와 같은 규칙).
+    DataFrame은 공유 객체이므로 꺼낼 때마다 복사본을 돌려준다.
+    """
+
+    def __init__(self, func, name: str, max_entries: int, max_mb: float):
+        self.func = func
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()   # key → (value, nbytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.params = list(inspect.signature(func).parameters)
+        functools.update_wrapper(self, func)
+
+    def _key(self, args, kwargs):
+        bound = dict(zip(self.params, args))
+        bound.update(kwargs)
+        return tuple((k, bound[k]) for k in self.params if k in bound and not k.startswith("_"))
+
+    def __call__(self, *args, **kwargs):
+        key = self._key(args, kwargs)
+        with self.lock:
+            hit = self.entries.get(key)
+            if hit is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                value = hit[0]
+            else:
+                self.misses += 1
+        if hit is None:
+            value = self.func(*args, **kwargs)
+            with self.lock:
+                self.entries[key] = (value, _value_nbytes(value))
+                self.entries.move_to_end(key)
+                self._evict()
+        return value.copy() if isinstance(value, pd.DataFrame) else value
+
+    def _evict(self):
+        """항목 수 / 용량 초과분을 오래된 순서로 제거 (가장 최근 항목 1개는 항상 유지)."""
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_entries or self.resident_bytes() > self.max_bytes
+        ):
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def resident_bytes(self) -> int:
+        return sum(nbytes for _, nbytes in self.entries.values())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "캐시": self.name,
+                "항목 수": len(self.entries),
+                "최대 항목": self.max_entries,
+                "상주 MB": round(self.resident_bytes() / 1024 / 1024, 2),
+                "한도 MB": round(self.max_bytes / 1024 / 1024, 1),
+                "hit": self.hits,
+                "miss": self.misses,
+                "hit율(%)": round(self.hits / total * 100, 1) if total else None,
+                "eviction": self.evictions,
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def _loader_cache_registry() -> dict:
+    """이름 → LoaderCache. 스크립트가 rerun마다 다시 실행되어도 프로세스 안에서 유지된다."""
+    return {}
+
+
+def loader_cache(name: str, max_entries: int, max_mb: float):
+    """@loader_cache("bulk_drums", max_entries=4, max_mb=64) 형태로 _load_*_core에 사용."""
+
+    def decorator(func):
+        registry = _loader_cache_registry()
+        cache = registry.get(name)
+        if cache is None:
+            cache = LoaderCache(func, name, max_entries, max_mb)
+            registry[name] = cache
+        else:
+            # rerun 때 새로 정의된 함수로 교체 (코드가 바뀌었으면 기존 항목은 버림)
+            if cache.func.__code__.co_code != func.__code__.co_code:
+                cache.clear()
+            cache.func = func
+            cache.max_entries = max_entries
+            cache.max_bytes = int(max_mb * 1024 * 1024)
+        return cache
+
+    return decorator
+
+
+def loader_cache_stats() -> pd.DataFrame:
+    return pd.DataFrame([c.stats() for c in _loader_cache_registry().values()])
+
+
+# ==============================
+# 공통 유틸 (업로드/로컬/S3 겸용)
+# ==============================
+@loader_cache("bulk_drums", max_entries=4, max_mb=64)
+def _load_drums_core(version, _bulk_bytes):
+    """
+    bulk_drums_extended.csv 로드 (세션 업로드 > 로컬 > S3 순서).
+    version: 세션 바이트의 버전 토큰 (캐시 키). _bulk_bytes는 해시하지 않는다.
+    """
+    bulk_bytes = unpack_bytes(_bulk_bytes)
+    # 1) 세션 업로드 우선
+    if bulk_bytes is not None:
+        try:
+            df = pd.read_csv(io.BytesIO(bulk_bytes))
+        except Exception as e:
+            st.error(f"업로드한 bulk_drums_extended.csv를 읽는 중 오류가 발생했습니다: {e}")
+            return pd.DataFrame(
+                columns=[
+                    "품목코드", "품명", "로트번호", "제품라인", "제조일자",
+                    "상태", "통번호", "통용량", "현재위치",
+                ]
+            )
+
+    # 2) 로컬
+    elif os.path.exists(CSV_PATH):
+        try:
+            df = pd.read_csv(CSV_PATH)
+        except Exception as e:
+            st.error(f"CSV 파일을 읽는 중 오류가 발생했습니다: {e}")
+            return pd.DataFrame(
+                columns=[
+                    "품목코드", "품명", "로트번호", "제품라인", "제조일자",
+                    "상태", "통번호", "통용량", "현재위치",
+                ]
+            )
+
+    # 3) S3
+    else:
+        s3_bytes = s3_download_bytes(CSV_PATH)
+        if s3_bytes is not None:
+            try:
+                df = pd.read_csv(io.BytesIO(s3_bytes))
+            except Exception as e:
+                st.error(f"S3의 bulk_drums_extended.csv를 읽는 중 오류가 발생했습니다: {e}")
+                return pd.DataFrame(
+                    columns=[
+                        "품목코드", "품명", "로트번호", "제품라인", "제조일자",
+                        "상태", "통번호", "통용량", "현재위치",
+                    ]
+                )
+        else:
+            return pd.DataFrame(
+                columns=[
+                    "품목코드", "품명", "로트번호", "제품라인", "제조일자",
+                    "상태", "통번호", "통용량", "현재위치",
+                ]
+            )
+
+    # 필수 컬럼 체크
+    for c in DRUM_COLUMNS:
+        if c not in df.columns:
+            st.error(f"CSV에 '{c}' 열이 없습니다. 엑셀에서 다시 추출해 주세요.")
+            return pd.DataFrame(columns=DRUM_COLUMNS)
+
+    return normalize_drums(df)
+
+
+def load_drums() -> pd.DataFrame:
+    """세션 상태를 감안해서 bulk DF를 가져오는 외부용 함수."""
+    return _load_drums_core(*session_source("bulk_csv_bytes", CSV_PATH))
+
+
+def save_drums(df: pd.DataFrame):
+    """
+    현재 DF를 bulk_drums_extended.csv로 저장.
+    - 세션 메모리(업로드 방식) 갱신
+    - 로컬 파일도 있으면 덮어쓰기 (로컬 실행용)
+    - S3에도 업로드
+    """
+    # 1) 세션 메모리 갱신
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8-sig")
+    data = buf.getvalue()
+    set_session_bytes("bulk_csv_bytes", data)
+
+    # 캐시 무효화
+    _load_drums_core.clear()
+
+    # 2) 로컬 CSV + S3 저장은 백그라운드로
+    #    (원장은 이동 이력에서 다시 만들 수 있으므로 WAL은 이력 쪽만 쓴다)
+    persist_file(CSV_PATH, data)
+
+    # 4) 이벤트가 충분히 쌓였으면 체크포인트
+    maybe_write_checkpoint(df)
+
+# ==============================
+# 보관 원장 (소진/폐기/0kg 통, cold tier)
+#  - 소진된 통은 bulk_drums_extended.csv(작업 원장)에서 bulk_drums_archive.csv로 옮긴다
+#  - 작업 원장은 실물 재고만 남아서 로드/검색/지도/저장이 가벼워진다
+#  - 보관 원장은 '용량 0 포함' 조회, 과거 시점 복원, 체크포인트에서만 함께 읽는다
+#  - 체크포인트는 두 원장을 합친 전체 원장으로 저장 (이동 이력 재생 기준이 바뀌지 않도록)
+# ==============================
+ARCHIVE_AFTER_DAYS = os.getenv("ARCHIVE_AFTER_DAYS", "")  # 값이 있으면 세션 시작 시 자동 보관 (N일 지난 소진 통)
+
+
+@loader_cache("archive", max_entries=2, max_mb=64)
+def _load_archive_core(version, _archive_bytes):
+    archive_bytes = unpack_bytes(_archive_bytes)
+    try:
+        if archive_bytes is not None:
+            df = pd.read_csv(io.BytesIO(archive_bytes))
+        elif os.path.exists(ARCHIVE_CSV):
+            df = pd.read_csv(ARCHIVE_CSV)
+        else:
+            s3_bytes = s3_download_bytes(ARCHIVE_CSV)
+            if s3_bytes is None:
+                return pd.DataFrame(columns=DRUM_COLUMNS)
+            df = pd.read_csv(io.BytesIO(s3_bytes))
+    except Exception as e:
+        st.error(f"보관 원장({ARCHIVE_CSV})을 읽는 중 오류가 발생했습니다: {e}")
+        return pd.DataFrame(columns=DRUM_COLUMNS)
+
+    for c in DRUM_COLUMNS:
+        if c not in df.columns:
+            return pd.DataFrame(columns=DRUM_COLUMNS)
+    return normalize_drums(df)
+
+
+def load_archive() -> pd.DataFrame:
+    return _load_archive_core(*session_source("archive_csv_bytes", ARCHIVE_CSV))
+
+
+def save_archive(df: pd.DataFrame):
+    buf = io.BytesIO()
+    df[DRUM_COLUMNS].to_csv(buf, index=False, encoding="utf-8-sig")
+    data = buf.getvalue()
+    set_session_bytes("archive_csv_bytes", data)
+    _load_archive_core.clear()
+    persist_file(ARCHIVE_CSV, data)
+
+
+def consumed_mask(df: pd.DataFrame) -> pd.Series:
+    """소진/폐기 위치이거나 0kg인 통."""
+    return df["현재위치"].isin(["소진", "폐기"]) | (df["통용량"] <= 0)
+
+
+def with_archive(hot: pd.DataFrame, archive: pd.DataFrame = None) -> pd.DataFrame:
+    """작업 원장 + 보관 원장 = 전체 원장. (같은 통이 양쪽에 있으면 작업 원장 우선)"""
+    if archive is None:
+        archive = load_archive()
+    if archive.empty:
+        return hot
+    archive = archive[~_drum_keys(archive).isin(_drum_keys(hot))]
+    return pd.concat([hot, archive[DRUM_COLUMNS]], ignore_index=True)
+
+
+def load_all_drums() -> pd.DataFrame:
+    return with_archive(load_drums())
+
+
+def save_ledger(full: pd.DataFrame):
+    """
+    전체 원장을 작업/보관 원장으로 나눠 저장.
+    보관 원장에 있던 통은 여전히 소진 상태일 때만 보관 쪽에 남기고,
+    다시 살아난 통(롤백 등)은 작업 원장으로 돌려놓는다.
+    """
+    full = full.drop(columns=["lot_lower"], errors="ignore")
+    archive = load_archive()
+    in_archive = _drum_keys(full).isin(_drum_keys(archive)) & consumed_mask(full).to_numpy()
+
+    cold = full[in_archive].reset_index(drop=True)
+    hot = full[~in_archive].reset_index(drop=True)
+    if not _same_ledger(cold, archive):
+        save_archive(cold)
+    save_drums(hot)
+
+
+def _last_event_times(log_df: pd.DataFrame) -> pd.Series:
+    """통 키 (소문자 로트번호, 통번호) → 마지막 이동 이력 시간."""
+    ev = _prepare_events(log_df)
+    ev["_time"] = _move_log_times(ev)
+    return ev.groupby(["_lot", "_drum"])["_time"].max()
+
+
+def archive_consumed_drums(days: int = 0) -> int:
+    """
+    작업 원장의 소진 통 중 마지막 이력이 days일 이상 지난 통을 보관 원장으로 옮긴다.
+    return: 옮긴 통 수
+    """
+    with ledger_lock():
+        hot = load_drums()
+        if hot.empty:
+            return 0
+
+        mask = consumed_mask(hot)
+        if days > 0 and mask.any():
+            last = _last_event_times(load_move_log())
+            pos = last.index.get_indexer(_drum_keys(hot))
+            times = pd.Series(pd.NaT, index=hot.index, dtype="datetime64[ns]")
+            found = pos >= 0
+            times[found] = last.to_numpy()[pos[found]]
+            cutoff = pd.Timestamp(datetime.now(KST).replace(tzinfo=None)) - pd.Timedelta(days=days)
+            # 이력이 없는 통은 오래된 것으로 본다
+            mask &= times.isna() | (times <= cutoff)
+
+        n = int(mask.sum())
+        if n == 0:
+            return 0
+
+        # 보관 원장 먼저 저장 (중간에 끊겨도 통이 사라지지 않도록)
+        archive = load_archive()
+        moved = hot[mask]
+        archive = archive[~_drum_keys(archive).isin(_drum_keys(moved))]
+        save_archive(pd.concat([archive, moved[DRUM_COLUMNS]], ignore_index=True))
+        save_drums(hot[~mask].reset_index(drop=True))
+    return n
+
+
+def rerun_tab():
+    """
+    탭(fragment) 안에서 호출: 탭만 단독 실행 중이면 해당 탭만,
+    앱 전체 실행 중이면(탭 전환 직후 등) 앱 전체를 다시 실행.
+    """
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+# ==============================
+# 위치 카테고리 (지도/이동 공통)
+# ==============================
+FLOOR_ZONES = {
+    "2층": ["A", "B", "C", "D", "E", "보관"],
+    "4층": ["블리스터", "로터리", "덕용", "보관"],
+    "5층": ["기초", "덕용", "보관"],
+    "6층": ["스틱&파우치", "스킨팩", "보관"],
+}
+SPECIAL_AREAS = ["외주", "폐기", "소진", "창고"]  # 보관 붙이지 않음
+
+
+def known_locations(df: pd.DataFrame) -> set:
+    """이동 위치로 받을 수 있는 값: 위치 선택 목록(층 세부구역 + 특수구역) + 원장에서 이미 쓰고 있는 위치."""
+    known = {f"{floor} {zone}" for floor, zones in FLOOR_ZONES.items() for zone in zones}
+    known.update(SPECIAL_AREAS)
+    known.update(df["현재위치"].dropna().astype(str))
+    known.discard("")
+    return known
+
+
+def location_picker(key_prefix: str) -> str:
+    """
+    지도 탭과 동일한 카테고리로 '현재위치' 문자열을 만든다.
+    - 특수구역: 외주 / 폐기 / 소진 / 창고 → 그대로 반환
+    - 층 선택 시: 세부구역 선택, 없으면 '보관'
+    - 층 변경 시 세부구역 자동 리셋
+    """
+
+    # 1️⃣ 최상위 선택 (층 + 특수구역 통합)
+    top_options = list(FLOOR_ZONES.keys()) + SPECIAL_AREAS
+
+    top_key = f"{key_prefix}_top"
+    zone_key = f"{key_prefix}_zone"
+    last_top_key = f"{key_prefix}_last_top"
+
+    top = st.selectbox(
+        "이동하실 위치를 선택해 주세요.",
+        top_options,
+        key=top_key,
+    )
+
+    # 2️⃣ 특수구역이면 바로 반환
+    if top in SPECIAL_AREAS:
+        return top
+
+    # 3️⃣ 층이 바뀌면 세부구역 선택값 리셋
+    prev_top = st.session_state.get(last_top_key)
+    if prev_top != top:
+        st.session_state.pop(zone_key, None)
+        st.session_state[last_top_key] = top
+
+    # 4️⃣ 세부구역 선택
+    zones = FLOOR_ZONES.get(top, ["보관"])
+    zone = st.selectbox(
+        "세부구역 선택",
+        zones,
+        key=zone_key,
+    )
+
+    # 5️⃣ fallback
+    z = (zone or "").strip()
+    if not z:
+        z = "보관"
+
+    return f"{top} {z}"
+
+
+# ==============================
+# 큰 표 공통: 서버 측 정렬/검색/페이지 + 표시 컬럼만 전송
+# ==============================
+def _arrow_nbytes(df: pd.DataFrame) -> int:
+    """브라우저로 보내는 Arrow 데이터 크기(추정, bytes)."""
+    try:
+        import pyarrow as pa
+        return int(pa.Table.from_pandas(df, preserve_index=False).nbytes)
+    except Exception:
+        return int(df.memory_usage(deep=True).sum())
+
+
+def paged_table(
+    df: pd.DataFrame,
+    key: str,
+    columns: list = None,
+    default_sort: list = None,
+    ascending: bool = True,
+    page_size: int = 50,
+):
+    """
+    큰 결과 표를 서버에서 정렬/검색/페이지 나눈 뒤, 현재 페이지 + 선택 컬럼만 st.dataframe으로 보낸다.
+    - columns: 기본 표시 컬럼 (사용자가 표 옵션에서 줄이거나 늘릴 수 있음)
+    - default_sort: '(기본)' 정렬일 때 사용할 컬럼 목록
+    - 하단 캡션에 이번 전송 크기(Arrow)와 전체를 보냈을 때의 추정치를 표시
+    """
+    all_cols = [c for c in df.columns if c != "lot_lower"]
+    base_cols = [c for c in (columns or all_cols) if c in df.columns]
+
+    with st.expander("표 옵션 (컬럼 / 정렬 / 표 내 검색)", expanded=False):
+        visible = st.multiselect(
+            "표시할 컬럼",
+            all_cols,
+            default=base_cols,
+            key=f"{key}_cols",
+        ) or base_cols
+
+        col_s, col_d, col_f = st.columns([2, 1, 2])
+        with col_s:
+            sort_col = st.selectbox("정렬 기준", ["(기본)"] + visible, key=f"{key}_sort")
+        with col_d:
+            desc = st.toggle("내림차순", value=not ascending, key=f"{key}_desc")
+        with col_f:
+            table_q = st.text_input("표 내 검색", key=f"{key}_filter")
+
+    view = df
+    if table_q:
+        q = table_q.strip()
+        mask = pd.Series(False, index=view.index)
+        for c in visible:
+            mask |= view[c].astype(str).str.contains(q, case=False, regex=False, na=False)
+        view = view[mask]
+
+    if sort_col != "(기본)":
+        view = view.sort_values(sort_col, ascending=not desc, kind="stable")
+    elif default_sort:
+        sort_cols = [c for c in default_sort if c in view.columns]
+        if sort_cols:
+            view = view.sort_values(sort_cols, ascending=not desc, kind="stable")
+
+    total_rows = len(view)
+    total_pages = max(1, math.ceil(total_rows / page_size))
+
+    page_key = f"{key}_page"
+    page = min(max(1, int(st.session_state.get(page_key, 1))), total_pages)
+    st.session_state[page_key] = page
+
+    start = (page - 1) * page_size
+    page_df = view.iloc[start:start + page_size][visible]
+
+    st.dataframe(page_df, use_container_width=True, hide_index=True)
+
+    col_p, col_info = st.columns([1, 4])
+    with col_p:
+        if total_pages > 1:
+            st.number_input(
+                "페이지",
+                min_value=1,
+                max_value=total_pages,
+                step=1,
+                key=page_key,
+                label_visibility="collapsed",
+            )
+    with col_info:
+        sent = _arrow_nbytes(page_df)
+        full_est = sent * total_rows / max(len(page_df), 1) * len(all_cols) / max(len(visible), 1)
+        st.caption(
+            f"페이지 {page} / {total_pages} · 총 {total_rows}건 · "
+            f"전송 {sent / 1024:.1f}KB (전체 전송 시 약 {full_est / 1024:.1f}KB)"
+        )
+
+
+@loader_cache("production", max_entries=2, max_mb=32)  # 현재 + 직전 버전 (재업로드 비교용)
+def _load_production_core(version, _prod_bytes):
+    prod_bytes = _prod_bytes
+    if prod_bytes is not None:
+        try:
+            df = pd.read_excel(io.BytesIO(prod_bytes))
+        except Exception:
+            return pd.DataFrame()
+    elif os.path.exists(PRODUCTION_FILE):
+        try:
+            df = pd.read_excel(PRODUCTION_FILE)
+        except Exception:
+            return pd.DataFrame()
+    else:
+        # 로컬도 없으면 S3 시도
+        s3_bytes = s3_download_bytes(PRODUCTION_FILE)
+        if s3_bytes is not None:
+            try:
+                df = pd.read_excel(io.BytesIO(s3_bytes))
+            except Exception:
+                return pd.DataFrame()
+        else:
+            return pd.DataFrame()
+
+    required = ["작업번호", "품번", "품명", "LOTNO", "지시수량", "제조량", "작업일자"]
+    for c in required:
+        if c not in df.columns:
+            return pd.DataFrame()
+    return df[required].copy()
+
+
+def load_production():
+    return _load_production_core(*session_source("prod_xlsx_bytes", PRODUCTION_FILE))
+
+
+@loader_cache("receive", max_entries=2, max_mb=32)  # 현재 + 직전 버전 (재업로드 비교용)
+def _load_receive_core(version, _recv_bytes):
+    recv_bytes = _recv_bytes
     if recv_bytes is not None:
         try:
-            df = pd.read_excel(io.BytesIO(recv_bytes))
+            df = pd.read_excel(io.BytesIO(recv_bytes))
+        except Exception as e:
+            st.error(f"receive.xlsx 파일(업로드)을 읽는 중 오류가 발생했습니다: {e}")
+            return pd.DataFrame()
+    elif os.path.exists(RECEIVE_FILE):
+        try:
+            df = pd.read_excel(RECEIVE_FILE)
+        except Exception as e:
+            st.error(f"receive.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
+            return pd.DataFrame()
+    else:
+        s3_bytes = s3_download_bytes(RECEIVE_FILE)
+        if s3_bytes is not None:
+            try:
+                df = pd.read_excel(io.BytesIO(s3_bytes))
+            except Exception as e:
+                st.error(f"S3의 receive.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
+                return pd.DataFrame()
+        else:
+            return pd.DataFrame()
+    return df
+
+
+def load_receive():
+    return _load_receive_core(*session_source("recv_xlsx_bytes", RECEIVE_FILE))
+
+
+@loader_cache("stock", max_entries=2, max_mb=32)  # 현재 + 직전 버전 (재업로드 비교용)
+def _load_stock_core(version, _stock_bytes):
+    stock_bytes = _stock_bytes
+    if stock_bytes is not None:
+        try:
+            df = pd.read_excel(io.BytesIO(stock_bytes))
         except Exception as e:
-            st.error(f"receive.xlsx 파일(업로드)을 읽는 중 오류가 발생했습니다: {e}")
+            st.error(f"stock.xlsx 파일(업로드)을 읽는 중 오류가 발생했습니다: {e}")
             return pd.DataFrame()
-    elif os.path.exists(RECEIVE_FILE):
+    elif os.path.exists(STOCK_FILE):
         try:
-            df = pd.read_excel(RECEIVE_FILE)
+            df = pd.read_excel(STOCK_FILE)
         except Exception as e:
-            st.error(f"receive.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
+            st.error(f"stock.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
             return pd.DataFrame()
     else:
-        s3_bytes = s3_download_bytes(RECEIVE_FILE)
+        s3_bytes = s3_download_bytes(STOCK_FILE)
         if s3_bytes is not None:
             try:
                 df = pd.read_excel(io.BytesIO(s3_bytes))
             except Exception as e:
-                st.error(f"S3의 receive.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
+                st.error(f"S3의 stock.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
                 return pd.DataFrame()
         else:
-            return pd.DataFrame()
-    return df
+            return pd.DataFrame()
+    return df
+
+
+def load_stock() -> pd.DataFrame:
+    return _load_stock_core(*session_source("stock_xlsx_bytes", STOCK_FILE))
+
+
+# ==============================
+# ERP 엑셀 재업로드 변경분 (production / receive / stock)
+#  - 새 엑셀을 이전 버전과 키 기준으로 비교해서 추가/수정/삭제 행만 남긴다
+#  - 변경분은 erp_changes/ 에 저장하고, 파생 인덱스는 변경분만 패치
+# ==============================
+ERP_CHANGE_DIR = "erp_changes"
+ERP_DIFF_KEYS = {
+    PRODUCTION_FILE: ["작업번호"],
+    RECEIVE_FILE: ["입하번호"],
+    STOCK_FILE: ["품번", "로트번호", "창고/작업장"],
+}
+CHANGE_ADDED = "추가"
+CHANGE_MODIFIED = "수정"
+CHANGE_REMOVED = "삭제"
+
+
+def _erp_keyed(df: pd.DataFrame, keys: list):
+    """키 컬럼을 문자열로 정리해서 인덱스로. 키가 중복이면 None (비교 불가)."""
+    out = df.copy()
+    for k in keys:
+        out[k] = out[k].astype(str).str.strip()
+    if out.duplicated(subset=keys).any():
+        return None
+    return out.set_index(keys)
+
+
+def _erp_text(df: pd.DataFrame) -> pd.DataFrame:
+    """값 비교용 문자열 (숫자는 숫자로 맞춘 뒤 비교해서 1500 / 1500.0 차이를 무시)."""
+    out = {}
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_numeric_dtype(s):
+            s = pd.to_numeric(s, errors="coerce").astype(float)
+        out[c] = s.astype(object).fillna("").astype(str).str.strip()
+    return pd.DataFrame(out, index=df.index)
+
+
+def diff_erp_frames(old: pd.DataFrame, new: pd.DataFrame, keys: list):
+    """
+    이전/새 엑셀 비교 → 변경분 DataFrame (변경 / 키 / 값 컬럼).
+    추가·수정 행은 새 값, 삭제 행은 이전 값.
+    키 컬럼이 없거나 중복이면 None (전체 교체로 처리).
+    """
+    if new is None or new.empty:
+        return None
+    if old is None or old.empty:
+        old = pd.DataFrame(columns=new.columns)
+    if any(k not in new.columns or k not in old.columns for k in keys):
+        return None
+
+    o = _erp_keyed(old, keys)
+    n = _erp_keyed(new, keys)
+    if o is None or n is None:
+        return None
+
+    cols = list(n.columns)
+    o = o.reindex(columns=cols)
+
+    added = n.index.difference(o.index)
+    removed = o.index.difference(n.index)
+    common = n.index.intersection(o.index)
+
+    diff_mask = (_erp_text(o.loc[common]) != _erp_text(n.loc[common])).any(axis=1)
+    modified = common[diff_mask.to_numpy()]
+
+    changes = pd.concat(
+        [
+            n.loc[added].assign(변경=CHANGE_ADDED),
+            n.loc[modified].assign(변경=CHANGE_MODIFIED),
+            o.loc[removed].assign(변경=CHANGE_REMOVED),
+        ]
+    ).reset_index()
+    return changes[["변경"] + keys + cols]
+
+
+def save_erp_changes(filename: str, changes: pd.DataFrame):
+    """변경분을 erp_changes/<파일명>_<시각>.csv 로 로컬/S3에 저장."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    stamp = datetime.now(KST).strftime("%Y%m%d_%H%M%S")
+    path = f"{ERP_CHANGE_DIR}/{stem}_{stamp}.csv"
+
+    buf = io.BytesIO()
+    changes.to_csv(buf, index=False, encoding="utf-8-sig")
+    data = buf.getvalue()
+
+    try:
+        os.makedirs(ERP_CHANGE_DIR, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    except Exception:
+        pass
+
+    s3_upload_bytes(path, data)
+
+
+def erp_change_counts(changes: pd.DataFrame) -> str:
+    counts = changes["변경"].value_counts()
+    return " · ".join(
+        f"{label} {int(counts.get(label, 0))}건"
+        for label in (CHANGE_ADDED, CHANGE_MODIFIED, CHANGE_REMOVED)
+    )
+
+
+def replace_erp_workbook(filename: str, sess_key: str, load_core, data: bytes):
+    """
+    ERP 엑셀 재업로드 처리.
+    이전 버전과 비교해서 변경분을 저장하고, 변경이 있을 때만 로컬/S3 파일을 교체한다.
+    return: (새 DataFrame, 변경분 또는 None(키 비교 불가 → 전체 교체))
+    """
+    ss = st.session_state
+    old_df = load_core(*session_source(sess_key, filename))
+    set_session_bytes(sess_key, data)
+    new_df = load_core(*session_source(sess_key, filename))
+    changes = diff_erp_frames(old_df, new_df, ERP_DIFF_KEYS[filename])
+
+    ss.setdefault("erp_changes", {})[filename] = changes
+
+    if changes is not None:
+        if changes.empty:
+            return new_df, changes
+        save_erp_changes(filename, changes)
+
+    try:
+        new_df.to_excel(filename, index=False)
+    except Exception:
+        pass
+    s3_upload_bytes(filename, data)
+    return new_df, changes
+
+
+def show_erp_changes(filename: str):
+    """마지막 재업로드의 변경분 표시."""
+    changes = st.session_state.get("erp_changes", {}).get(filename, None)
+    if changes is None or changes.empty:
+        return
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    st.caption(f"마지막 업로드 변경분: {erp_change_counts(changes)}")
+    paged_table(changes, key=f"erp_changes_{stem}", page_size=20)
+
+
+# ==============================
+# 자사 품번별 제품라인 자동 분류
+# ==============================
+NEEDLESHOT_CODES = {
+    "3VTCLOS-010",
+    "3VTCLOS-006",
+    "3VTCLOS-007",
+    "3VTCLOS-008",
+    "3VTCLOS-011",
+    "3VTCLOS-013",
+    "3VTCLOS-047",
+}
+
+FACIAL_CODES = {
+    "3VTCLOS-023",
+    "3VTCLOS-024",
+    "3VTCLOS-060",
+    "3VTCLOS-061",
+    "3VTCLOS-062",
+    "3VTCLOS-063",
+    "3VTCLOS-064",
+    "3VTCLOS-065",
+}
+
+
+def classify_product_line(item_code: str) -> str:
+    if not isinstance(item_code, str):
+        return ""
+    code = item_code.strip()
+    if code in NEEDLESHOT_CODES:
+        return "리들샷"
+    if code in FACIAL_CODES:
+        return "페이셜"
+    return ""
+
+
+@functools.lru_cache(maxsize=8192)
+def _tat_months(mfg_date: str, today_iso: str):
+    """제조일자('YYYY-MM-DD')부터 today까지 경과 개월 수. 날짜가 아니면 None. (날짜별 메모)"""
+    try:
+        mfg = datetime.strptime(normalize_mfg_date(mfg_date), "%Y-%m-%d")
+    except ValueError:
+        return None
+    today = date.fromisoformat(today_iso)
+    return max(0, (today.year - mfg.year) * 12 + (today.month - mfg.month))
+
+
+def add_tat_column(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    df에 'TAT' 컬럼을 추가해서 제조일자로부터 오늘까지 경과 개월 수를 채워준다. (df를 직접 수정)
+    - 제조일자가 비어있거나 파싱 불가하면 TAT는 <NA>
+    - 제조일자는 적재 시 'YYYY-MM-DD'로 정규화되어 있으므로 고유값별 메모만 조회
+    """
+    if "제조일자" not in df.columns:
+        df["TAT"] = pd.NA
+        return df
+
+    today_iso = date.today().isoformat()
+    uniq = df["제조일자"].dropna().astype(str).unique()
+    memo = {v: _tat_months(v, today_iso) for v in uniq}
+
+    df["TAT"] = df["제조일자"].astype(str).map(memo).astype("Int64")
+    return df
+
+
+def expand_drums(lots: pd.DataFrame, qty_col: str = "제조량") -> pd.DataFrame:
+    """
+    로트별 제조량(kg)을 통 단위 행으로 한 번에 펼친다.
+    - 200kg 미만: 1통
+    - 그 외: 1000kg 통 N개 + 나머지 1통
+    - 제조량이 없거나 0 이하: 통 없음
+    lots의 나머지 컬럼은 통마다 복제되고 '통번호'/'통용량' 컬럼이 붙는다.
+    """
+    qty = pd.to_numeric(lots[qty_col], errors="coerce").to_numpy(dtype=float)
+    qty = np.where(np.isnan(qty), 0.0, qty)
+
+    small = qty < 200
+    full = np.where(small, 0, np.floor(qty / 1000)).astype(int)
+    rem = np.where(small, qty, qty - full * 1000.0)
+    n_drums = np.where(qty > 0, full + (rem > 0), 0)
+
+    # 로트 i를 n_drums[i]번 반복 + 로트 안에서 1부터 통번호
+    src = np.repeat(np.arange(len(lots)), n_drums)
+    starts = np.repeat(np.cumsum(n_drums) - n_drums, n_drums)
+    drum_no = np.arange(len(src)) - starts + 1
+
+    out = lots.iloc[src].drop(columns=[qty_col]).reset_index(drop=True)
+    out["통번호"] = drum_no.astype(int)
+    out["통용량"] = np.where(drum_no <= full[src], 1000.0, rem[src])
+    return out
+
+
+def generate_drums(prod_qty_kg: float):
+    """제조량(kg)을 받아서 통번호/용량을 자동 생성. (expand_drums의 단건 버전)"""
+    if prod_qty_kg is None:
+        return []
+
+    try:
+        qty = float(prod_qty_kg)
+    except Exception:
+        return []
+
+    drums = expand_drums(pd.DataFrame({"제조량": [qty]}))
+    return drums[["통번호", "통용량"]].to_dict("records")
+
+
+def ensure_lots_in_csv(
+    df: pd.DataFrame,
+    lots: pd.DataFrame,
+    initial_status: str = "생산대기",
+    location: str = "2층 보관",
+) -> pd.DataFrame:
+    """
+    여러 로트의 통을 한 번에 생성해서 CSV(DF)에 추가. 이미 있는 로트는 건너뛴다.
+    lots 컬럼: 품목코드, 품명, 로트번호, 제품라인, 제조일자, 제조량
+    (pd.concat은 한 번만)
+    """
+    if lots is None or lots.empty:
+        return df
+
+    lots = lots[~lots["로트번호"].isin(set(df["로트번호"].astype(str)))]
+    lots = lots.drop_duplicates(subset=["로트번호"])
+    drums = expand_drums(lots)
+    if drums.empty:
+        return df
+
+    drums["제품라인"] = drums["제품라인"].fillna("")
+    drums["제조일자"] = _normalize_mfg_dates(drums["제조일자"])
+    drums["상태"] = initial_status or "생산대기"
+    drums["현재위치"] = location
+
+    return pd.concat([df, drums[DRUM_COLUMNS]], ignore_index=True)
+
+
+def ensure_lot_in_csv(
+    df: pd.DataFrame,
+    lot: str,
+    item_code: str,
+    item_name: str,
+    line: str,
+    mfg_date: str,
+    initial_status: str = "생산대기",
+    prod_qty: float = None,
+) -> pd.DataFrame:
+    """없던 로트면 통 자동 생성해서 CSV에 추가."""
+    lots = pd.DataFrame(
+        {
+            "품목코드": [item_code],
+            "품명": [item_name],
+            "로트번호": [lot],
+            "제품라인": [line or ""],
+            "제조일자": [mfg_date or ""],
+            "제조량": [prod_qty],
+        }
+    )
+    return ensure_lots_in_csv(df, lots, initial_status=initial_status)
+
+
+# ==============================
+# 이동 LOG 유틸 (ID 포함, 업로드/세션/S3 겸용)
+# ==============================
+EVENT_CREATE = "생성"   # 통 최초 생성 (작업번호/입하번호 첫 조회 시)
+EVENT_MOVE = "이동"     # 용량/위치/상태 변경
+
+MOVE_LOG_COLUMNS = [
+    "시간",
+    "ID",          # 이동 기록 작성자 (표시용 이름)
+    "품번",
+    "품명",
+    "로트번호",
+    "통번호",
+    "변경 전 용량",
+    "변경 후 용량",
+    "변화량",
+    "변경 전 위치",
+    "변경 후 위치",
+    "상태",        # 변경 후 상태 (예전 로그에는 없음)
+    "제품라인",    # 생성/라인 지정 이벤트용
+    "제조일자",    # 생성 이벤트용
+    "이벤트",      # 생성 / 이동
+    "커밋ID",      # 같이 저장된 행 묶음 (WAL 복구 시 중복 방지)
+]
+
+
+@loader_cache("move_log", max_entries=4, max_mb=64)
+def _load_move_log_core(version, _move_bytes):
+    """이동 이력 CSV 로드. (version: 캐시 키, _move_bytes: 해시하지 않음)"""
+    move_bytes = unpack_bytes(_move_bytes)
+    default_cols = MOVE_LOG_COLUMNS
+
+    if move_bytes is not None:
+        try:
+            df = pd.read_csv(io.BytesIO(move_bytes))
+        except Exception as e:
+            st.error(f"이동 이력 파일(업로드)을 읽는 중 오류가 발생했습니다: {e}")
+            return pd.DataFrame(columns=default_cols)
+    elif os.path.exists(MOVE_LOG_CSV):
+        try:
+            df = pd.read_csv(MOVE_LOG_CSV)
+        except Exception as e:
+            st.error(f"이동 이력 파일을 읽는 중 오류가 발생했습니다: {e}")
+            return pd.DataFrame(columns=default_cols)
+    else:
+        s3_bytes = s3_download_bytes(MOVE_LOG_CSV)
+        if s3_bytes is not None:
+            try:
+                df = pd.read_csv(io.BytesIO(s3_bytes))
+            except Exception as e:
+                st.error(f"S3의 이동 이력 파일을 읽는 중 오류가 발생했습니다: {e}")
+                return pd.DataFrame(columns=default_cols)
+        else:
+            return pd.DataFrame(columns=default_cols)
+
+    # 예전 로그에 ID/상태/이벤트 열이 없을 수도 있으니 보정
+    for c in default_cols:
+        if c not in df.columns:
+            if c == "ID":
+                df[c] = ""
+            elif c == "이벤트":
+                df[c] = EVENT_MOVE
+            else:
+                df[c] = pd.NA
+    df["이벤트"] = df["이벤트"].fillna(EVENT_MOVE)
+
+    return df[default_cols]
+
+
+def load_move_log() -> pd.DataFrame:
+    return _load_move_log_core(*session_source("move_log_csv_bytes", MOVE_LOG_CSV))
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _move_log_sorted_core(version, _move_bytes):
+    """
+    이동 이력을 최신순으로 한 번만 정렬해 둔다. (공유 객체이므로 수정 금지)
+    - '시간'을 int64(ns)로 파싱해서 정렬 (같은 시간이면 나중에 기록된 행이 위)
+    - 원본 인덱스 유지 (롤백 시 df.loc[...]로 사용)
+    return: (정렬된 DF, 소문자 로트번호 배열)
+    """
+    df = _load_move_log_core(version, _move_bytes)
+    ts = _move_log_times(df).to_numpy(dtype="datetime64[ns]").view("int64")  # NaT → 가장 작은 값
+    order = np.lexsort((np.arange(len(df)), ts))[::-1]
+
+    sorted_df = df.iloc[order]
+    lot_lower = sorted_df["로트번호"].astype(str).str.lower().to_numpy()
+    return sorted_df, lot_lower
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _move_log_filter_core(version, _move_bytes, q: str):
+    """
+    로트번호 부분 일치 검색 결과를 정렬본 기준 위치 배열로 캐시.
+    검색어가 없으면 None (= 전체).
+    """
+    if not q:
+        return None
+    _, lot_lower = _move_log_sorted_core(version, _move_bytes)
+    mask = pd.Series(lot_lower).str.contains(q, regex=False, na=False).to_numpy()
+    return np.flatnonzero(mask)
+
+
+# ----- 소진 로트 인덱스 (조회 탭 '소진 이력' 폴백용) -----
+#  이동 이력 중 소진/폐기 이벤트만 모아 둔 작은 표. 이력 버전별로 보관하고,
+#  이력이 뒤에 추가될 때는 새 행만 더해서 다음 버전의 인덱스를 만든다.
+TOMBSTONE_VERSIONS = 4
+
+
+@st.cache_resource(show_spinner=False)
+def _tombstone_registry() -> dict:
+    return {"lock": threading.Lock(), "by_version": OrderedDict()}
+
+
+def consumed_events(log_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    소진/폐기 이벤트 행 + lot_lower.
+    상태가 '소진'이거나 변경 후 위치가 소진/폐기면 소진으로 간주
+    (예전 로그는 상태 열이 비어 있으므로 위치 기준도 같이 확인)
+    """
+    is_consumed = log_df["변경 후 위치"].astype(str).str.strip().isin(["소진", "폐기"])
+    if "상태" in log_df.columns:
+        is_consumed |= log_df["상태"].astype(str).str.strip() == "소진"
+    hit = log_df[is_consumed].copy()
+    hit["lot_lower"] = hit["로트번호"].astype(str).str.strip().str.lower()
+    return hit
+
+
+def _register_tombstones(version, index: pd.DataFrame):
+    reg = _tombstone_registry()
+    with reg["lock"]:
+        reg["by_version"][version] = index
+        reg["by_version"].move_to_end(version)
+        while len(reg["by_version"]) > TOMBSTONE_VERSIONS:
+            reg["by_version"].popitem(last=False)
+
+
+def extend_tombstones(old_version, new_version, new_rows: pd.DataFrame):
+    """이력 추가 시: 직전 버전 인덱스가 있으면 새 행의 소진 이벤트만 더해서 새 버전으로 등록."""
+    reg = _tombstone_registry()
+    with reg["lock"]:
+        base = reg["by_version"].get(old_version)
+    if base is None:
+        return
+    added = consumed_events(new_rows)
+    index = pd.concat([base, added], ignore_index=True) if not added.empty else base
+    _register_tombstones(new_version, index)
+
+
+def tombstone_index() -> pd.DataFrame:
+    """현재 이동 이력 버전의 소진 이벤트 인덱스."""
+    version, _ = session_source("move_log_csv_bytes", MOVE_LOG_CSV)
+    reg = _tombstone_registry()
+    with reg["lock"]:
+        index = reg["by_version"].get(version)
+    if index is None:
+        index = consumed_events(load_move_log())
+        _register_tombstones(version, index)
+    return index
+
+
+def find_consumed_lots(q: str) -> pd.DataFrame:
+    """로트번호 부분 일치로 소진 이벤트 조회 (인덱스의 고유 로트만 검사)."""
+    index = tombstone_index()
+    if index.empty or not q:
+        return index.iloc[0:0]
+    lots = pd.Series(index["lot_lower"].unique())
+    matched = lots[lots.str.contains(q.lower(), regex=False, na=False)]
+    return index[index["lot_lower"].isin(set(matched))]
+
+
+def save_move_log(df: pd.DataFrame):
+    """
+    이동 이력 DataFrame 전체를 bulk_move_log.csv 및 세션/S3에 저장.
+    (기존 내용을 유지한 채 덮어쓰기 방식으로 전체 저장)
+    """
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, encoding="utf-8-sig")
+    data = buf.getvalue()
+
+    # 세션에 반영
+    set_session_bytes("move_log_csv_bytes", data)
+
+    # 캐시 클리어
+    _load_move_log_core.clear()
+
+    # 로컬 CSV + S3 저장 (백그라운드)
+    persist_file(MOVE_LOG_CSV, data)
+
+
+
+def write_move_log(
+    item_code: str,
+    item_name: str,
+    lot: str,
+    drum_infos,
+    from_zone: str,
+    to_zone: str,
+    status: str = "",
+    line: str = "",
+    mfg_date: str = "",
+    event: str = EVENT_MOVE,
+):
+    """
+    이동 이력을 bulk_move_log.csv에 기록.
+    drum_infos:
+      - 옛 형식: (통번호, moved_qty, old_qty, new_qty)
+      - 새 형식: (통번호, moved_qty, old_qty, new_qty, old_loc)
+    ID 열에는 로그인한 사용자의 '표시 이름'을 남긴다.
+    이동 이력이 원장의 원본이므로, 통 CSV를 저장하기 전에 먼저 기록해야 한다.
+    """
+    if not drum_infos:
+        return
+
+    ss = st.session_state
+    user_display_name = ss.get("user_name", "")
+
+    ts = now_kst_str()  # 🔹 한국 시간 기준
+
+    rows = []
+    for info in drum_infos:
+        # 🔹 튜플 길이에 따라 분기 (옛 데이터와 호환)
+        if len(info) == 4:
+            drum_no, moved_qty, old_qty, new_qty = info
+            old_loc = from_zone
+        else:
+            drum_no, moved_qty, old_qty, new_qty, old_loc = info
+
+        rows.append(
+            {
+                "시간": ts,
+                "ID": user_display_name,
+                "품번": item_code,
+                "품명": item_name,
+                "로트번호": lot,
+                "통번호": drum_no,
+                "변경 전 용량": old_qty,
+                "변경 후 용량": new_qty,
+                "변화량": moved_qty,
+                "변경 전 위치": old_loc,
+                "변경 후 위치": to_zone,
+                "상태": status,
+                "제품라인": line,
+                "제조일자": mfg_date,
+                "이벤트": event,
+            }
+        )
 
+    append_move_log(pd.DataFrame(rows))
 
-def load_receive():
+
+def append_move_log(new_df: pd.DataFrame):
+    """
+    이력 행(DataFrame) 여러 개를 한 번에 bulk_move_log.csv 뒤에 추가.
+    WAL에 fsync한 뒤 세션에 반영하고, 로컬/S3 저장은 백그라운드로 넘긴다.
+    return: 이번 추가분의 커밋ID (추가할 행이 없으면 None)
+    """
+    if new_df is None or new_df.empty:
+        return None
+    with ledger_lock():
+        return _append_move_log_locked(new_df)
+
+
+def _append_move_log_locked(new_df: pd.DataFrame):
     ss = st.session_state
-    recv_bytes = ss.get("recv_xlsx_bytes", None)
-    return _load_receive_core(recv_bytes)
 
+    new_df = new_df.assign(커밋ID=uuid.uuid4().hex)
+    journaled = wal_append(new_df, new_df["커밋ID"].iat[0])
 
-@st.cache_data(show_spinner=False)
-def _load_stock_core(stock_bytes):
-    if stock_bytes is not None:
+    # 기존 로그 불러오기 (세션/로컬/S3). 다른 프로세스가 파일을 바꿨으면 세션 바이트는 버려진다
+    old_version = session_source("move_log_csv_bytes", MOVE_LOG_CSV)[0]
+    if "move_log_csv_bytes" in ss:
         try:
-            df = pd.read_excel(io.BytesIO(stock_bytes))
-        except Exception as e:
-            st.error(f"stock.xlsx 파일(업로드)을 읽는 중 오류가 발생했습니다: {e}")
-            return pd.DataFrame()
-    elif os.path.exists(STOCK_FILE):
+            old_df = pd.read_csv(io.BytesIO(session_bytes("move_log_csv_bytes")))
+        except Exception:
+            old_df = pd.DataFrame()
+    elif os.path.exists(MOVE_LOG_CSV):
         try:
-            df = pd.read_excel(STOCK_FILE)
-        except Exception as e:
-            st.error(f"stock.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
-            return pd.DataFrame()
+            old_df = pd.read_csv(MOVE_LOG_CSV)
+        except Exception:
+            old_df = pd.DataFrame()
     else:
-        s3_bytes = s3_download_bytes(STOCK_FILE)
+        s3_bytes = s3_download_bytes(MOVE_LOG_CSV)
         if s3_bytes is not None:
             try:
-                df = pd.read_excel(io.BytesIO(s3_bytes))
-            except Exception as e:
-                st.error(f"S3의 stock.xlsx 파일을 읽는 중 오류가 발생했습니다: {e}")
-                return pd.DataFrame()
+                old_df = pd.read_csv(io.BytesIO(s3_bytes))
+            except Exception:
+                old_df = pd.DataFrame()
         else:
-            return pd.DataFrame()
-    return df
+            old_df = pd.DataFrame()
 
+    log_df = pd.concat([old_df, new_df], ignore_index=True)
 
-def load_stock() -> pd.DataFrame:
-    ss = st.session_state
-    stock_bytes = ss.get("stock_xlsx_bytes", None)
-    return _load_stock_core(stock_bytes)
+    # 1) 세션에 다시 저장 (소진 로트 인덱스는 새 행만 더해서 이어감)
+    buf = io.BytesIO()
+    log_df.to_csv(buf, index=False, encoding="utf-8-sig")
+    data = buf.getvalue()
+    set_session_bytes("move_log_csv_bytes", data)
+    extend_tombstones(old_version, ss["move_log_csv_bytes_ver"], new_df)
+
+    _load_move_log_core.clear()
+
+    # 2) 로컬 CSV + S3
+    if journaled:
+        persist_file(MOVE_LOG_CSV, data)
+    else:
+        # WAL을 쓸 수 없는 환경(읽기 전용 디스크 등)이면 저장이 끝날 때까지 기다린다
+        persist_file(MOVE_LOG_CSV, data)
+        wait_for_persist()
+    return new_df["커밋ID"].iat[0]
+
+
+def creation_events(new_drums: pd.DataFrame) -> pd.DataFrame:
+    """새로 생성된 통 행들 → 생성 이벤트(이동 이력 행)."""
+    qty = new_drums["통용량"].astype(float)
+    return pd.DataFrame(
+        {
+            "시간": now_kst_str(),
+            "ID": st.session_state.get("user_name", ""),
+            "품번": new_drums["품목코드"],
+            "품명": new_drums["품명"],
+            "로트번호": new_drums["로트번호"],
+            "통번호": new_drums["통번호"].astype(int),
+            "변경 전 용량": 0.0,
+            "변경 후 용량": qty,
+            "변화량": -qty,
+            "변경 전 위치": "",
+            "변경 후 위치": new_drums["현재위치"],
+            "상태": new_drums["상태"],
+            "제품라인": new_drums["제품라인"],
+            "제조일자": new_drums["제조일자"],
+            "이벤트": EVENT_CREATE,
+        }
+    ).reset_index(drop=True)
+
+
+def provision_lots(
+    lots: pd.DataFrame,
+    initial_status: str = "생산대기",
+) -> tuple:
+    """
+    ensure_lots_in_csv + 생성 이벤트 일괄 기록 + 원장 저장 (각 1회).
+    원장은 잠금을 잡은 뒤 읽는다 (미리 읽어 둔 원장은 다른 프로세스의 저장 전일 수 있다).
+    새 통이 생긴 경우에만 이력/CSV를 저장한다.
+    return: (갱신된 DF, 새로 생긴 통 수)
+    """
+    with ledger_lock():
+        df = load_drums()
+
+        # 보관 원장으로 옮긴(모두 소진된) 로트는 다시 만들지 않는다
+        archive = load_archive()
+        if lots is not None and not archive.empty:
+            lots = lots[~lots["로트번호"].isin(set(archive["로트번호"].astype(str)))]
+
+        n_before = len(df)
+        df = ensure_lots_in_csv(df, lots, initial_status=initial_status)
+        if len(df) == n_before:
+            return df, 0
+
+        append_move_log(creation_events(df.iloc[n_before:]))
+        save_drums(df)
+    return df, len(df) - n_before
+
+
+def provision_lot(
+    lot: str,
+    item_code: str,
+    item_name: str,
+    line: str,
+    mfg_date: str,
+    initial_status: str = "생산대기",
+    prod_qty: float = None,
+) -> pd.DataFrame:
+    """
+    ensure_lot_in_csv + 생성 이벤트 기록 + 원장 저장.
+    새 통이 생긴 경우에만 이력/CSV를 저장한다.
+    """
+    lots = pd.DataFrame(
+        {
+            "품목코드": [item_code],
+            "품명": [item_name],
+            "로트번호": [lot],
+            "제품라인": [line or ""],
+            "제조일자": [mfg_date or ""],
+            "제조량": [prod_qty],
+        }
+    )
+    df, _ = provision_lots(lots, initial_status=initial_status)
+    return df
 
 
 # ==============================
-# 자사 품번별 제품라인 자동 분류
+# 업로드 시 통 일괄 생성 (production.xlsx / receive.xlsx)
+#  - 첫 바코드 조회 때 통을 만들면 그때마다 CSV 저장 + S3 업로드가 생기므로
+#    업로드 시점에 빠진 로트를 한 번에 만들어 둔다
 # ==============================
-NEEDLESHOT_CODES = {
-    "3VTCLOS-010",
-    "3VTCLOS-006",
-    "3VTCLOS-007",
-    "3VTCLOS-008",
-    "3VTCLOS-011",
-    "3VTCLOS-013",
-    "3VTCLOS-047",
-}
+def classify_trade_line(trade_type: str) -> str:
+    """유/무상 값 → 사급 제품라인."""
+    trade_type = str(trade_type or "").strip()
+    if trade_type == "유상":
+        return "사급(유상)"
+    if trade_type == "무상":
+        return "사급(무상)"
+    return "사급"
+
+
+def production_lots(prod_df: pd.DataFrame) -> pd.DataFrame:
+    """production.xlsx → 로트 목록 (품목코드/품명/로트번호/제품라인/제조일자/제조량)."""
+    if prod_df is None or prod_df.empty:
+        return pd.DataFrame(columns=["품목코드", "품명", "로트번호", "제품라인", "제조일자", "제조량"])
+
+    item_codes = prod_df["품번"].astype(str).str.strip()
+    return pd.DataFrame(
+        {
+            "품목코드": item_codes,
+            "품명": prod_df["품명"].astype(str).str.strip(),
+            "로트번호": prod_df["LOTNO"].astype(str).str.strip().str.upper(),
+            "제품라인": item_codes.map(classify_product_line),
+            "제조일자": _normalize_mfg_dates(prod_df["작업일자"]),
+            "제조량": pd.to_numeric(prod_df["제조량"], errors="coerce"),
+        }
+    )
 
-FACIAL_CODES = {
-    "3VTCLOS-023",
-    "3VTCLOS-024",
-    "3VTCLOS-060",
-    "3VTCLOS-061",
-    "3VTCLOS-062",
-    "3VTCLOS-063",
-    "3VTCLOS-064",
-    "3VTCLOS-065",
-}
 
+def receive_lots(recv_df: pd.DataFrame, stock_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    receive.xlsx → 로트 목록. 입하량을 제조량처럼 사용.
+    제품라인은 stock.xlsx의 유/무상(첫 행) 우선, 없으면 receive의 유/무상.
+    """
+    cols = ["품목코드", "품명", "로트번호", "제품라인", "제조일자", "제조량"]
+    if recv_df is None or recv_df.empty or "입하량" not in recv_df.columns:
+        return pd.DataFrame(columns=cols)
+
+    if "제조일자" in recv_df.columns:
+        mfg = recv_df["제조일자"]
+    elif "제조년월일" in recv_df.columns:
+        mfg = recv_df["제조년월일"]
+    else:
+        mfg = pd.Series("", index=recv_df.index)
+
+    lots = pd.DataFrame(
+        {
+            "품목코드": recv_df["품번"].astype(str).str.strip(),
+            "품명": recv_df["품명"].astype(str).str.strip(),
+            "로트번호": recv_df["로트번호"].astype(str).str.strip().str.upper(),
+            "제조일자": _normalize_mfg_dates(mfg),
+            "제조량": pd.to_numeric(recv_df["입하량"], errors="coerce"),
+            "_recv_trade": recv_df.get("유/무상", pd.Series("", index=recv_df.index)).fillna("").astype(str).str.strip(),
+        }
+    )
 
-def classify_product_line(item_code: str) -> str:
-    if not isinstance(item_code, str):
-        return ""
-    code = item_code.strip()
-    if code in NEEDLESHOT_CODES:
-        return "리들샷"
-    if code in FACIAL_CODES:
-        return "페이셜"
-    return ""
+    lots["_stock_trade"] = ""
+    if stock_df is not None and not stock_df.empty and "유/무상" in stock_df.columns:
+        trade = pd.DataFrame(
+            {
+                "품목코드": stock_df["품번"].astype(str).str.strip(),
+                "로트번호": stock_df["로트번호"].astype(str).str.strip().str.upper(),
+                "_stock_trade": stock_df["유/무상"].fillna("").astype(str).str.strip(),
+            }
+        ).drop_duplicates(subset=["품목코드", "로트번호"])
+        lots = lots.drop(columns=["_stock_trade"]).merge(trade, on=["품목코드", "로트번호"], how="left")
+        lots["_stock_trade"] = lots["_stock_trade"].fillna("")
 
+    trade_type = lots["_stock_trade"].where(lots["_stock_trade"] != "", lots["_recv_trade"])
+    lots["제품라인"] = trade_type.map(classify_trade_line)
+    return lots[cols]
 
-def add_tat_column(df: pd.DataFrame) -> pd.DataFrame:
+
+def materialize_uploaded_lots(prod_df=None, recv_df=None) -> int:
     """
-    df에 'TAT' 컬럼을 추가해서 제조일자로부터 오늘까지 경과 개월 수를 채워준다.
-    - 제조일자가 비어있거나 파싱 불가하면 TAT는 <NA>
+    production.xlsx / receive.xlsx의 로트 중 원장에도 이동 이력에도 없는 로트의 통을 한 번에 생성.
+    (이력에 있는 로트는 소진 후 원장에서 지운 것일 수 있으므로 다시 만들지 않는다)
+    prod_df / recv_df를 주면 그 행(재업로드 변경분)만 확인한다.
+    return: 새로 생성한 통 수
     """
-    if "제조일자" not in df.columns:
-        df["TAT"] = pd.NA
-        return df
+    if prod_df is None and recv_df is None:
+        prod_df, recv_df = load_production(), load_receive()
 
-    # 제조일자를 datetime으로 변환 (여러 포맷 허용)
-    mfg_dt = pd.to_datetime(df["제조일자"], errors="coerce")
+    df = load_drums()
+    log_df = load_move_log()
 
-    # 오늘 날짜
-    today = date.today()
+    lots = pd.concat(
+        [production_lots(prod_df), receive_lots(recv_df, load_stock())],
+        ignore_index=True,
+    )
+    if lots.empty:
+        return 0
 
-    # 연/월 차이로 개월 수 계산
-    years_diff = today.year - mfg_dt.dt.year
-    months_diff = today.month - mfg_dt.dt.month
-    tat_months = years_diff * 12 + months_diff
+    known = set(df["로트번호"].astype(str).str.strip().str.lower())
+    known |= set(log_df["로트번호"].astype(str).str.strip().str.lower())
+    lots = lots[~lots["로트번호"].str.lower().isin(known)]
 
-    # 음수 방지
-    tat_months = tat_months.clip(lower=0)
+    _, n_new = provision_lots(lots, initial_status="생산대기")
+    return n_new
 
-    # 날짜 없는 곳은 NA로
-    tat_months = tat_months.where(~mfg_dt.isna(), pd.NA)
 
-    # nullable 정수로 저장
-    df = df.copy()
-    df["TAT"] = tat_months.astype("Int64")
+# ==============================
+# 원장 체크포인트 (이동 이력 = 원본, bulk CSV = 투영)
+#  - 이동 이력(bulk_move_log.csv)의 각 행은 통 하나의 '변경 후' 상태를 담은 이벤트
+#  - 체크포인트 = 통 원장 스냅샷 + 그 시점의 이동 이력 행 수(offset)
+#  - 세션 시작 시 최신 체크포인트 + 이후 이벤트(tail)만 재생해서 원장을 맞춘다
+# ==============================
+CHECKPOINT_DIR = "ledger_checkpoints"
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "200"))  # 이벤트 N개마다 스냅샷
+CHECKPOINT_KEEP = 5                                                 # 최근 N개는 모두 보관
+CHECKPOINT_BUCKET = CHECKPOINT_INTERVAL * 10                        # 그 이전은 구간별 1개만 보관 (과거 시점 조회용)
 
-    return df
+_CHECKPOINT_RE = re.compile(r"bulk_checkpoint_(\d+)\.csv")
 
 
-def generate_drums(prod_qty_kg: float):
-    """제조량(kg)을 받아서 통번호/용량을 자동 생성."""
-    if prod_qty_kg is None:
-        return []
+def _checkpoint_path(offset: int) -> str:
+    return f"{CHECKPOINT_DIR}/bulk_checkpoint_{offset:09d}.csv"
+
+
+def _checkpoint_offsets(names) -> list:
+    offsets = set()
+    for n in names:
+        m = _CHECKPOINT_RE.fullmatch(n)
+        if m:
+            offsets.add(int(m.group(1)))
+    return sorted(offsets)
+
 
+def list_checkpoint_offsets() -> list:
+    """저장된 체크포인트의 offset 목록 (오름차순). 로컬 → S3 순으로 확인."""
+    names = []
+    if os.path.isdir(CHECKPOINT_DIR):
+        names = os.listdir(CHECKPOINT_DIR)
+    if not names:
+        names = s3_list_filenames(CHECKPOINT_DIR)
+    return _checkpoint_offsets(names)
+
+
+@loader_cache("checkpoint", max_entries=16, max_mb=128)
+def _load_checkpoint_core(offset: int):
+    """체크포인트 스냅샷 로드. 없거나 오류면 None."""
+    path = _checkpoint_path(offset)
     try:
-        qty = float(prod_qty_kg)
+        if os.path.exists(path):
+            df = pd.read_csv(path)
+        else:
+            data = s3_download_bytes(path)
+            if data is None:
+                return None
+            df = pd.read_csv(io.BytesIO(data))
     except Exception:
-        return []
+        return None
 
-    if qty <= 0:
-        return []
+    for c in DRUM_COLUMNS:
+        if c not in df.columns:
+            return None
+    return normalize_drums(df)
 
-    drums = []
-    if qty < 200:
-        drums.append({"통번호": 1, "통용량": qty})
-        return drums
 
-    full = int(qty // 1000)
-    rem = qty % 1000
+def load_checkpoint(offset: int):
+    return _load_checkpoint_core(offset)
 
-    for i in range(full):
-        drums.append({"통번호": i + 1, "통용량": 1000})
 
-    if rem > 0:
-        drums.append({"통번호": full + 1, "통용량": rem})
+def _checkpoints_to_prune(offsets: list) -> list:
+    """최근 CHECKPOINT_KEEP개는 유지, 그 이전은 CHECKPOINT_BUCKET 구간마다 가장 최신 1개만 유지."""
+    older = offsets[:-CHECKPOINT_KEEP]
+    latest_in_bucket = {}
+    for o in older:
+        latest_in_bucket[o // CHECKPOINT_BUCKET] = o
+    return [o for o in older if latest_in_bucket[o // CHECKPOINT_BUCKET] != o]
 
-    return drums
 
+def write_checkpoint(df: pd.DataFrame, offset: int):
+    """통 원장 스냅샷을 offset(이동 이력 행 수)과 함께 로컬/S3에 저장."""
+    path = _checkpoint_path(offset)
+    snap = df.drop(columns=["lot_lower"], errors="ignore")
 
-def ensure_lot_in_csv(
-    df: pd.DataFrame,
-    lot: str,
-    item_code: str,
-    item_name: str,
-    line: str,
-    mfg_date: str,
-    initial_status: str = "생산대기",
-    prod_qty: float = None,
-) -> pd.DataFrame:
-    """없던 로트면 통 자동 생성해서 CSV에 추가."""
-    if (df["로트번호"] == lot).any():
-        return df
+    buf = io.BytesIO()
+    snap.to_csv(buf, index=False, encoding="utf-8-sig")
+    data = buf.getvalue()
+
+    try:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    except Exception:
+        pass
+    # 체크포인트는 원장 재생의 기준점 → 중간에 끊겨도 잘린 파일이 남지 않게 임시 파일로 쓰고 교체
+    if not _write_local_atomic(path, data) and not s3_enabled():
+        return
+
+    s3_upload_bytes(path, data)
+    _load_checkpoint_core.clear()
 
-    drums = generate_drums(prod_qty)
-    if not drums:
+    # 오래된 체크포인트 정리
+    for old in _checkpoints_to_prune(list_checkpoint_offsets()):
+        _delete_checkpoint(old)
+
+
+def _delete_checkpoint(offset: int):
+    path = _checkpoint_path(offset)
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+    s3_delete(path)
+    _load_checkpoint_core.clear()
+
+
+def drop_checkpoints_after(offset: int):
+    """offset보다 뒤의 체크포인트 삭제 (이동 이력 행 삭제/교체로 offset이 무효가 된 경우)."""
+    for o in list_checkpoint_offsets():
+        if o > offset:
+            _delete_checkpoint(o)
+
+
+def reset_checkpoints(df: pd.DataFrame, offset: int):
+    """
+    기존 체크포인트를 모두 버리고 현재 원장을 새 기준점으로 등록.
+    로컬에만 / S3에만 남은 체크포인트도 지운다 (다른 이력 기준이라 재생하면 원장이 틀어짐).
+    """
+    names = set(s3_list_filenames(CHECKPOINT_DIR))
+    if os.path.isdir(CHECKPOINT_DIR):
+        names.update(os.listdir(CHECKPOINT_DIR))
+    for o in _checkpoint_offsets(names):
+        _delete_checkpoint(o)
+    write_checkpoint(df, offset)
+
+
+def maybe_write_checkpoint(df: pd.DataFrame):
+    """마지막 체크포인트 이후 이벤트가 CHECKPOINT_INTERVAL개 이상 쌓였으면 새 체크포인트 저장."""
+    log_len = len(load_move_log())
+    offsets = list_checkpoint_offsets()
+    if not offsets or log_len - offsets[-1] >= CHECKPOINT_INTERVAL:
+        write_checkpoint(with_archive(df.drop(columns=["lot_lower"], errors="ignore")), log_len)
+
+
+def _drum_keys(df: pd.DataFrame) -> pd.MultiIndex:
+    """통 원장의 (소문자 로트번호, 통번호) 키."""
+    return pd.MultiIndex.from_arrays(
+        [df["로트번호"].astype(str).str.strip().str.lower(), df["통번호"].astype(int)]
+    )
+
+
+def _prepare_events(events: pd.DataFrame) -> pd.DataFrame:
+    """이동 이력 행에 통 키(_lot, _drum)를 붙이고 값 타입/빈 문자열을 정리."""
+    ev = events.copy()
+    ev["_lot"] = ev["로트번호"].astype(str).str.strip().str.lower()
+    ev["_drum"] = pd.to_numeric(ev["통번호"], errors="coerce")
+    ev = ev.dropna(subset=["_drum"])
+    ev["_drum"] = ev["_drum"].astype(int)
+    for c in ["변경 전 용량", "변경 후 용량"]:
+        ev[c] = pd.to_numeric(ev[c], errors="coerce")
+    for c in ["품번", "품명", "로트번호", "변경 전 위치", "변경 후 위치", "상태", "제품라인", "제조일자", "이벤트"]:
+        ev[c] = ev[c].astype("string").str.strip().replace("", pd.NA)
+    return ev
+
+
+def _overlay_column(out: pd.DataFrame, hit, col: str, values: pd.Series):
+    """out[col]의 hit 행을 values로 덮어쓴다 (values가 비어 있는 행은 기존 값 유지)."""
+    vals = pd.Series(values.to_numpy(dtype=object), index=out.index[hit])
+    merged = out[col].astype(object)
+    merged.loc[hit] = vals.where(vals.notna(), merged.loc[hit])
+    out[col] = merged
+
+
+def apply_log_events(df: pd.DataFrame, events: pd.DataFrame) -> pd.DataFrame:
+    """
+    이동 이력(이벤트)을 통 원장 스냅샷 위에 재생.
+    - 이벤트는 '변경 후' 값을 담고 있으므로 통(로트번호+통번호)별 마지막 값만 반영
+    - 상태/제품라인은 값이 있는 이벤트만 반영 (예전 로그는 비어 있음)
+    - 스냅샷에 없는 통(생성 이벤트)은 새 행으로 추가
+    """
+    if events is None or events.empty:
         return df
 
-    new_rows = []
-    for d in drums:
-        new_rows.append(
+    ev = _prepare_events(events)
+
+    # 통별 마지막 (값이 있는) 이벤트
+    last = ev.groupby(["_lot", "_drum"], sort=False).last()
+
+    out = df.copy()
+    keys = _drum_keys(out)
+    pos = last.index.get_indexer(keys)
+    hit = pos >= 0
+
+    if hit.any():
+        src = last.iloc[pos[hit]]
+        for col, ev_col in [
+            ("통용량", "변경 후 용량"),
+            ("현재위치", "변경 후 위치"),
+            ("상태", "상태"),
+            ("제품라인", "제품라인"),
+        ]:
+            _overlay_column(out, hit, col, src[ev_col])
+
+    new_keys = ~last.index.isin(keys)
+    if new_keys.any():
+        nl = last[new_keys].reset_index()
+        new_rows = pd.DataFrame(
             {
-                "품목코드": item_code,
-                "품명": item_name,
-                "로트번호": lot,
-                "제품라인": line or "",
-                "제조일자": mfg_date or "",
-                "상태": initial_status or "생산대기",
-                "통번호": int(d["통번호"]),
-                "통용량": float(d["통용량"]),
-                "현재위치": "2층 보관",
+                "품목코드": nl["품번"].fillna(""),
+                "품명": nl["품명"].fillna(""),
+                "로트번호": nl["로트번호"].fillna(nl["_lot"].str.upper()),
+                "제품라인": nl["제품라인"].fillna(""),
+                "제조일자": nl["제조일자"].fillna(""),
+                "상태": nl["상태"].fillna("생산대기"),
+                "통번호": nl["_drum"],
+                "통용량": nl["변경 후 용량"].fillna(0.0),
+                "현재위치": nl["변경 후 위치"].fillna(""),
             }
         )
+        out = pd.concat([out, new_rows], ignore_index=True)
 
-    df = pd.concat([df, pd.DataFrame(new_rows)], ignore_index=True)
-    return df
+    return normalize_drums(out)
 
 
-# ==============================
-# 이동 LOG 유틸 (ID 포함, 업로드/세션/S3 겸용)
-# ==============================
-@st.cache_data(show_spinner=False)
-def _load_move_log_core(move_bytes):
-    """이동 이력 CSV 로드."""
-    default_cols = [
-        "시간",
-        "ID",          # 이동 기록 작성자 (표시용 이름)
-        "품번",
-        "품명",
-        "로트번호",
-        "통번호",
-        "변경 전 용량",
-        "변경 후 용량",
-        "변화량",
-        "변경 전 위치",
-        "변경 후 위치",
+def revert_log_rows(df: pd.DataFrame, rows: pd.DataFrame, prior: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    삭제(롤백)할 이동 이력 행을 통 원장에 역적용. (rows는 각 통의 최신 이력이어야 한다)
+    - 이동: 통별 가장 앞선 삭제 행의 '변경 전' 용량/위치로 복원
+    - 상태/제품라인: prior(삭제 후 남은 이력)에서 그 통의 마지막 값으로 복원 (값이 없으면 유지)
+    - 생성: 해당 통 삭제
+    """
+    out = rewind_log_events(df, rows)
+    if prior is None or prior.empty or out.empty:
+        return out
+
+    reverted = _prepare_events(rows)
+    ev = _prepare_events(prior)
+    ev = ev[
+        pd.MultiIndex.from_arrays([ev["_lot"], ev["_drum"]]).isin(
+            pd.MultiIndex.from_arrays([reverted["_lot"], reverted["_drum"]])
+        )
     ]
+    if ev.empty:
+        return out
+    # 생성 이벤트의 빈 값은 '변경 없음'이 아니라 실제 값(빈 제품라인)
+    created = ev["이벤트"] == EVENT_CREATE
+    for col in ["상태", "제품라인"]:
+        ev.loc[created, col] = ev.loc[created, col].fillna("")
+    last = ev.groupby(["_lot", "_drum"], sort=False)[["상태", "제품라인"]].last()
+    pos = last.index.get_indexer(_drum_keys(out))
+    hit = pos >= 0
+    if hit.any():
+        src = last.iloc[pos[hit]]
+        for col in ["상태", "제품라인"]:
+            _overlay_column(out, hit, col, src[col])
+    return out
+
+
+def rewind_log_events(df: pd.DataFrame, events: pd.DataFrame) -> pd.DataFrame:
+    """
+    apply_log_events의 역방향: 스냅샷에서 events를 거꾸로 되돌린다.
+    - 통별 가장 앞선 이벤트의 '변경 전' 용량/위치로 복원
+    - 구간 안에서 생성된 통은 삭제
+    - 이동 이력에 '변경 전 상태'가 없으므로 상태/제품라인은 스냅샷 값 유지
+    """
+    if events is None or events.empty:
+        return df
 
-    if move_bytes is not None:
-        try:
-            df = pd.read_csv(io.BytesIO(move_bytes))
-        except Exception as e:
-            st.error(f"이동 이력 파일(업로드)을 읽는 중 오류가 발생했습니다: {e}")
-            return pd.DataFrame(columns=default_cols)
-    elif os.path.exists(MOVE_LOG_CSV):
-        try:
-            df = pd.read_csv(MOVE_LOG_CSV)
-        except Exception as e:
-            st.error(f"이동 이력 파일을 읽는 중 오류가 발생했습니다: {e}")
-            return pd.DataFrame(columns=default_cols)
-    else:
-        s3_bytes = s3_download_bytes(MOVE_LOG_CSV)
-        if s3_bytes is not None:
-            try:
-                df = pd.read_csv(io.BytesIO(s3_bytes))
-            except Exception as e:
-                st.error(f"S3의 이동 이력 파일을 읽는 중 오류가 발생했습니다: {e}")
-                return pd.DataFrame(columns=default_cols)
-        else:
-            return pd.DataFrame(columns=default_cols)
+    ev = _prepare_events(events)
+    first = ev.groupby(["_lot", "_drum"], sort=False).agg(
+        변경전용량=("변경 전 용량", "first"),
+        변경전위치=("변경 전 위치", "first"),
+        이벤트=("이벤트", "first"),
+    )
+
+    out = df.copy()
+    pos = first.index.get_indexer(_drum_keys(out))
+    hit = pos >= 0
+    if hit.any():
+        src = first.iloc[pos[hit]]
+        for col, ev_col in [("통용량", "변경전용량"), ("현재위치", "변경전위치")]:
+            _overlay_column(out, hit, col, src[ev_col])
+
+        created = pd.Series(False, index=out.index)
+        created[out.index[hit]] = (src["이벤트"] == EVENT_CREATE).fillna(False).to_numpy()
+        out = out[~created]
+
+    return normalize_drums(out.reset_index(drop=True))
+
+
+def _move_log_times(log_df: pd.DataFrame) -> pd.Series:
+    """이동 이력 '시간' 문자열(KST) → datetime (파싱 불가는 NaT)."""
+    return pd.to_datetime(log_df["시간"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+
+
+def drums_as_of(as_of: datetime) -> pd.DataFrame:
+    """
+    특정 시점(KST, tz 없는 datetime)의 통 원장을 복원.
+    - as_of 이후 첫 이벤트 위치(cut)를 찾고, cut 이하의 가장 가까운 체크포인트에서 cut까지 재생
+    - cut보다 앞선 체크포인트가 없으면 가장 오래된 체크포인트에서 거꾸로 되돌림
+    """
+    log_df = load_move_log()
+    after = (_move_log_times(log_df) > pd.Timestamp(as_of)).to_numpy()
+    cut = int(after.argmax()) if after.any() else len(log_df)
 
-    # 예전 로그에 ID열이 없을 수도 있으니 보정
-    for c in default_cols:
-        if c not in df.columns:
-            if c == "ID":
-                df[c] = ""
-            else:
-                df[c] = pd.NA
+    offsets = list_checkpoint_offsets()
+    before_cut = [o for o in offsets if o <= cut]
+    if before_cut:
+        snap = load_checkpoint(before_cut[-1])
+        if snap is not None:
+            return apply_log_events(snap, log_df.iloc[before_cut[-1]:cut])
 
-    return df[default_cols]
+    after_cut = [o for o in offsets if o > cut]
+    if after_cut:
+        snap = load_checkpoint(after_cut[0])
+        if snap is not None:
+            return rewind_log_events(snap, log_df.iloc[cut:after_cut[0]])
 
+    # 체크포인트가 하나도 없으면 현재 (전체) 원장에서 거꾸로 되돌림
+    return rewind_log_events(load_all_drums(), log_df.iloc[cut:])
 
-def load_move_log() -> pd.DataFrame:
-    ss = st.session_state
-    move_bytes = ss.get("move_log_csv_bytes", None)
-    return _load_move_log_core(move_bytes)
 
-def save_move_log(df: pd.DataFrame):
+def as_of_picker(key_prefix: str):
     """
-    이동 이력 DataFrame 전체를 bulk_move_log.csv 및 세션/S3에 저장.
-    (기존 내용을 유지한 채 덮어쓰기 방식으로 전체 저장)
+    '과거 시점으로 보기' 토글 + 날짜/시간 선택.
+    꺼져 있으면 None (= 현재 원장 사용).
     """
-    ss = st.session_state
+    on = st.toggle("🕒 과거 시점으로 보기", key=f"{key_prefix}_asof_on")
+    if not on:
+        return None
 
-    buf = io.BytesIO()
-    df.to_csv(buf, index=False, encoding="utf-8-sig")
-    data = buf.getvalue()
+    col_d, col_t, _sp = st.columns([1, 1, 3])
+    with col_d:
+        d = st.date_input("날짜", value=datetime.now(KST).date(), key=f"{key_prefix}_asof_date")
+    with col_t:
+        t = st.time_input("시간", value=dt_time(18, 0), key=f"{key_prefix}_asof_time")
 
-    # 세션에 반영
-    ss["move_log_csv_bytes"] = data
+    as_of = datetime.combine(d, t)
+    st.caption(f"※ {as_of:%Y-%m-%d %H:%M} 시점의 위치/용량입니다. (체크포인트 + 이동 이력 재생)")
+    return as_of
 
-    # 캐시 클리어
-    _load_move_log_core.clear()
 
-    # 로컬 CSV 저장
-    try:
-        df.to_csv(MOVE_LOG_CSV, index=False, encoding="utf-8-sig")
-    except Exception:
-        pass
+def _same_ledger(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    """
+    두 원장의 내용이 같은지 (행 순서 무관).
+    보관/재생을 거치면 통 순서가 저장본과 달라지므로 (로트번호, 통번호) 순으로 맞춰 비교한다.
+    """
+    cols = [c for c in DRUM_COLUMNS if c in a.columns and c in b.columns]
+    if len(a) != len(b) or len(cols) != len(DRUM_COLUMNS):
+        return False
 
-    # S3 업로드
-    s3_upload_bytes(MOVE_LOG_CSV, data)
+    def canonical(df: pd.DataFrame) -> pd.DataFrame:
+        text = df[cols].astype(object).fillna("").astype(str)
+        order = ["로트번호", "통번호"] + [c for c in cols if c not in ("로트번호", "통번호")]
+        return text.sort_values(order).reset_index(drop=True)
 
+    return canonical(a).equals(canonical(b))
 
 
-def write_move_log(item_code: str, item_name: str, lot: str, drum_infos, from_zone: str, to_zone: str):
+def sync_ledger_from_log():
     """
-    이동 이력을 bulk_move_log.csv에 기록.
-    drum_infos:
-      - 옛 형식: (통번호, moved_qty, old_qty, new_qty)
-      - 새 형식: (통번호, moved_qty, old_qty, new_qty, old_loc)
-    ID 열에는 로그인한 사용자의 '표시 이름'을 남긴다.
+    세션 시작 시 1회 호출.
+    최신 체크포인트 + 이후 이동 이력(tail)만 재생해서 bulk CSV(투영)를 맞춘다.
+    - 체크포인트가 없으면(최초 실행) 현재 bulk CSV를 기준점으로 등록
+    - 이동 이력이 체크포인트보다 짧으면(이력 파일 교체 등) 기준점을 다시 잡는다
     """
-    if not drum_infos:
-        return
+    with ledger_lock():
+        log_df = load_move_log()
+        log_len = len(log_df)
 
-    ss = st.session_state
-    user_display_name = ss.get("user_name", "")
+        offsets = list_checkpoint_offsets()
+        snap = load_checkpoint(offsets[-1]) if offsets and offsets[-1] <= log_len else None
+        if snap is None:
+            reset_checkpoints(load_all_drums(), log_len)
+            return
 
-    ts = now_kst_str()  # 🔹 한국 시간 기준
+        # 체크포인트는 전체 원장(작업 + 보관) 기준
+        df = apply_log_events(snap, log_df.iloc[offsets[-1]:])
+        if not _same_ledger(df, load_all_drums()):
+            save_ledger(df)
 
-    rows = []
-    for info in drum_infos:
-        # 🔹 튜플 길이에 따라 분기 (옛 데이터와 호환)
-        if len(info) == 4:
-            drum_no, moved_qty, old_qty, new_qty = info
-            old_loc = from_zone
+
+def rollback_log_rows(log_df: pd.DataFrame, hit) -> pd.DataFrame:
+    """
+    이동 이력에서 hit 행을 지우고 원장을 지우기 전 상태로 되돌린다. (각 통의 최신 이력만 지울 것)
+    - 지운 첫 행 이전의 체크포인트가 있으면 체크포인트 + 남은 이력 재생 (원장 = 이력 투영)
+    - 없으면 지운 행을 역적용하고 상태/제품라인은 남은 이력의 마지막 값으로 복원
+    log_df는 ledger_lock을 잡은 채로 읽은 이력이어야 한다 (읽은 뒤 다른 프로세스가 추가한 이력을 지우지 않도록).
+    return: 지운 이력 행
+    """
+    with ledger_lock():
+        hit = np.asarray(hit, dtype=bool)
+        rows = log_df[hit]
+        log_updated = log_df[~hit].reset_index(drop=True)
+
+        # 이력(원본) 먼저 저장 → 지운 행 뒤의 체크포인트는 offset이 틀어지므로 버림
+        save_move_log(log_updated)
+        wal_discard(rows)
+        drop_checkpoints_after(int(np.flatnonzero(hit)[0]))
+
+        offsets = list_checkpoint_offsets()
+        snap = load_checkpoint(offsets[-1]) if offsets else None
+        if snap is not None:
+            drums_df = apply_log_events(snap, log_updated.iloc[offsets[-1]:])
         else:
-            drum_no, moved_qty, old_qty, new_qty, old_loc = info
+            drums_df = revert_log_rows(load_all_drums(), rows, log_updated)
+        save_ledger(drums_df)
+        write_checkpoint(drums_df, len(log_updated))
+    return rows
 
-        rows.append(
-            {
-                "시간": ts,
-                "ID": user_display_name,
-                "품번": item_code,
-                "품명": item_name,
-                "로트번호": lot,
-                "통번호": drum_no,
-                "변경 전 용량": old_qty,
-                "변경 후 용량": new_qty,
-                "변화량": moved_qty,
-                "변경 전 위치": old_loc,
-                "변경 후 위치": to_zone,
-            }
-        )
 
-    new_df = pd.DataFrame(rows)
+# ==============================
+# 원장 연산 (화면 없이 쓰는 공용 코어: 이동 탭 / 일괄 CLI / 스캐너 입력)
+#  - st.session_state에는 파일 바이트와 사용자 이름만 기대한다 (bare 실행에서도 동작)
+#  - 여러 통 이동 = 이동 이력 행을 한 번에 만들고, 이력 1회 추가 + 원장 1회 저장
+# ==============================
+MOVE_STATUSES = ["잔량", "생산대기", "생산종료"]
+
 
-    # 기존 로그 불러오기 (세션/로컬/S3)
-    if "move_log_csv_bytes" in ss:
-        try:
-            old_df = pd.read_csv(io.BytesIO(ss["move_log_csv_bytes"]))
-        except Exception:
-            old_df = pd.DataFrame()
-    elif os.path.exists(MOVE_LOG_CSV):
-        try:
-            old_df = pd.read_csv(MOVE_LOG_CSV)
-        except Exception:
-            old_df = pd.DataFrame()
-    else:
-        s3_bytes = s3_download_bytes(MOVE_LOG_CSV)
-        if s3_bytes is not None:
-            try:
-                old_df = pd.read_csv(io.BytesIO(s3_bytes))
-            except Exception:
-                old_df = pd.DataFrame()
-        else:
-            old_df = pd.DataFrame()
+def plan_moves(df: pd.DataFrame, moves: pd.DataFrame, user: str = None, status: str = None) -> tuple:
+    """
+    이동 요청 → (이동 이력 행, 거절 행). 원장/이력은 건드리지 않는다.
+    moves 컬럼: 로트번호, 통번호, 이동 위치, [잔량], [상태], [ID]
+      - 잔량이 없으면 기존 용량 그대로, 있으면 0 ~ 기존 용량으로 보정
+      - 상태: 외주로 가면 '외주', 아니면 행의 상태 > status 인자 > 기존 상태
+      - ID: 행마다 기록할 사용자 (없으면 user 인자)
+      - 이동 위치는 known_locations에 있어야 한다 (오타로 새 구역이 생기지 않도록)
+      - 통번호는 정수여야 한다 (2.7 같은 값은 '통번호 없음', 2와 "2"는 같은 통)
+    거절 행에는 '사유' 컬럼이 붙는다.
+    """
+    if user is None:
+        user = st.session_state.get("user_name", "")
+
+    m = moves.reset_index(drop=True).copy()
+    for c in ["잔량", "상태", "ID"]:
+        if c not in m.columns:
+            m[c] = pd.NA
+    m["_lot"] = m["로트번호"].astype(str).str.strip().str.lower()
+    drum = pd.to_numeric(m["통번호"], errors="coerce")
+    no_drum = drum.isna() | (drum % 1 != 0)
+    m["_drum"] = drum.where(~no_drum, -1).astype(int)
+    m["_to"] = m["이동 위치"].fillna("").astype(str).map(normalize_location)
+
+    lookup = pd.Series(np.arange(len(df)), index=_drum_keys(df))
+    lookup = lookup[~lookup.index.duplicated()]
+    pos = lookup.reindex(
+        pd.MultiIndex.from_arrays([m["_lot"], m["_drum"]])
+    ).to_numpy()
+
+    reason = pd.Series("", index=m.index)
+    reason[m["_to"] == ""] = "이동 위치 없음"
+    unknown = (m["_to"] != "") & ~m["_to"].isin(known_locations(df))
+    reason[unknown] = "알 수 없는 이동 위치: " + m.loc[unknown, "_to"]
+    reason[(reason == "") & np.isnan(pos)] = "원장에 없는 통"
+    reason[no_drum.to_numpy()] = "통번호 없음"
+    dup = m.duplicated(subset=["_lot", "_drum"], keep="last")
+    reason[(reason == "") & dup] = "같은 통 중복 (마지막 요청만 반영)"
+
+    ok = (reason == "").to_numpy()
+    cur = df.iloc[pos[ok].astype(int)].reset_index(drop=True)
+    req = m[ok].reset_index(drop=True)
+
+    old_qty = cur["통용량"].astype(float)
+    new_qty = pd.to_numeric(req["잔량"], errors="coerce").fillna(old_qty).clip(lower=0, upper=old_qty)
+    new_status = req["상태"].where(req["상태"].isin(MOVE_STATUSES), status)
+    new_status = new_status.fillna(cur["상태"]).where(req["_to"] != "외주", "외주")
+
+    unchanged = (cur["현재위치"] == req["_to"]) & (old_qty == new_qty) & (cur["상태"] == new_status)
+    ok_idx = m.index[ok]
+    reason[ok_idx[unchanged.to_numpy()]] = "변경 없음"
+    keep = ~unchanged.to_numpy()
+
+    events = pd.DataFrame(
+        {
+            "시간": now_kst_str(),
+            "ID": req["ID"].where(req["ID"].notna() & (req["ID"].astype(str).str.strip() != ""), user),
+            "품번": cur["품목코드"],
+            "품명": cur["품명"],
+            "로트번호": cur["로트번호"],
+            "통번호": cur["통번호"].astype(int),
+            "변경 전 용량": old_qty,
+            "변경 후 용량": new_qty,
+            "변화량": old_qty - new_qty,
+            "변경 전 위치": cur["현재위치"],
+            "변경 후 위치": req["_to"],
+            "상태": new_status,
+            "제품라인": "",
+            "제조일자": "",
+            "이벤트": EVENT_MOVE,
+        }
+    )[keep].reset_index(drop=True)
 
-    log_df = pd.concat([old_df, new_df], ignore_index=True)
+    rejected = moves.reset_index(drop=True)[(reason != "").to_numpy()].assign(사유=reason[reason != ""].to_numpy())
+    return events, rejected
 
-    # 1) 세션에 다시 저장
-    buf = io.BytesIO()
-    log_df.to_csv(buf, index=False, encoding="utf-8-sig")
-    data = buf.getvalue()
-    ss["move_log_csv_bytes"] = data
 
-    _load_move_log_core.clear()
+def commit_moves(moves: pd.DataFrame, user: str = None, status: str = None) -> tuple:
+    """
+    여러 통 이동을 한 번에 반영: 이동 이력 1회 추가(커밋ID 하나) → 원장 1회 저장.
+    return: (반영한 이동 이력 행 + 커밋ID, 거절 행)
+    """
+    with ledger_lock():
+        df = load_drums()
+        events, rejected = plan_moves(df, moves, user=user, status=status)
+        if not events.empty:
+            events = events.assign(커밋ID=append_move_log(events))
+            save_drums(apply_log_events(df, events))
+    return events, rejected
 
-    # 2) 로컬 CSV에도 저장 (로컬 실행용)
-    try:
-        log_df.to_csv(MOVE_LOG_CSV, index=False, encoding="utf-8-sig")
-    except Exception:
-        pass
 
-    # 3) S3 업로드
-    s3_upload_bytes(MOVE_LOG_CSV, data)
+def rollback_commit(commit_id: str) -> int:
+    """
+    커밋ID 하나(일괄 이동 한 번)에 속한 이동 이력을 지우고 원장을 되돌린다.
+    그 뒤에 같은 통의 이력이 더 있으면 ValueError. return: 삭제한 이력 행 수
+    """
+    with ledger_lock():
+        log_df = load_move_log()
+        hit = log_df["커밋ID"].astype(str) == str(commit_id)
+        if not hit.any():
+            return 0
+
+        keys = pd.DataFrame(
+            {
+                "lot": log_df["로트번호"].astype(str).str.strip().str.lower(),
+                "drum": pd.to_numeric(log_df["통번호"], errors="coerce"),
+            }
+        )
+        blocked = hit & keys.duplicated(keep="last")
+        if blocked.any():
+            names = (log_df.loc[blocked, "로트번호"].astype(str) + " / 통 " + log_df.loc[blocked, "통번호"].astype(str))
+            raise ValueError("더 새로운 이력이 있어 롤백할 수 없습니다: " + ", ".join(names))
+
+        return len(rollback_log_rows(log_df, hit.to_numpy()))
+
+
+INTEGRITY_CHECKS = [
+    (
+        "용량 0인데 소진/폐기가 아닌 통",
+        lambda d: d[(d["통용량"] == 0) & ~d["현재위치"].isin(["소진", "폐기"])],
+    ),
+    (
+        "위치는 외주인데 상태가 외주가 아닌 통",
+        lambda d: d[(d["현재위치"] == "외주") & (d["상태"] != "외주")],
+    ),
+    (
+        "같은 로트번호/통번호가 두 번 이상 있는 통",
+        lambda d: d[_drum_keys(d).duplicated(keep=False)],
+    ),
+]
+
+
+def check_integrity(df_all: pd.DataFrame, job=None) -> dict:
+    """제목 → 문제 행 DataFrame (문제 없는 항목은 제외)."""
+    problems = {}
+    for i, (title, check) in enumerate(INTEGRITY_CHECKS):
+        if job is not None:
+            job.update(i / len(INTEGRITY_CHECKS), title)
+        found = check(df_all)
+        if not found.empty:
+            problems[title] = found
+    return problems
 
 
 # ==============================
@@ -732,11 +2785,11 @@ def write_move_log(item_code: str, item_name: str, lot: str, drum_infos, from_zo
 from datetime import datetime as dt_for_caption
 
 
-@st.cache_data(show_spinner=False, ttl=60)
 def last_upload_caption(filename: str) -> str:
     """
     파일의 마지막 업로드 시간을 KST(UTC+9) 시간으로 표시
     1) S3 → 2) 로컬 파일 → 3) 없으면 표시 없음
+    S3는 s3_metadata_snapshot을 쓰므로 파일 수와 관계없이 목록 조회 최대 1번.
     """
     from datetime import timezone, timedelta, datetime as dt
 
@@ -746,19 +2799,11 @@ def last_upload_caption(filename: str) -> str:
     # ------------------------
     # 1) S3 timestamp
     # ------------------------
-    try:
-        if s3_enabled():
-            client = get_s3_client()
-            if client:
-                s3_path = _s3_key(filename)
-                resp = client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_path)
-
-                lm = resp["LastModified"]     # timezone-aware datetime
-                lm_kst = lm.astimezone(KST)   # 👉 KST 로 변환
-
-                return f"S3 마지막 수정: {lm_kst.strftime('%Y-%m-%d %H:%M:%S')}"
-    except Exception:
-        pass
+    meta = s3_metadata_snapshot().get(filename)
+    if meta is not None:
+        lm = meta["LastModified"]     # timezone-aware datetime
+        lm_kst = lm.astimezone(KST)   # 👉 KST 로 변환
+        return f"S3 마지막 수정: {lm_kst.strftime('%Y-%m-%d %H:%M:%S')}"
 
     # ------------------------
     # 2) Local file timestamp
@@ -854,60 +2899,58 @@ def render_file_loader():
         stock_bytes = stock_file.read()
         move_bytes = move_file.read() if move_file is not None else None
 
-        ss["bulk_csv_bytes"] = bulk_bytes
-        ss["prod_xlsx_bytes"] = prod_bytes
-        ss["recv_xlsx_bytes"] = recv_bytes
-        ss["stock_xlsx_bytes"] = stock_bytes
+        set_session_bytes("bulk_csv_bytes", bulk_bytes)
+        set_session_bytes("prod_xlsx_bytes", prod_bytes)
+        set_session_bytes("recv_xlsx_bytes", recv_bytes)
+        set_session_bytes("stock_xlsx_bytes", stock_bytes)
         if move_bytes is not None:
-            ss["move_log_csv_bytes"] = move_bytes
+            set_session_bytes("move_log_csv_bytes", move_bytes)
 
         # 🔹 S3 업로드 (원본 바이트 그대로 보관)
-        s3_upload_bytes(CSV_PATH, bulk_bytes)
+        #    원장/이력 CSV는 로컬 저장과 함께 백그라운드 저장 큐로 (순서 보장)
+        persist_file(CSV_PATH, bulk_bytes)
         s3_upload_bytes(PRODUCTION_FILE, prod_bytes)
         s3_upload_bytes(RECEIVE_FILE, recv_bytes)
         s3_upload_bytes(STOCK_FILE, stock_bytes)
         if move_bytes is not None:
-            s3_upload_bytes(MOVE_LOG_CSV, move_bytes)
+            persist_file(MOVE_LOG_CSV, move_bytes)
 
         # ---------- 2) 서버 로컬 파일로도 저장 (이후 세션에서 재사용) ----------
-        try:
-            _load_drums_core.clear()
-            df_bulk = _load_drums_core(bulk_bytes)
-            df_bulk.to_csv(CSV_PATH, index=False, encoding="utf-8-sig")
-        except Exception:
-            pass
+        _load_drums_core.clear()
 
         try:
             _load_production_core.clear()
-            df_prod = _load_production_core(prod_bytes)
+            df_prod = load_production()
             df_prod.to_excel(PRODUCTION_FILE, index=False)
         except Exception:
             pass
 
         try:
             _load_receive_core.clear()
-            df_recv = _load_receive_core(recv_bytes)
+            df_recv = load_receive()
             df_recv.to_excel(RECEIVE_FILE, index=False)
         except Exception:
             pass
 
         try:
             _load_stock_core.clear()
-            df_stock = _load_stock_core(stock_bytes)
+            df_stock = load_stock()
             df_stock.to_excel(STOCK_FILE, index=False)
         except Exception:
             pass
 
         if move_bytes is not None:
-            try:
-                _load_move_log_core.clear()
-                df_move = _load_move_log_core(move_bytes)
-                df_move.to_csv(MOVE_LOG_CSV, index=False, encoding="utf-8-sig")
-            except Exception:
-                pass
+            _load_move_log_core.clear()
+
+        # 업로드한 원장/이력을 새 기준점(체크포인트)으로 등록
+        reset_checkpoints(load_all_drums(), len(load_move_log()))
+
+        # production / receive 의 새 로트 통을 미리 생성
+        materialize_uploaded_lots()
 
         # ---------- 3) 플래그 세팅 후 메인으로 ----------
         ss["data_initialized"] = True
+        ss["ledger_synced"] = True
 
         st.success("파일 업로드가 완료되었습니다. 메인 화면으로 이동합니다.")
         st.rerun()
@@ -942,95 +2985,774 @@ def render_login():
             ss["user_id"] = (login_id or "").strip()
             ss["user_name"] = user["display_name"]
 
-            # 🔹 마지막에 성공적으로 로그인한 ID 기억
-            ss["last_login_id"] = (login_id or "").strip()
+            # 🔹 마지막에 성공적으로 로그인한 ID 기억
+            ss["last_login_id"] = (login_id or "").strip()
+
+            # 혹시 예전에 쓰던 로그인 유지 관련 키가 있다면 정리 (선택 사항)
+            for k in ["remember_me", "login_remember_checkbox"]:
+                if k in ss:
+                    del ss[k]
+
+            st.success(f"{user['display_name']}님, 환영합니다.")
+            st.rerun()
+        else:
+            st.error("ID 또는 비밀번호가 올바르지 않습니다.")
+
+# ----- stock.xlsx 창고 대분류 -----
+STOCK_ONSITE_CODES = {"WC301", "WC501", "WC502", "WC503", "WC504"}
+STOCK_WAREHOUSE_CODES = {"WH201", "WH701", "WH301", "WH601", "WH401", "WH506"}
+STOCK_DEFECT_CODES = {"WH001", "WH102"}
+STOCK_INDEX_COLS = ["창고/작업장", "창고/작업장명", "품번", "로트번호", "실재고수량"]
+
+
+def classify_stock_warehouse(code: str) -> str:
+    code = str(code).strip()
+    if code in STOCK_ONSITE_CODES:
+        return "자사"
+    if code in STOCK_WAREHOUSE_CODES:
+        return "창고"
+    if code in STOCK_DEFECT_CODES:
+        return "불량"
+    return "외주"
+
+
+def build_stock_index(stock_df: pd.DataFrame):
+    """
+    stock.xlsx → (품번, 로트번호) 인덱스 재고표 (실재고 0 제외, 대분류 포함).
+    필요한 컬럼이 없으면 None.
+    """
+    if stock_df is None:
+        return None
+    for c in STOCK_INDEX_COLS:
+        if c not in stock_df.columns:
+            return None
+
+    df = stock_df[STOCK_INDEX_COLS].copy()
+    df["품번"] = df["품번"].astype(str).str.strip()
+    df["로트번호"] = df["로트번호"].astype(str).str.strip().str.upper()
+    df["실재고수량"] = pd.to_numeric(df["실재고수량"], errors="coerce").fillna(0)
+    df = df[df["실재고수량"] != 0]
+    df["대분류"] = df["창고/작업장"].map(classify_stock_warehouse)
+    return df.set_index(["품번", "로트번호"]).sort_index()
+
+
+def stock_index():
+    """
+    현재 stock.xlsx의 조회용 인덱스 (세션에 보관).
+    stock 버전이 바뀌면 새로 만든다. 재업로드 시에는 patch_stock_index로 변경분만 반영.
+    """
+    ss = st.session_state
+    src = session_source("stock_xlsx_bytes", STOCK_FILE)[0]
+    cached = ss.get("stock_index", None)
+    if cached is None or cached[0] != src:
+        cached = (src, build_stock_index(load_stock()))
+        ss["stock_index"] = cached
+    return cached[1]
+
+
+def patch_stock_index(new_stock: pd.DataFrame, changes: pd.DataFrame, old_src, new_src):
+    """
+    변경분에 걸린 (품번, 로트번호)만 새 stock에서 다시 만들어 인덱스에 덮어쓴다.
+    세션의 인덱스가 직전 버전(old_src) 것이 아니면 버리고 다음 조회 때 새로 만든다.
+    """
+    ss = st.session_state
+    cached = ss.get("stock_index", None)
+    if cached is None or cached[0] != old_src or cached[1] is None:
+        ss.pop("stock_index", None)
+        return
+    idx = cached[1]
+
+    touched = pd.MultiIndex.from_arrays(
+        [
+            changes["품번"].astype(str).str.strip(),
+            changes["로트번호"].astype(str).str.strip().str.upper(),
+        ]
+    ).unique()
+    new_keys = pd.MultiIndex.from_arrays(
+        [
+            new_stock["품번"].astype(str).str.strip(),
+            new_stock["로트번호"].astype(str).str.strip().str.upper(),
+        ]
+    )
+    fresh = build_stock_index(new_stock[new_keys.isin(touched)])
+    patched = pd.concat([idx[~idx.index.isin(touched)], fresh]).sort_index()
+    ss["stock_index"] = (new_src, patched)
+
+
+def get_stock_summary(item_code: str, lot: str):
+    """
+    stock.xlsx에서 '품번 + 로트번호' 기준으로 전산 재고 요약을 구한다.
+
+    stock.xlsx 컬럼 구조 (중요):
+      - A열: 창고/작업장
+      - B열: 창고/작업장명
+      - C열: 품번
+      - G열: 로트번호
+      - K열: 실재고수량
+    """
+    idx = stock_index()
+    if idx is None or idx.empty:
+        # 필요한 컬럼이 하나라도 없거나 재고가 없으면 요약 불가
+        return None, ""
+
+    # 품번 + 로트번호 완전 일치
+    key = (str(item_code).strip(), str(lot).strip().upper())
+    if key not in idx.index:
+        return None, ""
+    df = idx.loc[[key]].reset_index()
+
+    # 화면에서 쓰기 좋게 컬럼 이름 정리
+    summary = df[["창고/작업장", "창고/작업장명", "품번", "로트번호", "실재고수량", "대분류"]].copy()
+    summary = summary.rename(
+        columns={
+            "창고/작업장": "창고코드",
+            "창고/작업장명": "창고명",
+        }
+    )
+
+    # 재고 많은 순으로 정렬
+    summary = summary.sort_values("실재고수량", ascending=False).reset_index(drop=True)
+
+    return summary, ""
+
+
+# ==============================
+# 원장 ↔ 전산 재고 대조 (창고 전체)
+#  - 원장 kg을 (품번, 로트번호, 대분류)로 한 번에 묶고 stock.xlsx 인덱스와 외부 병합
+#  - 결과는 (원장 버전, stock 버전, 허용 오차) 조합별로 캐시
+# ==============================
+RECONCILE_TOLERANCE_KG = float(os.getenv("RECONCILE_TOLERANCE_KG", "0.5"))
+RECONCILE_KEYS = ["품번", "로트번호", "대분류"]
+LEDGER_ONSITE_FLOORS = ["2층", "4층", "5층", "6층"]
+
+
+def ledger_place(loc: pd.Series) -> pd.Series:
+    """원장 현재위치 → stock.xlsx와 같은 대분류 (자사/외주/창고, 그 외는 기타)."""
+    floor = loc.astype(str).str.strip().str.split(" ").str[0]
+    return pd.Series(
+        np.select(
+            [floor.isin(LEDGER_ONSITE_FLOORS), floor == "외주", floor == "창고"],
+            ["자사", "외주", "창고"],
+            default="기타",
+        ),
+        index=loc.index,
+    )
+
+
+@loader_cache("reconcile", max_entries=4, max_mb=32)
+def _reconcile_core(drums_version, stock_version, tolerance, _drums, _stock_idx):
+    """
+    원장(소진/폐기 제외) kg과 전산 실재고를 (품번, 로트번호, 대분류) 단위로 비교한 불일치 목록.
+    전산 쪽은 원장에 있는 품번만 본다 (원료/완제품 등 벌크 외 재고 제외).
+    """
+    live = _drums[~consumed_mask(_drums)]
+    led = pd.DataFrame(
+        {
+            "품번": live["품목코드"].astype(str).str.strip(),
+            "로트번호": live["로트번호"].astype(str).str.strip().str.upper(),
+            "대분류": ledger_place(live["현재위치"]),
+            "원장_kg": pd.to_numeric(live["통용량"], errors="coerce").fillna(0),
+        }
+    )
+    led = led.groupby(RECONCILE_KEYS, sort=False).agg(
+        통수=("원장_kg", "size"), 원장_kg=("원장_kg", "sum")
+    )
+
+    if _stock_idx is None or _stock_idx.empty:
+        stk = pd.DataFrame(columns=RECONCILE_KEYS + ["전산_kg"]).set_index(RECONCILE_KEYS)
+    else:
+        items = _drums["품목코드"].astype(str).str.strip().unique()
+        stk = _stock_idx[_stock_idx.index.get_level_values("품번").isin(items)].reset_index()
+        stk = stk.groupby(RECONCILE_KEYS, sort=False)["실재고수량"].sum().to_frame("전산_kg")
+
+    rep = led.join(stk, how="outer").reset_index()
+    rep["통수"] = rep["통수"].fillna(0).astype(int)
+    rep["원장_kg"] = rep["원장_kg"].astype(float).fillna(0)
+    rep["전산_kg"] = pd.to_numeric(rep["전산_kg"], errors="coerce").fillna(0)
+    rep["차이_kg"] = rep["원장_kg"] - rep["전산_kg"]
+
+    # 로트 합계는 맞는데 대분류만 다르면 '위치 차이'
+    lot_diff = rep.groupby(["품번", "로트번호"])["차이_kg"].transform("sum")
+    rep["구분"] = np.select(
+        [
+            lot_diff.abs() <= tolerance,
+            rep["전산_kg"] == 0,
+            rep["원장_kg"] == 0,
+        ],
+        ["위치 차이", "원장만", "전산만"],
+        default="수량 차이",
+    )
+
+    rep = rep[rep["차이_kg"].abs() > tolerance]
+    order = rep["차이_kg"].abs().sort_values(ascending=False).index
+    return rep.loc[order, ["품번", "로트번호", "대분류", "구분", "통수", "원장_kg", "전산_kg", "차이_kg"]].reset_index(drop=True)
+
+
+def reconcile_stock(tolerance: float = RECONCILE_TOLERANCE_KG) -> pd.DataFrame:
+    """현재 원장 × 현재 stock.xlsx 대조 결과 (같은 버전 조합이면 캐시에서)."""
+    drums_ver = session_source("bulk_csv_bytes", CSV_PATH)[0]
+    stock_ver = session_source("stock_xlsx_bytes", STOCK_FILE)[0]
+    return _reconcile_core(drums_ver, stock_ver, float(tolerance), load_drums(), stock_index())
+
+
+# ==============================
+# 백그라운드 작업 (백업 / 점검 / 대조 보고서)
+#  - 프로세스 공용 작업 큐 + 워커 풀: 버튼을 눌러도 세션이 막히지 않고, rerun 후에도 결과가 남는다
+#  - 같은 (작업 종류, 입력 데이터 버전)이면 다시 돌리지 않고 기존 작업/결과를 돌려준다
+#  - 작업 함수는 워커 스레드에서 돌므로 st.* / 세션 접근 금지 (입력은 제출할 때 넘긴다)
+# ==============================
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_KEEP = int(os.getenv("JOB_KEEP", "20"))   # 끝난 작업(결과) 보관 개수
+JOB_QUEUED = "대기"
+JOB_RUNNING = "실행 중"
+JOB_DONE = "완료"
+JOB_FAILED = "실패"
+JOB_CANCELLED = "취소"
+JOB_ACTIVE = {JOB_QUEUED, JOB_RUNNING}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind: str, label: str, key: tuple, owner: str):
+        self.id = uuid.uuid4().hex[:8]
+        self.kind = kind
+        self.label = label
+        self.key = key
+        self.owner = owner
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = ""
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def update(self, progress: float, message: str = ""):
+        """작업 함수에서 진행률(0~1) 보고. 취소 요청이 들어와 있으면 여기서 중단된다."""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.progress = min(max(float(progress), 0.0), 1.0)
+        if message:
+            self.message = message
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+@st.cache_resource(show_spinner=False)
+def _job_runner() -> dict:
+    return {
+        "pool": ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="bulk-job"),
+        "jobs": OrderedDict(),   # id → Job (제출 순)
+        "lock": threading.Lock(),
+    }
+
+
+def _run_job(job: Job, func, args):
+    if job.cancel_event.is_set():
+        job.status = JOB_CANCELLED
+        job.finished = time.time()
+        return
+    job.status = JOB_RUNNING
+    job.started = time.time()
+    try:
+        job.result = func(job, *args)
+        job.progress = 1.0
+        job.status = JOB_DONE
+    except JobCancelled:
+        job.status = JOB_CANCELLED
+    except Exception as e:
+        job.error = f"{type(e).__name__}: {e}"
+        job.status = JOB_FAILED
+    finally:
+        job.finished = time.time()
+
+
+def _trim_jobs(jobs: OrderedDict):
+    """끝난 작업이 JOB_KEEP개를 넘으면 오래된 것부터 버린다 (실행 중인 작업은 유지)."""
+    done = [jid for jid, j in jobs.items() if j.status not in JOB_ACTIVE]
+    for jid in done[: max(len(done) - JOB_KEEP, 0)]:
+        del jobs[jid]
+
+
+def submit_job(kind: str, label: str, versions: tuple, func, *args) -> Job:
+    """
+    func(job, *args)를 워커 풀에 넣는다.
+    같은 kind + versions로 대기/실행 중이거나 완료된 작업이 있으면 그 작업을 그대로 돌려준다.
+    """
+    runner = _job_runner()
+    key = (kind,) + tuple(versions)
+    with runner["lock"]:
+        for job in reversed(runner["jobs"].values()):
+            if job.key == key and (job.status in JOB_ACTIVE or job.status == JOB_DONE):
+                return job
+        job = Job(kind, label, key, st.session_state.get("user_name", ""))
+        runner["jobs"][job.id] = job
+        _trim_jobs(runner["jobs"])
+    job.future = runner["pool"].submit(_run_job, job, func, args)
+    return job
+
+
+def get_job(job_id: str):
+    return _job_runner()["jobs"].get(job_id)
+
+
+def find_job(kind: str, versions: tuple):
+    """같은 kind + versions로 가장 최근에 제출된 작업 (없으면 None)."""
+    key = (kind,) + tuple(versions)
+    runner = _job_runner()
+    with runner["lock"]:
+        for job in reversed(runner["jobs"].values()):
+            if job.key == key:
+                return job
+    return None
+
+
+def cancel_job(job_id: str):
+    job = get_job(job_id)
+    if job is None or job.status not in JOB_ACTIVE:
+        return
+    job.cancel_event.set()
+    # 아직 대기 중이면 워커에 들어가기 전에 바로 취소
+    if job.future is not None and job.future.cancel():
+        job.status = JOB_CANCELLED
+        job.finished = time.time()
+
+
+def job_table() -> pd.DataFrame:
+    runner = _job_runner()
+    with runner["lock"]:
+        jobs = list(runner["jobs"].values())
+    return pd.DataFrame(
+        [
+            {
+                "ID": j.id,
+                "작업": j.label,
+                "요청자": j.owner,
+                "상태": j.status,
+                "진행률(%)": round(j.progress * 100),
+                "요청 시각": datetime.fromtimestamp(j.submitted, KST).strftime("%H:%M:%S"),
+                "소요(초)": round(j.elapsed(), 1),
+            }
+            for j in reversed(jobs)
+        ]
+    )
+
+
+@st.fragment(run_every=1)
+def _job_progress(job_id: str):
+    job = get_job(job_id)
+    if job is None or job.status not in JOB_ACTIVE:
+        st.rerun()
+    st.progress(job.progress, text=f"{job.label} {job.status}… {job.message}")
+    if st.button("취소", key=f"job_cancel_{job_id}"):
+        cancel_job(job_id)
+        st.rerun()
+
+
+def show_job(job, render_result):
+    """작업 상태 표시: 진행 중이면 진행률(1초마다 갱신), 끝났으면 render_result(결과)."""
+    if job is None:
+        return
+    if job.status in JOB_ACTIVE:
+        _job_progress(job.id)
+    elif job.status == JOB_DONE:
+        done_at = datetime.fromtimestamp(job.finished, KST).strftime("%H:%M:%S")
+        st.caption(f"{job.label} · {job.owner} · {done_at} 완료 ({job.elapsed():.1f}초)")
+        render_result(job.result)
+    elif job.status == JOB_FAILED:
+        st.error(f"{job.label} 실패: {job.error}")
+    else:
+        st.info(f"{job.label} 작업이 취소되었습니다.")
+
+
+# ----- 작업 함수 (워커 스레드에서 실행) -----
+def run_integrity_job(job: Job, df_all: pd.DataFrame) -> dict:
+    return check_integrity(df_all, job=job)
+
+
+def run_reconcile_job(job: Job, drums_ver, stock_ver, tolerance, drums, idx) -> pd.DataFrame:
+    job.update(0.1, "원장/전산 재고 집계")
+    return _reconcile_core(drums_ver, stock_ver, tolerance, drums, idx)
+
+
+# ==============================
+# 원장 백업 (내용 기반 청크 + 중복 제거 + 보존 정책)
+#  - 스냅샷 = 원장/보관 원장/이동 이력 CSV 각각의 청크 해시 목록 (manifest JSON)
+#  - 청크 경계는 줄 내용으로 정한다 → 행 추가/수정 시 바뀐 주변 청크만 새로 저장
+#  - 청크는 sha256 이름으로 한 번만 저장 (로컬 + S3), 보존 정책에서 빠진 스냅샷의 청크는 정리
+# ==============================
+BACKUP_DIR = "ledger_backups"
+BACKUP_CHUNK_DIR = f"{BACKUP_DIR}/chunks"
+BACKUP_SNAPSHOT_DIR = f"{BACKUP_DIR}/snapshots"
+BACKUP_CHUNK_MIN = 16 * 1024          # 청크 최소 크기 (바이트)
+BACKUP_CHUNK_MAX = 1024 * 1024        # 청크 최대 크기
+BACKUP_CHUNK_MASK = 0x1FF             # 최소 크기 이후 평균 512줄마다 경계
+BACKUP_INTERVAL_MIN = int(os.getenv("BACKUP_INTERVAL_MIN", "60"))   # 자동 백업 주기 (0 = 끄기)
+BACKUP_KEEP_LAST = int(os.getenv("BACKUP_KEEP_LAST", "10"))         # 최근 N개는 구간과 무관하게 유지
+BACKUP_KEEP_HOURLY = int(os.getenv("BACKUP_KEEP_HOURLY", "24"))
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", "14"))
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", "8"))
+BACKUP_CHUNK_GRACE_MIN = int(os.getenv("BACKUP_CHUNK_GRACE_MIN", "60"))  # 이보다 최근 청크는 참조가 없어도 남김 (다른 호스트에서 진행 중인 백업)
+
+# (파일명, 세션 키)
+BACKUP_FILES = [
+    (CSV_PATH, "bulk_csv_bytes"),
+    (ARCHIVE_CSV, "archive_csv_bytes"),
+    (MOVE_LOG_CSV, "move_log_csv_bytes"),
+]
+
+
+def split_chunks(data: bytes) -> list:
+    """줄 단위 내용 기반 청크 분할 (줄의 crc32 하위 비트가 0인 줄 끝에서 자른다)."""
+    chunks = []
+    start = pos = 0
+    for line in data.splitlines(keepends=True):
+        pos += len(line)
+        size = pos - start
+        if size >= BACKUP_CHUNK_MIN and (
+            (zlib.crc32(line) & BACKUP_CHUNK_MASK) == 0 or size >= BACKUP_CHUNK_MAX
+        ):
+            chunks.append(data[start:pos])
+            start = pos
+    if start < len(data):
+        chunks.append(data[start:])
+    return chunks
+
+
+def _chunk_path(digest: str) -> str:
+    return f"{BACKUP_CHUNK_DIR}/{digest}.gz"
+
+
+def _snapshot_path(snap_id: str) -> str:
+    return f"{BACKUP_SNAPSHOT_DIR}/{snap_id}.json"
+
+
+def _backup_put(path: str, data: bytes) -> bool:
+    """로컬 + S3 저장. 둘 중 하나라도 성공하면 True."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    except Exception:
+        pass
+    local_ok = _write_local_atomic(path, data)
+    s3_ok = s3_upload_bytes(path, data, notify=False) if s3_enabled() else False
+    return local_ok or s3_ok
+
+
+def _backup_get(path: str):
+    if os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except Exception:
+            pass
+    return s3_download_bytes(path)
+
+
+def _backup_delete(path: str):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+    s3_delete(path)
+
+
+def _backup_list(folder: str, suffix: str) -> dict:
+    """folder 아래 {파일 이름(확장자 제외): 마지막 수정 시각(epoch 초)}. 로컬 + S3 합집합 (둘 다 있으면 최근 값)."""
+    found = {}
+    if os.path.isdir(folder):
+        for n in os.listdir(folder):
+            try:
+                found[n] = os.stat(os.path.join(folder, n)).st_mtime
+            except OSError:
+                continue
+    for n, modified in s3_list_objects(folder).items():
+        found[n] = max(found.get(n, 0.0), modified.timestamp())
+    return {n[: -len(suffix)]: t for n, t in found.items() if n.endswith(suffix)}
 
-            # 혹시 예전에 쓰던 로그인 유지 관련 키가 있다면 정리 (선택 사항)
-            for k in ["remember_me", "login_remember_checkbox"]:
-                if k in ss:
-                    del ss[k]
 
-            st.success(f"{user['display_name']}님, 환영합니다.")
-            st.rerun()
-        else:
-            st.error("ID 또는 비밀번호가 올바르지 않습니다.")
+@st.cache_resource(show_spinner=False)
+def _backup_catalog() -> dict:
+    """스냅샷 manifest 캐시 (manifest는 만든 뒤 바뀌지 않으므로 id별로 한 번만 읽는다)."""
+    return {"lock": threading.Lock(), "manifests": {}, "last_auto": 0.0}
 
-def get_stock_summary(item_code: str, lot: str):
-    """
-    stock.xlsx에서 '품번 + 로트번호' 기준으로 전산 재고 요약을 구한다.
 
-    stock.xlsx 컬럼 구조 (중요):
-      - A열: 창고/작업장
-      - B열: 창고/작업장명
-      - C열: 품번
-      - G열: 로트번호
-      - K열: 실재고수량
+@st.cache_data(show_spinner=False, ttl=S3_ETAG_TTL)
+def _snapshot_ids() -> dict:
     """
-    stock_df = load_stock()
-    if stock_df is None or stock_df.empty:
-        return None, ""
+    스냅샷 id 목록 (S3_ETAG_TTL초 캐시).
+    데이터 탭은 백업 패널을 접어 둬도 다시 그릴 때마다 목록을 보므로 S3 목록 조회를 매번 하지 않도록.
+    백업 생성/정리는 잠금 안에서 비우고 다시 읽는다.
+    """
+    return _backup_list(BACKUP_SNAPSHOT_DIR, ".json")
+
+
+def list_backups() -> list:
+    """저장된 스냅샷 manifest 목록 (최신순)."""
+    catalog = _backup_catalog()
+    ids = _snapshot_ids()
+    with catalog["lock"]:
+        manifests = catalog["manifests"]
+        for snap_id in list(manifests):
+            if snap_id not in ids:
+                del manifests[snap_id]
+        missing = [i for i in ids if i not in manifests]
+    for snap_id in missing:
+        raw = _backup_get(_snapshot_path(snap_id))
+        if raw is None:
+            continue
+        try:
+            man = json.loads(raw)
+        except Exception:
+            continue
+        with catalog["lock"]:
+            catalog["manifests"][snap_id] = man
+    with catalog["lock"]:
+        return sorted(catalog["manifests"].values(), key=lambda m: m["created"], reverse=True)
 
-    df = stock_df.copy()
 
-    # 필수 컬럼만 남기고, 이름 통일
-    required_cols = ["창고/작업장", "창고/작업장명", "품번", "로트번호", "실재고수량"]
-    for c in required_cols:
-        if c not in df.columns:
-            # 필요한 컬럼이 하나라도 없으면 요약 불가
-            return None, ""
+def create_backup(files: dict, user: str = "", reason: str = "수동", job: Job = None) -> dict:
+    """
+    files: {파일명: 바이트(None이면 제외)} 스냅샷 저장.
+    직전 스냅샷과 내용이 같으면 새로 만들지 않고 그 manifest를 돌려준다.
+    return: manifest (+ 이번에 새로 저장한 청크 수/바이트: new_chunks / new_bytes)
+    """
+    files = {name: data for name, data in files.items() if data is not None}
+    digests = {name: hashlib.sha256(data).hexdigest() for name, data in files.items()}
+
+    # 정리(prune)와 겹치지 않게: 재사용하기로 한 기존 청크가 manifest 저장 전에 지워지면 스냅샷이 깨진다
+    with file_lock(BACKUP_DIR):
+        _snapshot_ids.clear()
+        snapshots = list_backups()
+        if snapshots and {n: f["sha256"] for n, f in snapshots[0]["files"].items()} == digests:
+            return dict(snapshots[0], new_chunks=0, new_bytes=0, unchanged=True)
+
+        known = {c for m in snapshots for f in m["files"].values() for c, _ in f["chunks"]}
+        entry = {}
+        new_chunks = new_bytes = 0
+        for i, (name, data) in enumerate(files.items()):
+            if job is not None:
+                job.update(i / max(len(files), 1), name)
+            chunk_list = []
+            for chunk in split_chunks(data):
+                digest = hashlib.sha256(chunk).hexdigest()
+                if digest not in known:
+                    _backup_put(_chunk_path(digest), pack_bytes(chunk))
+                    known.add(digest)
+                    new_chunks += 1
+                    new_bytes += len(chunk)
+                chunk_list.append([digest, len(chunk)])
+            entry[name] = {"sha256": digests[name], "size": len(data), "chunks": chunk_list}
+
+        now = datetime.now(KST)
+        manifest = {
+            "id": now.strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:4],
+            "created": now.isoformat(),
+            "user": user,
+            "reason": reason,
+            "files": entry,
+        }
+        # manifest는 청크를 모두 올린 다음에 저장 (중간에 끊겨도 깨진 스냅샷이 보이지 않게)
+        _backup_put(_snapshot_path(manifest["id"]), json.dumps(manifest, ensure_ascii=False).encode("utf-8"))
+        _snapshot_ids.clear()
+        catalog = _backup_catalog()
+        with catalog["lock"]:
+            catalog["manifests"][manifest["id"]] = manifest
+
+        prune_backups()
+        return dict(manifest, new_chunks=new_chunks, new_bytes=new_bytes, unchanged=False)
+
+
+def _backups_to_keep(snapshots: list) -> set:
+    """최근 BACKUP_KEEP_LAST개 + 시간별 / 일별 / 주별로 각 구간의 최신 스냅샷을 정해진 개수만큼 유지."""
+    keep = {m["id"] for m in snapshots[: max(BACKUP_KEEP_LAST, 1)]}
+    policies = [
+        (lambda t: t.strftime("%Y%m%d%H"), BACKUP_KEEP_HOURLY),
+        (lambda t: t.strftime("%Y%m%d"), BACKUP_KEEP_DAILY),
+        (lambda t: t.isocalendar()[:2], BACKUP_KEEP_WEEKLY),
+    ]
+    for period, limit in policies:
+        seen = set()
+        for m in snapshots:   # 최신순
+            p = period(datetime.fromisoformat(m["created"]))
+            if p not in seen and len(seen) < limit:
+                seen.add(p)
+                keep.add(m["id"])
+    return keep
 
-    # 문자열 정리
-    df["품번"] = df["품번"].astype(str).str.strip()
-    df["로트번호"] = df["로트번호"].astype(str).str.strip().str.upper()
 
-    item_key = str(item_code).strip()
-    lot_key = str(lot).strip().upper()
+def prune_backups() -> int:
+    """
+    보존 정책에서 빠진 스냅샷 삭제 + 어떤 스냅샷도 쓰지 않는 청크 정리. return: 삭제한 스냅샷 수
+    청크는 BACKUP_CHUNK_GRACE_MIN분이 지난 것만 지운다 (manifest를 아직 쓰지 않은 진행 중 백업의 청크 보호).
+    """
+    with file_lock(BACKUP_DIR):
+        return _prune_backups_locked()
+
+
+def _prune_backups_locked() -> int:
+    _snapshot_ids.clear()
+    snapshots = list_backups()
+    keep = _backups_to_keep(snapshots)
+    dropped = [m["id"] for m in snapshots if m["id"] not in keep]
+    if not dropped:
+        return 0
+
+    for snap_id in dropped:
+        _backup_delete(_snapshot_path(snap_id))
+    _snapshot_ids.clear()
+    catalog = _backup_catalog()
+    with catalog["lock"]:
+        for snap_id in dropped:
+            catalog["manifests"].pop(snap_id, None)
+
+    used = {c for m in snapshots if m["id"] in keep for f in m["files"].values() for c, _ in f["chunks"]}
+    cutoff = time.time() - BACKUP_CHUNK_GRACE_MIN * 60
+    for digest, modified in _backup_list(BACKUP_CHUNK_DIR, ".gz").items():
+        if digest not in used and modified < cutoff:
+            _backup_delete(_chunk_path(digest))
+    return len(dropped)
+
+
+def backup_manifest(snap_id: str):
+    for fresh in (False, True):
+        if fresh:
+            # 다른 프로세스가 방금 만든 스냅샷일 수 있다 (목록 캐시 TTL 안)
+            _snapshot_ids.clear()
+        for m in list_backups():
+            if m["id"] == snap_id:
+                return m
+    return None
+
+
+def backup_file_bytes(manifest: dict, name: str) -> bytes:
+    """스냅샷의 파일 하나를 청크로부터 다시 조립 (S3 청크는 병렬로 받는다). 해시가 안 맞으면 ValueError."""
+    entry = manifest["files"][name]
+    digests = [c for c, _ in entry["chunks"]]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        parts = list(pool.map(lambda d: _backup_get(_chunk_path(d)), digests))
+    if any(p is None for p in parts):
+        raise ValueError(f"{name}: 백업 청크가 없습니다.")
+    data = b"".join(unpack_bytes(p) for p in parts)
+    if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+        raise ValueError(f"{name}: 백업 내용이 손상되었습니다.")
+    return data
+
+
+def current_ledger_files() -> dict:
+    """백업 대상 파일의 현재 바이트 (세션 > 로컬 > S3)."""
+    files = {}
+    for name, sess_key in BACKUP_FILES:
+        data = session_source(sess_key, name)[1]
+        if data is not None:
+            files[name] = data
+        elif os.path.exists(name):
+            with open(name, "rb") as f:
+                files[name] = f.read()
+        else:
+            files[name] = s3_download_bytes(name)
+    return files
 
-    # 품번 + 로트번호 완전 일치
-    df = df[(df["품번"] == item_key) & (df["로트번호"] == lot_key)]
 
-    if df.empty:
-        return None, ""
+def ledger_versions() -> tuple:
+    return tuple(session_source(sess_key, name)[0] for name, sess_key in BACKUP_FILES)
 
-    # 실재고수량 숫자화 + 0 제외
-    df["실재고수량"] = pd.to_numeric(df["실재고수량"], errors="coerce").fillna(0)
-    df = df[df["실재고수량"] != 0]
 
-    if df.empty:
-        return None, ""
+def run_ledger_backup_job(job: Job, files: dict, user: str, reason: str) -> dict:
+    return create_backup(files, user=user, reason=reason, job=job)
 
-    # ----- 대분류 매핑 -----
-    ONSITE_CODES = {"WC301", "WC501", "WC502", "WC503", "WC504"}
-    WAREHOUSE_CODES = {"WH201", "WH701", "WH301", "WH601", "WH401", "WH506"}
-    DEFECT_CODES = {"WH001", "WH102"}
 
-    def classify(code: str) -> str:
-        code = str(code).strip()
-        if code in ONSITE_CODES:
-            return "자사"
-        if code in WAREHOUSE_CODES:
-            return "창고"
-        if code in DEFECT_CODES:
-            return "불량"
-        return "외주"
+def submit_ledger_backup(reason: str = "수동") -> Job:
+    """현재 원장 백업을 백그라운드 작업으로 제출 (같은 버전이면 기존 작업 재사용)."""
+    return submit_job(
+        "backup",
+        "원장 백업",
+        ledger_versions(),
+        run_ledger_backup_job,
+        current_ledger_files(),
+        st.session_state.get("user_name", ""),
+        reason,
+    )
 
-    df["대분류"] = df["창고/작업장"].apply(classify)
 
-    # 화면에서 쓰기 좋게 컬럼 이름 정리
-    summary = df[["창고/작업장", "창고/작업장명", "품번", "로트번호", "실재고수량", "대분류"]].copy()
-    summary = summary.rename(
-        columns={
-            "창고/작업장": "창고코드",
-            "창고/작업장명": "창고명",
+def maybe_auto_backup():
+    """BACKUP_INTERVAL_MIN마다 (프로세스 기준) 자동 백업 제출. 내용이 같으면 청크 해시만 하고 끝난다."""
+    if BACKUP_INTERVAL_MIN <= 0:
+        return
+    catalog = _backup_catalog()
+    with catalog["lock"]:
+        if time.time() - catalog["last_auto"] < BACKUP_INTERVAL_MIN * 60:
+            return
+        catalog["last_auto"] = time.time()
+    submit_ledger_backup(reason="자동")
+
+
+def restore_backup(snap_id: str) -> dict:
+    """스냅샷 시점으로 원장/보관 원장/이동 이력을 되돌린다. return: {파일명: 바이트 수}"""
+    manifest = backup_manifest(snap_id)
+    if manifest is None:
+        raise ValueError(f"백업 {snap_id}을(를) 찾을 수 없습니다.")
+    files = {name: backup_file_bytes(manifest, name) for name in manifest["files"]}
+    # 백업 당시 없던 보관 원장/이력은 빈 파일로 (그 뒤에 생긴 보관 통/이력을 버린다)
+    for name, cols in [(ARCHIVE_CSV, DRUM_COLUMNS), (MOVE_LOG_CSV, MOVE_LOG_COLUMNS)]:
+        if name not in files:
+            files[name] = pd.DataFrame(columns=cols).to_csv(index=False).encode("utf-8-sig")
+
+    # 진행 중인 이력 저장(WAL 정리)을 먼저 끝낸 뒤 덮어쓴다.
+    # 남은 WAL 기록은 복원으로 버리는 이력이므로 같이 지운다 (다음 복구 때 다시 붙지 않도록)
+    with ledger_lock():
+        wait_for_persist()
+        wal_clear()
+        loaders = {
+            "bulk_csv_bytes": _load_drums_core,
+            "archive_csv_bytes": _load_archive_core,
+            "move_log_csv_bytes": _load_move_log_core,
         }
-    )
+        for name, sess_key in BACKUP_FILES:
+            if name not in files:
+                continue
+            set_session_bytes(sess_key, files[name])
+            loaders[sess_key].clear()
+            persist_file(name, files[name])
 
-    # 재고 많은 순으로 정렬
-    summary = summary.sort_values("실재고수량", ascending=False).reset_index(drop=True)
+        # 이력이 통째로 바뀌었으므로 복원한 원장을 새 기준점으로
+        reset_checkpoints(load_all_drums(), len(load_move_log()))
+    return {name: len(data) for name, data in files.items()}
 
-    return summary, ""
+
+def backup_table(snapshots: list) -> pd.DataFrame:
+    return pd.DataFrame(
+        [
+            {
+                "ID": m["id"],
+                "시각": m["created"].replace("T", " ")[:19],
+                "구분": m.get("reason", ""),
+                "요청자": m.get("user", ""),
+                "파일 수": len(m["files"]),
+                "크기(KB)": round(sum(f["size"] for f in m["files"].values()) / 1024, 1),
+            }
+            for m in snapshots
+        ]
+    )
 
 
+def show_backup_result(result: dict):
+    if result.get("unchanged"):
+        st.info(f"마지막 백업({result['id']})과 내용이 같아 새로 저장하지 않았습니다.")
+    else:
+        st.success(
+            f"백업 {result['id']}을(를) 저장했습니다. "
+            f"(새 청크 {result['new_chunks']}개 / {result['new_bytes'] / 1024:,.1f}KB, 나머지는 기존 청크 재사용)"
+        )
 
 
 # ==============================
@@ -1054,13 +3776,168 @@ def clear_move_inputs():
             del ss[k]
 
             
+# ==============================
+# 탭 1: 이동 - 일괄 이동 (조건 / 목록 업로드 → 미리보기 → 한 번에 저장)
+# ==============================
+BULK_KEEP_STATUS = "기존 상태 유지"
+
+
+def bulk_move_candidates(df: pd.DataFrame) -> pd.DataFrame:
+    """일괄 이동 대상 통 선택 (조건 또는 업로드 목록). return: 로트번호, 통번호[, 잔량, 이동 위치]"""
+    live = df[~consumed_mask(df)]
+
+    how = st.radio(
+        "대상 선택 방식",
+        ["조건 (위치 / 품목 / 제품라인)", "목록 업로드 (로트번호, 통번호)"],
+        horizontal=True,
+        key="mv_bulk_how",
+    )
+
+    if how.startswith("조건"):
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            locs = st.multiselect(
+                "현재위치", sorted(live["현재위치"].dropna().astype(str).unique()), key="mv_bulk_locs"
+            )
+        with c2:
+            item_q = st.text_input("품목코드 / 품명 (포함 검색)", key="mv_bulk_item").strip()
+        with c3:
+            lines = sorted(x for x in live["제품라인"].dropna().astype(str).unique() if x.strip())
+            line_sel = st.multiselect("제품라인", lines, key="mv_bulk_lines")
+
+        if not (locs or item_q or line_sel):
+            st.info("조건을 하나 이상 선택해 주세요.")
+            return pd.DataFrame()
+
+        mask = pd.Series(True, index=live.index)
+        if locs:
+            mask &= live["현재위치"].isin(locs)
+        if item_q:
+            mask &= live["품목코드"].astype(str).str.contains(item_q, case=False, regex=False) | live[
+                "품명"
+            ].astype(str).str.contains(item_q, case=False, regex=False)
+        if line_sel:
+            mask &= live["제품라인"].astype(str).isin(line_sel)
+        return live.loc[mask, ["로트번호", "통번호"]].reset_index(drop=True)
+
+    up = st.file_uploader(
+        "로트번호, 통번호 (선택: 잔량, 이동 위치) 컬럼이 있는 CSV / 엑셀. 통번호가 없으면 로트의 모든 통",
+        type=["csv", "xlsx"],
+        key="mv_bulk_file",
+    )
+    if up is None:
+        return pd.DataFrame()
+    try:
+        listed = pd.read_excel(up) if up.name.lower().endswith(".xlsx") else pd.read_csv(up, encoding="utf-8-sig")
+    except Exception as e:
+        st.error(f"파일을 읽는 중 오류가 발생했습니다: {e}")
+        return pd.DataFrame()
+    if "로트번호" not in listed.columns:
+        st.error("'로트번호' 컬럼이 없습니다.")
+        return pd.DataFrame()
+
+    if "통번호" not in listed.columns:
+        # 로트 단위 목록 → 해당 로트의 살아 있는 통 전체
+        listed = listed.assign(_lot=listed["로트번호"].astype(str).str.strip().str.lower())
+        drums = live[["로트번호", "통번호"]].assign(_lot=live["로트번호"].astype(str).str.strip().str.lower())
+        listed = drums.merge(listed.drop(columns=["로트번호"]), on="_lot").drop(columns=["_lot"])
+    return listed
+
+
+def render_bulk_move():
+    ss = st.session_state
+
+    # 직전 일괄 이동 결과 + 되돌리기 (커밋ID 단위)
+    last = ss.get("mv_bulk_last_commit")
+    if last:
+        commit_id, n = last
+        c1, c2 = st.columns([3, 1])
+        c1.success(f"{n}통을 한 번에 이동했습니다. (커밋ID {commit_id[:8]})")
+        if c2.button("방금 일괄 이동 되돌리기", key="mv_bulk_undo"):
+            try:
+                n_undone = rollback_commit(commit_id)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                ss.pop("mv_bulk_last_commit", None)
+                ss["mv_bulk_undone"] = n_undone
+                rerun_tab()
+    n_undone = ss.pop("mv_bulk_undone", None)
+    if n_undone:
+        st.success(f"이동 이력 {n_undone}행을 삭제하고 원장을 되돌렸습니다.")
+
+    df = load_drums()
+    if df.empty:
+        st.info("CSV에 등록된 벌크 정보가 없습니다.")
+        return
+
+    picked = bulk_move_candidates(df)
+    if picked.empty:
+        return
+
+    st.markdown("#### 📍 이동할 위치")
+    to_zone = location_picker("mv_bulk")
+    if to_zone == "외주":
+        status = "외주"
+    else:
+        status = st.radio(
+            "이동 후 상태",
+            [BULK_KEEP_STATUS] + MOVE_STATUSES,
+            horizontal=True,
+            key="mv_bulk_status",
+        )
+
+    moves = picked.copy()
+    if "이동 위치" not in moves.columns:
+        moves["이동 위치"] = to_zone
+    else:
+        moves["이동 위치"] = moves["이동 위치"].where(moves["이동 위치"].notna(), to_zone)
+
+    events, rejected = plan_moves(df, moves, status=None if status == BULK_KEEP_STATUS else status)
+
+    st.markdown("#### 👀 미리보기")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("이동할 통", f"{len(events):,}통")
+    c2.metric("로트", f"{events['로트번호'].nunique():,}개")
+    c3.metric("총 용량", f"{events['변경 후 용량'].sum():,.0f} kg")
+    if not events.empty:
+        paged_table(
+            events,
+            key="mv_bulk_preview",
+            columns=["품번", "품명", "로트번호", "통번호", "변경 전 위치", "변경 후 위치", "변경 전 용량", "변경 후 용량", "상태"],
+            default_sort=["로트번호", "통번호"],
+            page_size=30,
+        )
+    if not rejected.empty:
+        unknown = rejected["사유"].str.startswith("알 수 없는 이동 위치")
+        if unknown.any():
+            st.warning(f"목록의 이동 위치 중 알 수 없는 위치가 있어 {int(unknown.sum())}건을 제외했습니다. 위치 이름을 확인해 주세요.")
+        with st.expander(f"제외된 요청 {len(rejected)}건", expanded=bool(unknown.any())):
+            st.dataframe(rejected, hide_index=True, use_container_width=True)
+
+    if st.button(f"일괄 이동 저장 ({len(events):,}통)", key="mv_bulk_apply", disabled=events.empty):
+        # 저장 직전 원장으로 다시 계획해서 반영 (미리보기 이후 바뀐 통은 제외 사유로 돌아온다)
+        done, _ = commit_moves(moves, status=None if status == BULK_KEEP_STATUS else status)
+        if done.empty:
+            st.warning("반영할 이동이 없습니다.")
+        else:
+            ss["mv_bulk_last_commit"] = (done["커밋ID"].iat[0], len(done))
+            rerun_tab()
+
+
 # ==============================
 # 탭 1: 이동
 # ==============================
+@st.fragment
 def render_tab_move():
     st.markdown("### 📦 벌크 이동")
 
     ss = st.session_state
+
+    mode = st.radio("이동 방식", ["한 로트씩", "일괄 이동"], horizontal=True, key="mv_mode")
+    if mode == "일괄 이동":
+        render_bulk_move()
+        return
     ss.setdefault("mv_searched_csv", False)
     ss.setdefault("mv_search_by_lot", False)
     ss.setdefault("mv_show_stock_detail", False)
@@ -1110,7 +3987,7 @@ def render_tab_move():
     if reset_submit:
         clear_move_inputs()          # 검색 상태 초기화 (입력칸은 버전으로 리셋)
         ss["mv_input_version"] += 1  # 👉 새 키로 위젯 재생성 → 값 완전 삭제
-        st.rerun()
+        rerun_tab()
 
     # ----- 조회 버튼: 이번 입력을 "마지막 조회 조건"으로 저장 -----
     if search_submit:
@@ -1129,7 +4006,6 @@ def render_tab_move():
 
     # 여기부터는 "마지막 조회 조건" 기반으로 항상 화면 그림
     bulk_type = ss.get("mv_bulk_type_csv", "자사")
-    df = load_drums()
     prod_df = load_production()
     recv_df = load_receive()
 
@@ -1192,8 +4068,7 @@ def render_tab_move():
             prod_date = "" if pd.isna(r["작업일자"]) else str(r["작업일자"])
             line = classify_product_line(item_code)
 
-            df = ensure_lot_in_csv(
-                df,
+            provision_lot(
                 lot=lot,
                 item_code=item_code,
                 item_name=item_name,
@@ -1202,7 +4077,6 @@ def render_tab_move():
                 initial_status="생산대기",
                 prod_qty=prod_qty,
             )
-            save_drums(df)
 
         else:
             # 사급
@@ -1271,8 +4145,7 @@ def render_tab_move():
             else:
                 line = "사급"
 
-            df = ensure_lot_in_csv(
-                df,
+            provision_lot(
                 lot=lot,
                 item_code=item_code,
                 item_name=item_name,
@@ -1281,7 +4154,6 @@ def render_tab_move():
                 initial_status="생산대기",
                 prod_qty=prod_qty,
             )
-            save_drums(df)
 
             # ==============================
             # stock.xlsx 기준으로 유/무상 판단
@@ -1320,8 +4192,7 @@ def render_tab_move():
             else:
                 line = "사급"
 
-            df = ensure_lot_in_csv(
-                df,
+            provision_lot(
                 lot=lot,
                 item_code=item_code,
                 item_name=item_name,
@@ -1330,7 +4201,6 @@ def render_tab_move():
                 initial_status="생산대기",
                 prod_qty=prod_qty,
             )
-            save_drums(df)
 
     # ---------- LOT 기준으로 CSV 조회 (대소문자 무시) ----------
     df = load_drums()
@@ -1338,7 +4208,11 @@ def render_tab_move():
     lot_df = df[df["lot_lower"] == lot_lower].copy()
 
     if lot_df.empty:
-        st.warning("CSV에서 해당 로트번호의 통 정보를 찾을 수 없습니다.")
+        archive = load_archive()
+        if (archive["로트번호"].astype(str).str.lower() == lot_lower).any():
+            st.info("이 로트는 모두 소진되어 보관 원장으로 옮겨졌습니다. (조회 탭에서 '용량 0 포함'으로 확인)")
+        else:
+            st.warning("CSV에서 해당 로트번호의 통 정보를 찾을 수 없습니다.")
         ss["mv_searched_csv"] = False
         return
 
@@ -1431,13 +4305,9 @@ def render_tab_move():
     else:
         stock_loc_display = current_zone
 
-    # 이동에 사용할 변수 (좌/우 컬럼에서 같이 씀)
-    selected_drums = []
-    drum_new_qty = {}
-
     col_left2, col_right2 = st.columns(2)
 
-    # ===== 왼쪽: 조회 정보 + 통 선택 =====
+    # ===== 왼쪽: 조회 정보 =====
     with col_left2:
         st.markdown("### 🧾 조회 정보")
         st.success("조회가 완료되었습니다.")
@@ -1491,53 +4361,7 @@ def render_tab_move():
                 st.info("전산 재고 데이터가 없습니다.")
 
 
-        # 🔴 여기부터는 상세보기와 상관없이 항상 보여야 하는 영역
-        st.markdown("### ✅ 통 선택 및 잔량 입력")
-
-        selected_drums = []
-        drum_new_qty = {}
-
-        # ✅ index 기준으로 key를 만들어서 중복 방지
-        lot_df = lot_df.reset_index(drop=True)
-        index_list = lot_df.index.tolist()
-
-        c1, c_sp, c2, _c_gap = st.columns([1, 0.001, 1, 5])
-        with c1:
-            if st.button("모두 선택", key=f"mv_select_all_{lot}", use_container_width=False):
-                for idx in index_list:
-                    st.session_state[f"mv_sel_{lot}_{idx}"] = True
-        with c2:
-            if st.button("모두 해제", key=f"mv_select_none_{lot}", use_container_width=False):
-                for idx in index_list:
-                    st.session_state[f"mv_sel_{lot}_{idx}"] = False
-
-        for idx, row in lot_df.iterrows():
-            drum_no = int(row["통번호"])
-            old_qty = float(row["통용량"])
-            drum_loc = str(row.get("현재위치", "") or "").strip()
-
-            if drum_loc:
-                label = f"{drum_no}번 통 — 기존 {old_qty:.0f}kg (위치: {drum_loc})"
-            else:
-                label = f"{drum_no}번 통 — 기존 {old_qty:.0f}kg"
-
-            cb_key = f"mv_sel_{lot}_{idx}"
-            checked = st.checkbox(label, key=cb_key)
-            if checked:
-                selected_drums.append(drum_no)
-                new_val = st.number_input(
-                    f"통 {drum_no}의 현재 용량(kg)",
-                    min_value=0.0,
-                    max_value=old_qty,
-                    value=old_qty,
-                    step=10.0,
-                    format="%.0f",
-                    key=f"mv_qty_{lot}_{drum_no}",
-                )
-                drum_new_qty[drum_no] = float(new_val)
-
-
-    # ===== 오른쪽: 이동 위치 + 상태 + 비고 + 저장 =====
+    # ===== 오른쪽: 이동 위치 (층 변경 시 세부구역이 바로 바뀌어야 하므로 폼 밖) =====
     with col_right2:
         st.markdown("### 🚚 이동 위치 선택")
 
@@ -1553,30 +4377,90 @@ def render_tab_move():
             to_zone = location_picker("mv_to")
 
         if to_zone == "외주":
-            move_status = "외주"
             st.info("이동 위치가 '외주'이므로 상태는 자동으로 '외주'로 설정됩니다.")
-        else:
-            move_status = st.radio(
-                "이동 후 상태를 선택해 주세요.",
-                ["잔량", "생산대기", "생산종료"],
-                horizontal=True,
-                key="mv_status_csv",
+
+    # ================== 통 선택 + 잔량 입력 + 상태/비고 → 한 번에 저장 ==================
+    #  - 통마다 checkbox/number_input을 만들지 않고 표(data_editor) 하나로 입력
+    #  - form 안에 있으므로 저장 버튼을 누를 때만 rerun
+    lot_df = lot_df.reset_index(drop=True)
+
+    grid_ver_key = f"mv_grid_ver_{lot}"
+    select_all_key = f"mv_grid_all_{lot}"
+    ss.setdefault(grid_ver_key, 0)
+
+    c1, c_sp, c2, _c_gap = st.columns([1, 0.001, 1, 5])
+    with c1:
+        if st.button("모두 선택", key=f"mv_select_all_{lot}", use_container_width=False):
+            ss[select_all_key] = True
+            ss[grid_ver_key] += 1   # 새 key로 표 재생성 → 기존 편집값 초기화
+    with c2:
+        if st.button("모두 해제", key=f"mv_select_none_{lot}", use_container_width=False):
+            ss[select_all_key] = False
+            ss[grid_ver_key] += 1
+
+    grid = pd.DataFrame(
+        {
+            "선택": ss.get(select_all_key, False),
+            "통번호": lot_df["통번호"].astype(int),
+            "기존 용량(kg)": lot_df["통용량"].astype(float),
+            "위치": lot_df["현재위치"].fillna("").astype(str),
+            "현재 용량(kg)": lot_df["통용량"].astype(float),
+        }
+    )
+
+    with st.form(f"mv_drum_form_{lot}", border=False):
+        col_grid, col_save = st.columns(2)
+
+        with col_grid:
+            st.markdown("### ✅ 통 선택 및 잔량 입력")
+            edited = st.data_editor(
+                grid,
+                hide_index=True,
+                use_container_width=True,
+                disabled=["통번호", "기존 용량(kg)", "위치"],
+                column_config={
+                    "선택": st.column_config.CheckboxColumn("선택"),
+                    "기존 용량(kg)": st.column_config.NumberColumn(format="%.0f"),
+                    "현재 용량(kg)": st.column_config.NumberColumn(
+                        "현재 용량(kg)", min_value=0.0, step=10.0, format="%.0f",
+                        help="이동 후 통에 남아 있는 용량 (기존 용량 이하)",
+                    ),
+                },
+                key=f"mv_grid_{lot}_{ss[grid_ver_key]}",
             )
 
-        note = st.text_area("비고(선택 입력)", height=80, key="mv_note_csv")
+        with col_save:
+            if to_zone == "외주":
+                move_status = "외주"
+            else:
+                move_status = st.radio(
+                    "이동 후 상태를 선택해 주세요.",
+                    ["잔량", "생산대기", "생산종료"],
+                    horizontal=True,
+                    key="mv_status_csv",
+                )
+
+            note = st.text_area("비고(선택 입력)", height=80, key="mv_note_csv")
 
-        if st.button("이동 내용 저장 (CSV 반영)", key="mv_save_csv"):
-            if not selected_drums:
-                st.warning("이동하실 통을 한 개 이상 선택해 주세요.")
-                return
+            save_submit = st.form_submit_button("이동 내용 저장 (CSV 반영)")
+
+    if save_submit:
+        picked = edited[edited["선택"].fillna(False).astype(bool)]
+        if picked.empty:
+            st.warning("이동하실 통을 한 개 이상 선택해 주세요.")
+            return
 
+        # 잔량은 0 ~ 기존 용량 범위로 보정
+        qty_after = pd.to_numeric(picked["현재 용량(kg)"], errors="coerce").fillna(picked["기존 용량(kg)"])
+        qty_after = qty_after.clip(lower=0, upper=picked["기존 용량(kg)"])
+        selected_drums = picked["통번호"].astype(int).tolist()
+        drum_new_qty = dict(zip(selected_drums, qty_after.astype(float)))
+
+        # 원장 읽기 → 이력 기록 → 원장 저장을 한 번에 (스캐너 입력/CLI와 겹치지 않게)
+        with ledger_lock():
             df_all = load_drums()
             df_all["lot_lower"] = df_all["로트번호"].astype(str).str.lower()
             lot_mask = df_all["lot_lower"] == lot_lower
-            
-            # 🔹 사급 벌크인 경우, 최초 입고 상태(현재위치 = '보관')의 통에만 제품라인을 기록
-            if bulk_type == "사급" and line:
-                df_all.loc[lot_mask & (df_all["현재위치"] == "보관"), "제품라인"] = line
 
             drum_logs = []
 
@@ -1598,11 +4482,14 @@ def render_tab_move():
                 else:
                     df_all.at[i, "상태"] = move_status
 
+                # 🔹 사급 벌크는 유/무상 판단 결과(제품라인)를 이동한 통에 기록 (이동 이력과 동일하게)
+                if bulk_type == "사급" and line:
+                    df_all.at[i, "제품라인"] = line
+
                 # (통번호, 변화량, 변경 전 용량, 변경 후 용량, 변경 전 위치)
                 drum_logs.append((dn, moved, old_qty, new_qty, old_loc))
 
-            save_drums(df_all)
-
+            # 이동 이력(원본) 먼저 기록 → 통 CSV(투영) 저장
             write_move_log(
                 item_code=item_code,
                 item_name=item_name,
@@ -1610,9 +4497,13 @@ def render_tab_move():
                 drum_infos=drum_logs,
                 from_zone=from_zone,
                 to_zone=to_zone,
+                status="외주" if to_zone == "외주" else move_status,
+                line=line if bulk_type == "사급" else "",
             )
 
-            st.success(f"총 {len(drum_logs)}개의 통 정보가 CSV 및 이동 이력에 반영되었습니다.")
+            save_drums(df_all.drop(columns=["lot_lower"], errors="ignore"))
+
+        st.success(f"총 {len(drum_logs)}개의 통 정보가 CSV 및 이동 이력에 반영되었습니다.")
 
     # ================== 이동 탭 내부 LOT 이동 이력 ==================
     if ss.get("mv_show_move_history_here", False):
@@ -1631,10 +4522,12 @@ def render_tab_move():
 # ==============================
 # 탭 2: 조회
 # ==============================
+@st.fragment
 def render_tab_lookup():
     st.markdown("### 🔍 벌크 조회")
 
-    df = load_drums()
+    as_of = as_of_picker("lookup")
+    df = load_drums() if as_of is None else drums_as_of(as_of)
     if df.empty:
         st.info("CSV에 등록된 벌크 정보가 없습니다.")
         return
@@ -1643,6 +4536,14 @@ def render_tab_lookup():
     df = add_tat_column(df)
 
     query = st.text_input("로트번호, 품목코드 또는 품명을 입력해 주세요.")
+
+    # 용량 0 포함 여부 (기본: 미포함) → 포함이면 보관 원장(소진 통)도 같이 조회
+    include_zero = st.checkbox("용량 0 포함", value=False)
+    if include_zero and as_of is None:
+        archive = load_archive()
+        if not archive.empty:
+            df = pd.concat([df, add_tat_column(archive)], ignore_index=True)
+
     if query:
         q = query.strip()
         mask = (
@@ -1654,9 +4555,6 @@ def render_tab_lookup():
     else:
         df_view = df
 
-    # 용량 0 포함 여부 (기본: 미포함)
-    include_zero = st.checkbox("용량 0 포함", value=False)
-
     if not include_zero:
         df_view = df_view[df_view["통용량"] > 0]
 
@@ -1675,53 +4573,38 @@ def render_tab_lookup():
         # 2차: bulk_move_log.csv 에서 "소진" 이력 먼저 확인
         #  - bulk_drums_extended.csv 에서 소진 통은 삭제되므로,
         #    이동이력에서 소진 상태인 건을 먼저 보여줌
+        #  - 로트번호 부분 일치, 소진 로트 인덱스에서 조회 (이력 전체를 훑지 않음)
         # =========================
-        log_df = load_move_log()
-        if log_df is not None and not log_df.empty and "로트번호" in log_df.columns:
-            tmp = log_df.copy()
-            tmp["lot_lower"] = tmp["로트번호"].astype(str).str.lower()
-
-            # 로트번호 기준: 부분 일치(원하면 == 로 바꿔도 됨)
-            hit = tmp[tmp["lot_lower"].str.contains(q_lower, na=False)].copy()
-
-            if not hit.empty:
-                # "상태" 컬럼이 있는 경우만 "소진" 필터 적용
-                # (없으면 안전하게 '소진 위치'로 추정하는 보완 로직도 같이 넣음)
-                if "상태" in hit.columns:
-                    hit = hit[hit["상태"].astype(str).str.strip() == "소진"].copy()
-                else:
-                    # 보완: 상태 컬럼이 없다면, 변경 후 위치가 소진/폐기면 소진으로 간주
-                    if "변경 후 위치" in hit.columns:
-                        hit["__after_loc"] = hit["변경 후 위치"].astype(str).str.strip()
-                        hit = hit[hit["__after_loc"].isin(["소진", "폐기"])].copy()
-                        hit = hit.drop(columns=["__after_loc"], errors="ignore")
-
-                if not hit.empty:
-                    st.markdown("#### 🧾 소진 이력 검색 결과 (이동 이력 기준)")
-                    st.caption("※ 이 로트는 소진 처리되어 bulk_drums_extended.csv에서 삭제됐을 수 있습니다.")
-
-                    show_cols = [
-                        "시간",
-                        "ID",
-                        "품번",
-                        "품명",
-                        "로트번호",
-                        "통번호",
-                        "변경 전 용량",
-                        "변경 후 용량",
-                        "변화량",
-                        "변경 전 위치",
-                        "변경 후 위치",
-                        "상태",
-                    ]
-                    show_cols = [c for c in show_cols if c in hit.columns]
-
-                    # 최신순 정렬
-                    if "시간" in hit.columns:
-                        hit = hit.sort_values("시간", ascending=False)
-
-                    st.dataframe(hit[show_cols], use_container_width=True)
-                    return
+        hit = find_consumed_lots(q_lower)
+        if not hit.empty:
+            st.markdown("#### 🧾 소진 이력 검색 결과 (이동 이력 기준)")
+            st.caption("※ 이 로트는 소진 처리되어 bulk_drums_extended.csv에서 삭제됐을 수 있습니다.")
+
+            show_cols = [
+                "시간",
+                "ID",
+                "품번",
+                "품명",
+                "로트번호",
+                "통번호",
+                "변경 전 용량",
+                "변경 후 용량",
+                "변화량",
+                "변경 전 위치",
+                "변경 후 위치",
+                "상태",
+            ]
+            show_cols = [c for c in show_cols if c in hit.columns]
+
+            # 최신순 정렬
+            paged_table(
+                hit,
+                key="lookup_consumed",
+                columns=show_cols,
+                default_sort=["시간"],
+                ascending=False,
+            )
+            return
 
         # =========================
         # 3차: production.xlsx (제조실 재고 검색 결과)로 폴백
@@ -1742,44 +4625,24 @@ def render_tab_lookup():
             st.info("bulk CSV / 이동 이력 / production.xlsx 모두에서 검색 결과가 없습니다.")
             return
 
-        # (이 아래는 너가 이미 쓰고 있는 '제조실 재고 검색 결과' 생성 로직 그대로 유지)
-        # ===== production 기반 가상 벌크통 생성 =====
-        drums_rows = []
-
-        for _, r in prod_view.iterrows():
-            item_code = str(r["품번"])
-            item_name = str(r["품명"])
-            lot = str(r["LOTNO"]).strip().upper()
-
-            raw_date = r["작업일자"]
-            try:
-                mfg_date = str(pd.to_datetime(raw_date).date())  # YYYY-MM-DD
-            except Exception:
-                mfg_date = str(raw_date)
-
-            prod_qty = float(r["제조량"]) if not pd.isna(r["제조량"]) else None
-
-            drums = generate_drums(prod_qty)
-
-            for d in drums:
-                drums_rows.append(
-                    {
-                        "품목코드": item_code,
-                        "품명": item_name,
-                        "로트번호": lot,
-                        "제조일자": mfg_date,
-                        "상태": "생산대기",
-                        "통번호": int(d["통번호"]),
-                        "통용량": float(d["통용량"]),
-                        "현재위치": "자사(제조실)",
-                    }
-                )
+        # ===== production 기반 가상 벌크통 생성 (전체 로트를 한 번에 펼침) =====
+        lots = pd.DataFrame(
+            {
+                "품목코드": prod_view["품번"].astype(str),
+                "품명": prod_view["품명"].astype(str),
+                "로트번호": prod_view["LOTNO"].astype(str).str.strip().str.upper(),
+                "제조일자": _normalize_mfg_dates(prod_view["작업일자"]),
+                "제조량": prod_view["제조량"],
+            }
+        )
+        drums_df = expand_drums(lots)
 
-        if not drums_rows:
+        if drums_df.empty:
             st.info("production.xlsx 에 데이터는 있으나 제조량이 없어 통 생성이 불가능합니다.")
             return
 
-        drums_df = pd.DataFrame(drums_rows)
+        drums_df["상태"] = "생산대기"
+        drums_df["현재위치"] = "자사(제조실)"
         drums_df = add_tat_column(drums_df)
 
         st.markdown("#### 📄 제조실 재고 검색 결과")
@@ -1814,7 +4677,12 @@ def render_tab_lookup():
 
     # 🔻 여기부터는 CSV에서 검색 결과가 있는 경우 기존 로직 그대로
     st.markdown("#### 📄 행별 상세")
-    st.dataframe(df_view, use_container_width=True)
+    paged_table(
+        df_view,
+        key="lookup_rows",
+        columns=DRUM_COLUMNS + ["TAT"],
+        default_sort=["로트번호", "통번호"],
+    )
 
     st.markdown("---")
     st.markdown("#### 📊 현재위치별 용량 요약")
@@ -1871,37 +4739,70 @@ def render_tab_lookup():
     show_summary_table(df_warehouse, "3) 창고")
     show_summary_table(df_consumed, "4) 소진 / 폐기")
 
+    # 과거 시점 조회 중에는 백업/점검 버튼 숨김 (현재 원장 전용)
+    if as_of is not None:
+        return
+
     st.markdown("---")
-    if st.button("현재 CSV를 그대로 백업 저장하기"):
-        # 🔹 한국 시간(KST) 기준 타임스탬프
-        KST = timezone(timedelta(hours=9))
-        ts = datetime.now(KST).strftime("%Y%m%d_%H%M%S")
-        backup_name = f"bulk_drums_extended_backup_{ts}.csv"
+    drums_ver = session_source("bulk_csv_bytes", CSV_PATH)[0]
 
-        df.to_csv(backup_name, index=False, encoding="utf-8-sig")
-        st.success(f"백업 파일로 저장되었습니다: {backup_name}")
+    if st.button("현재 CSV를 그대로 백업 저장하기"):
+        submit_ledger_backup()
+    show_job(find_job("backup", ledger_versions()), show_backup_result)
 
     if st.button("간단 데이터 점검"):
-        df_all = load_drums()
+        submit_job("integrity", "데이터 점검", (drums_ver,), run_integrity_job, load_drums())
+
+    def show_problems(problems: dict):
+        if not problems:
+            st.success("점검 항목에서 문제가 발견되지 않았습니다.")
+        for title, found in problems.items():
+            st.warning(title)
+            st.dataframe(found, use_container_width=True)
 
-        prob1 = df_all[(df_all["통용량"] == 0) & ~df_all["현재위치"].isin(["소진", "폐기"])]
-        if not prob1.empty:
-            st.warning("용량 0인데 소진/폐기가 아닌 통")
-            st.dataframe(prob1, use_container_width=True)
+    show_job(find_job("integrity", (drums_ver,)), show_problems)
+
+    if st.checkbox("전산 재고 대조 (stock.xlsx)", key="reconcile_on"):
+        tol = float(
+            st.number_input(
+                "허용 오차 (kg)", min_value=0.0, value=RECONCILE_TOLERANCE_KG, step=0.5, key="reconcile_tol"
+            )
+        )
+        idx = stock_index()
+        if idx is None:
+            st.info("stock.xlsx가 없거나 필요한 컬럼(창고/작업장, 품번, 로트번호, 실재고수량)이 없습니다.")
+            return
+        stock_ver = session_source("stock_xlsx_bytes", STOCK_FILE)[0]
+        versions = (drums_ver, stock_ver, tol)
+        if st.button("대조 실행", key="reconcile_run"):
+            submit_job("reconcile", "전산 재고 대조", versions, run_reconcile_job, *versions, load_drums(), idx)
+
+        def show_reconcile(rep: pd.DataFrame):
+            if rep.empty:
+                st.success("원장과 전산 재고가 모두 일치합니다.")
+                return
+            counts = rep["구분"].value_counts()
+            cols = st.columns(4)
+            for col, kind in zip(cols, ["원장만", "전산만", "수량 차이", "위치 차이"]):
+                col.metric(kind, f"{int(counts.get(kind, 0)):,}건")
+            st.caption(
+                f"원장 합계 {rep['원장_kg'].sum():,.1f} kg / 전산 합계 {rep['전산_kg'].sum():,.1f} kg "
+                "(불일치 행만 집계, 소진/폐기 제외)"
+            )
+            paged_table(rep, key="reconcile", page_size=50)
 
-        prob2 = df_all[(df_all["현재위치"] == "외주") & (df_all["상태"] != "외주")]
-        if not prob2.empty:
-            st.warning("위치는 외주인데 상태가 외주가 아닌 통")
-            st.dataframe(prob2, use_container_width=True)
+        show_job(find_job("reconcile", versions), show_reconcile)
 
 
 # ==============================
 # 탭 3: 지도 (A1~C3 버튼)
 # ==============================
+@st.fragment
 def render_tab_map():
     st.markdown("### 🗺 벌크 위치 지도 (CSV 기준)")
 
-    df = load_drums()
+    as_of = as_of_picker("map")
+    df = load_drums() if as_of is None else drums_as_of(as_of)
     if df.empty:
         st.info("CSV에 등록된 벌크 정보가 없습니다.")
         return
@@ -1984,9 +4885,11 @@ def render_tab_map():
             "품목코드", "품명", "로트번호", "제품라인", "제조일자",
             "상태", "현재위치", "통번호", "통용량",
         ]
-        st.dataframe(
-            fdf[show_cols].sort_values(["로트번호", "통번호"]),
-            use_container_width=True,
+        paged_table(
+            fdf,
+            key=f"map_special_{sel_floor}",
+            columns=show_cols,
+            default_sort=["로트번호", "통번호"],
         )
         return
 
@@ -2082,25 +4985,30 @@ def render_tab_map():
         "품목코드", "품명", "로트번호", "제품라인", "제조일자",
         "상태", "현재위치", "통번호", "통용량",
     ]
-    st.dataframe(
-        ddf[show_cols].sort_values(["로트번호", "통번호"]),
-        use_container_width=True,
+    paged_table(
+        ddf,
+        key=f"map_zone_{sel_floor}_{cz}",
+        columns=show_cols,
+        default_sort=["로트번호", "통번호"],
     )
 
 # ==============================
 # 탭 4: 이동 이력 (수정 + 행 삭제 가능)
 # ==============================
 
+@st.fragment
 def render_tab_move_log():
     st.markdown("### 📜 이동 이력 (롤백 전용 / 삭제만 가능)")
 
-    df = load_move_log()
-    if df.empty:
+    ss = st.session_state
+    move_version, move_bytes = session_source("move_log_csv_bytes", MOVE_LOG_CSV)
+
+    # 최신순 정렬본(캐시, 읽기 전용) — 페이지 넘김은 이 정렬본을 잘라 쓰기만 한다
+    sorted_log, _ = _move_log_sorted_core(move_version, move_bytes)
+    if sorted_log.empty:
         st.info("이동 이력이 없습니다.")
         return
 
-    ss = st.session_state
-
     # ------------------------------
     # 키 정의 (중복 방지)
     # ------------------------------
@@ -2139,32 +5047,22 @@ def render_tab_move_log():
     if cur_filter != prev_filter:
         ss[KEY_FILTER_PREV] = cur_filter
         ss[KEY_PAGE] = 1
-        st.rerun()
+        rerun_tab()
 
     # ------------------------------
-    # 필터 적용
+    # 필터 적용 (검색어별 결과 위치를 캐시)
     # ------------------------------
-    if lot_filter:
-        q = lot_filter.strip().lower()
-        df_tmp = df.copy()
-        df_tmp["lot_lower"] = df_tmp["로트번호"].astype(str).str.lower()
-        df_view = df_tmp[df_tmp["lot_lower"].str.contains(q, na=False)].copy()
-        df_view = df_view.drop(columns=["lot_lower"], errors="ignore")
-    else:
-        df_view = df.copy()
+    positions = _move_log_filter_core(move_version, move_bytes, cur_filter)
+    total_rows = len(sorted_log) if positions is None else len(positions)
 
-    if df_view.empty:
+    if total_rows == 0:
         st.info("검색 조건에 해당하는 이동 이력이 없습니다.")
         return
 
-    # 최신순
-    df_view = df_view.sort_values("시간", ascending=False)
-
     # ------------------------------
     # 페이지 계산 + slice (UI는 아래에서)
     # ------------------------------
     page_size = 50
-    total_rows = len(df_view)
     total_pages = max(1, math.ceil(total_rows / page_size))
 
     try:
@@ -2178,8 +5076,11 @@ def render_tab_move_log():
     start = (page - 1) * page_size
     end = start + page_size
 
-    # ✅ 원본 인덱스 유지
-    page_df = df_view.iloc[start:end].copy()
+    # ✅ 원본 인덱스 유지 (페이지 크기만큼만 복사)
+    if positions is None:
+        page_df = sorted_log.iloc[start:end].copy()
+    else:
+        page_df = sorted_log.iloc[positions[start:end]].copy()
 
     # ------------------------------
     # 📱 모바일 공유용 보기 (토글)
@@ -2232,7 +5133,7 @@ def render_tab_move_log():
     cols_order = [
         "시간", "ID", "품번", "품명", "로트번호", "통번호",
         "변경 전 용량", "변경 후 용량", "변화량",
-        "변경 전 위치", "변경 후 위치",
+        "변경 전 위치", "변경 후 위치", "상태", "이벤트",
     ]
     cols_order = [c for c in cols_order if c in page_df.columns]
     page_edit = page_df[cols_order].copy()
@@ -2258,18 +5159,6 @@ def render_tab_move_log():
         key=f"move_log_editor_page_{page}",
     )
 
-    def _save_full_log(df_updated: pd.DataFrame):
-        buf = io.BytesIO()
-        df_updated.to_csv(buf, index=False, encoding="utf-8-sig")
-        data = buf.getvalue()
-        ss["move_log_csv_bytes"] = data
-        _load_move_log_core.clear()
-        try:
-            df_updated.to_csv(MOVE_LOG_CSV, index=False, encoding="utf-8-sig")
-        except Exception:
-            pass
-        s3_upload_bytes(MOVE_LOG_CSV, data)
-
     # ------------------------------
     # ✅ 페이지네이션 + 삭제 버튼 (같은 줄)
     #   - KEY_PAGE 하나만 "진짜 페이지"로 사용
@@ -2281,7 +5170,7 @@ def render_tab_move_log():
     with col_prev:
         if st.button("이전", key="log_page_prev_btn", use_container_width=True):
             ss[KEY_PAGE] = max(1, int(ss[KEY_PAGE]) - 1)
-            st.rerun()
+            rerun_tab()
 
     with col_page:
         page_options = list(range(1, total_pages + 1))
@@ -2300,12 +5189,12 @@ def render_tab_move_log():
 
         if int(new_page) != int(ss[KEY_PAGE]):
             ss[KEY_PAGE] = int(new_page)
-            st.rerun()
+            rerun_tab()
 
     with col_next:
         if st.button("다음", key="log_page_next_btn", use_container_width=True):
             ss[KEY_PAGE] = min(total_pages, int(ss[KEY_PAGE]) + 1)
-            st.rerun()
+            rerun_tab()
 
     with col_info:
         st.markdown(
@@ -2325,68 +5214,52 @@ def render_tab_move_log():
                 st.warning("먼저 롤백할 행을 '삭제' 칼럼에 체크해 주세요.")
                 return
 
-            # 원본(df) 기준으로 해당 행 데이터 확보 (page_df의 인덱스는 df_view/df의 원본 인덱스)
-            rows_to_delete = df.loc[selected_idx].copy()
-
-            # 2) 각 통(로트번호+통번호)의 '가장 최신 이력'인지 확인
-            log_all = df.copy()
-            log_all["__dt"] = pd.to_datetime(log_all["시간"], errors="coerce")
-
-            not_latest = []
-            for idx, row in rows_to_delete.iterrows():
-                lot = str(row.get("로트번호", "") or "")
-                drum_no = int(pd.to_numeric(row.get("통번호", 0), errors="coerce") or 0)
-
-                mask = (log_all["로트번호"].astype(str) == lot) & (log_all["통번호"] == drum_no)
-                sub = log_all[mask]
-                if sub.empty:
-                    continue
-
-                sub_valid = sub.dropna(subset=["__dt"])
-                if not sub_valid.empty:
-                    last_idx = sub_valid["__dt"].idxmax()
-                else:
-                    last_idx = sub.index.max()
-
-                if idx != last_idx:
-                    not_latest.append(f"{lot} / 통 {drum_no}")
-
-            if not_latest:
-                st.error(
-                    "롤백은 각 통의 '가장 최근 이동 이력'만 삭제할 수 있습니다.\n"
-                    "다음 항목은 더 새로운 이력이 있어 롤백할 수 없습니다:\n"
-                    + ", ".join(not_latest)
-                )
-                return
-
-            # 3) 통 정보 CSV 롤백 (통용량/현재위치만)
-            drums_df = load_drums()
-            drums_df["lot_lower"] = drums_df["로트번호"].astype(str).str.lower()
-
-            for _, row in rows_to_delete.iterrows():
-                lot = str(row.get("로트번호", "") or "")
-                lot_lower = lot.lower()
-                drum_no = int(pd.to_numeric(row.get("통번호", 0), errors="coerce") or 0)
-
-                old_qty = float(pd.to_numeric(row.get("변경 전 용량", 0), errors="coerce") or 0)
-                from_loc = str(row.get("변경 전 위치", "") or "").strip()
-
-                mask_drum = (drums_df["lot_lower"] == lot_lower) & (drums_df["통번호"] == drum_no)
-                drum_idxs = drums_df.index[mask_drum]
-                if len(drum_idxs) == 0:
-                    continue
-
-                i = drum_idxs[0]
-                drums_df.at[i, "통용량"] = old_qty
-                if from_loc:
-                    drums_df.at[i, "현재위치"] = from_loc
-
-            drums_df = drums_df.drop(columns=["lot_lower"], errors="ignore")
-            save_drums(drums_df)
+            # 이력 읽기 → 최신 이력 확인 → 롤백을 한 번에 (다른 세션/프로세스와 겹치지 않게)
+            with ledger_lock():
+                # 원본(df) 기준으로 해당 행 데이터 확보 (page_df의 인덱스는 df의 원본 인덱스)
+                df = load_move_log()
+                # 화면을 그린 뒤 다른 세션/프로세스가 이력을 바꿨으면 인덱스가 다른 행을 가리킬 수 있다
+                shown = page_df.loc[selected_idx, MOVE_LOG_COLUMNS].astype(str)
+                if not set(selected_idx) <= set(df.index) or not shown.equals(
+                    df.loc[selected_idx, MOVE_LOG_COLUMNS].astype(str)
+                ):
+                    st.error("그 사이 이동 이력이 바뀌었습니다. 화면을 새로 고친 뒤 다시 선택해 주세요.")
+                    return
+                rows_to_delete = df.loc[selected_idx].copy()
+
+                # 2) 각 통(로트번호+통번호)의 '가장 최신 이력'인지 확인
+                log_all = df.copy()
+                log_all["__dt"] = pd.to_datetime(log_all["시간"], errors="coerce")
+
+                not_latest = []
+                for idx, row in rows_to_delete.iterrows():
+                    lot = str(row.get("로트번호", "") or "")
+                    drum_no = int(pd.to_numeric(row.get("통번호", 0), errors="coerce") or 0)
+
+                    mask = (log_all["로트번호"].astype(str) == lot) & (log_all["통번호"] == drum_no)
+                    sub = log_all[mask]
+                    if sub.empty:
+                        continue
+
+                    sub_valid = sub.dropna(subset=["__dt"])
+                    if not sub_valid.empty:
+                        last_idx = sub_valid["__dt"].idxmax()
+                    else:
+                        last_idx = sub.index.max()
+
+                    if idx != last_idx:
+                        not_latest.append(f"{lot} / 통 {drum_no}")
+
+                if not_latest:
+                    st.error(
+                        "롤백은 각 통의 '가장 최근 이동 이력'만 삭제할 수 있습니다.\n"
+                        "다음 항목은 더 새로운 이력이 있어 롤백할 수 없습니다:\n"
+                        + ", ".join(not_latest)
+                    )
+                    return
 
-            # 4) 이동 로그에서 행 삭제 + 저장
-            df_updated = df.drop(index=selected_idx)
-            _save_full_log(df_updated)
+                # 3) 이동 로그에서 행 삭제 + 통 정보 CSV 롤백 (용량/위치/상태/제품라인 복원, 생성 이벤트는 통 삭제)
+                rollback_log_rows(df, df.index.isin(selected_idx))
 
             st.success(f"총 {len(selected_idx)}개 이동 이력이 삭제되고, 관련 통 정보가 롤백되었습니다.")
             st.rerun()
@@ -2404,8 +5277,8 @@ def file_status(sess_key: str, path: str) -> str:
     return "파일 없음"
 
 
+@st.fragment
 def render_tab_data():
-    ss = st.session_state
     st.markdown("### 📁 데이터 파일 관리")
     st.write(
         "필요할 때마다 아래에서 CSV/엑셀 파일을 다시 업로드해서 교체할 수 있습니다. "
@@ -2427,14 +5300,13 @@ def render_tab_data():
                 st.warning("먼저 파일을 선택해 주세요.")
             else:
                 data = bulk_file.read()
-                ss["bulk_csv_bytes"] = data
-                _load_drums_core.clear()
-                try:
-                    df_tmp = _load_drums_core(data)
-                    df_tmp.to_csv(CSV_PATH, index=False, encoding="utf-8-sig")
-                except Exception:
-                    pass
-                s3_upload_bytes(CSV_PATH, data)
+                with ledger_lock():
+                    set_session_bytes("bulk_csv_bytes", data)
+                    _load_drums_core.clear()
+                    df_tmp = load_drums()
+                    persist_file(CSV_PATH, data)
+                    # 업로드한 원장을 현재 이동 이력 시점의 기준점으로 등록
+                    write_checkpoint(with_archive(df_tmp), len(load_move_log()))
                 st.success("bulk_drums_extended.csv가 교체되었습니다.")
 
     # --- production.xlsx ---
@@ -2452,15 +5324,24 @@ def render_tab_data():
                 st.warning("먼저 파일을 선택해 주세요.")
             else:
                 data = prod_file.read()
-                ss["prod_xlsx_bytes"] = data
-                _load_production_core.clear()
-                try:
-                    df_tmp = _load_production_core(data)
-                    df_tmp.to_excel(PRODUCTION_FILE, index=False)
-                except Exception:
-                    pass
-                s3_upload_bytes(PRODUCTION_FILE, data)
-                st.success("production.xlsx가 교체되었습니다.")
+                _, changes = replace_erp_workbook(
+                    PRODUCTION_FILE, "prod_xlsx_bytes", _load_production_core, data
+                )
+                n_new = 0
+                if changes is None:
+                    st.success("production.xlsx가 교체되었습니다.")
+                    n_new = materialize_uploaded_lots()
+                elif changes.empty:
+                    st.info("이전 production.xlsx와 내용이 같습니다. (변경 없음)")
+                else:
+                    st.success(f"production.xlsx 변경분을 반영했습니다. ({erp_change_counts(changes)})")
+                    n_new = materialize_uploaded_lots(
+                        prod_df=changes[changes["변경"] != CHANGE_REMOVED]
+                    )
+                if n_new:
+                    st.info(f"새 로트의 통 {n_new}개를 미리 생성했습니다. (바코드 조회 시 바로 사용)")
+
+        show_erp_changes(PRODUCTION_FILE)
 
     # --- receive.xlsx ---
     with st.expander("3) receive.xlsx (입하현황)", expanded=False):
@@ -2477,15 +5358,24 @@ def render_tab_data():
                 st.warning("먼저 파일을 선택해 주세요.")
             else:
                 data = recv_file.read()
-                ss["recv_xlsx_bytes"] = data
-                _load_receive_core.clear()
-                try:
-                    df_tmp = _load_receive_core(data)
-                    df_tmp.to_excel(RECEIVE_FILE, index=False)
-                except Exception:
-                    pass
-                s3_upload_bytes(RECEIVE_FILE, data)
-                st.success("receive.xlsx가 교체되었습니다.")
+                _, changes = replace_erp_workbook(
+                    RECEIVE_FILE, "recv_xlsx_bytes", _load_receive_core, data
+                )
+                n_new = 0
+                if changes is None:
+                    st.success("receive.xlsx가 교체되었습니다.")
+                    n_new = materialize_uploaded_lots()
+                elif changes.empty:
+                    st.info("이전 receive.xlsx와 내용이 같습니다. (변경 없음)")
+                else:
+                    st.success(f"receive.xlsx 변경분을 반영했습니다. ({erp_change_counts(changes)})")
+                    n_new = materialize_uploaded_lots(
+                        recv_df=changes[changes["변경"] != CHANGE_REMOVED]
+                    )
+                if n_new:
+                    st.info(f"새 로트의 통 {n_new}개를 미리 생성했습니다. (바코드 조회 시 바로 사용)")
+
+        show_erp_changes(RECEIVE_FILE)
 
     # --- stock.xlsx ---
     with st.expander("4) stock.xlsx (일자별통합재고현황)", expanded=False):
@@ -2502,15 +5392,22 @@ def render_tab_data():
                 st.warning("먼저 파일을 선택해 주세요.")
             else:
                 data = stock_file.read()
-                ss["stock_xlsx_bytes"] = data
-                _load_stock_core.clear()
-                try:
-                    df_tmp = _load_stock_core(data)
-                    df_tmp.to_excel(STOCK_FILE, index=False)
-                except Exception:
-                    pass
-                s3_upload_bytes(STOCK_FILE, data)
-                st.success("stock.xlsx가 교체되었습니다.")
+                old_src = session_source("stock_xlsx_bytes", STOCK_FILE)[0]
+                df_tmp, changes = replace_erp_workbook(
+                    STOCK_FILE, "stock_xlsx_bytes", _load_stock_core, data
+                )
+                if changes is not None:
+                    patch_stock_index(df_tmp, changes, old_src, session_source("stock_xlsx_bytes", STOCK_FILE)[0])
+
+                if changes is None:
+                    # 재고 인덱스는 다음 조회 때 새로 만든다
+                    st.success("stock.xlsx가 교체되었습니다.")
+                elif changes.empty:
+                    st.info("이전 stock.xlsx와 내용이 같습니다. (변경 없음)")
+                else:
+                    st.success(f"stock.xlsx 변경분을 반영했습니다. ({erp_change_counts(changes)})")
+
+        show_erp_changes(STOCK_FILE)
 
     # --- bulk_move_log.csv ---
     with st.expander("5) bulk_move_log.csv (이동 이력, 선택)", expanded=False):
@@ -2527,16 +5424,121 @@ def render_tab_data():
                 st.warning("먼저 파일을 선택해 주세요.")
             else:
                 data = move_file.read()
-                ss["move_log_csv_bytes"] = data
-                _load_move_log_core.clear()
-                try:
-                    df_tmp = _load_move_log_core(data)
-                    df_tmp.to_csv(MOVE_LOG_CSV, index=False, encoding="utf-8-sig")
-                except Exception:
-                    pass
-                s3_upload_bytes(MOVE_LOG_CSV, data)
+                with ledger_lock():
+                    set_session_bytes("move_log_csv_bytes", data)
+                    _load_move_log_core.clear()
+                    df_tmp = load_move_log()
+                    persist_file(MOVE_LOG_CSV, data)
+                    # 이력이 통째로 바뀌었으므로 현재 원장 기준으로 체크포인트 재설정
+                    reset_checkpoints(load_all_drums(), len(df_tmp))
                 st.success("bulk_move_log.csv가 교체되었습니다.")
 
+    # --- 보관 원장 (소진 통) ---
+    with st.expander("6) 소진 통 보관 (bulk_drums_archive.csv)", expanded=False):
+        hot = load_drums()
+        archive = load_archive()
+        n_consumed = int(consumed_mask(hot).sum()) if not hot.empty else 0
+        st.write(
+            f"작업 원장 {len(hot)}통 (그중 소진/폐기/0kg {n_consumed}통) · 보관 원장 {len(archive)}통"
+        )
+        if ARCHIVE_AFTER_DAYS.strip():
+            st.caption(f"세션 시작 시 마지막 이력이 {ARCHIVE_AFTER_DAYS}일 지난 소진 통을 자동으로 옮깁니다.")
+        days = st.number_input(
+            "마지막 이력 후 경과일 (0 = 바로)",
+            min_value=0,
+            value=int(ARCHIVE_AFTER_DAYS) if ARCHIVE_AFTER_DAYS.strip() else 0,
+            step=1,
+            key="archive_days",
+        )
+        if st.button("소진 통을 보관 원장으로 옮기기", key="apply_archive"):
+            n_moved = archive_consumed_drums(int(days))
+            if n_moved:
+                st.success(f"{n_moved}통을 보관 원장으로 옮겼습니다.")
+            else:
+                st.info("옮길 소진 통이 없습니다.")
+
+    # --- 로더 캐시 상태 (관리용) ---
+    with st.expander("7) 캐시 상태 (관리)", expanded=False):
+        if st.button("로더 캐시 비우기", key="clear_loader_caches"):
+            for cache in _loader_cache_registry().values():
+                cache.clear()
+            st.success("로더 캐시를 비웠습니다. 다음 조회 때 파일을 다시 읽습니다.")
+
+        stats = loader_cache_stats()
+        st.dataframe(stats, hide_index=True, use_container_width=True)
+        if not stats.empty:
+            st.caption(
+                f"전체 상주 메모리 {stats['상주 MB'].sum():.2f}MB · "
+                f"eviction 누적 {int(stats['eviction'].sum())}회"
+            )
+
+    # --- S3 연결 상태 (관리용) ---
+    with st.expander("8) S3 연결 상태 (관리)", expanded=False):
+        st.caption(
+            f"풀 {S3_MAX_POOL} · 연결 {S3_CONNECT_TIMEOUT:g}s / 읽기 {S3_READ_TIMEOUT:g}s 제한 · "
+            f"최대 {S3_MAX_ATTEMPTS}회 시도 (adaptive)"
+            + (f" · endpoint {S3_ENDPOINT_URL}" if S3_ENDPOINT_URL else "")
+        )
+        metrics = s3_metrics_frame()
+        if metrics.empty:
+            st.write("아직 S3 호출 기록이 없습니다.")
+        else:
+            st.dataframe(metrics, hide_index=True, use_container_width=True)
+        pending_files = s3_pending_filenames()
+        if pending_files:
+            st.warning("업로드 대기: " + ", ".join(pending_files))
+
+    # --- 원장 백업 / 복원 ---
+    with st.expander("9) 원장 백업 / 복원", expanded=False):
+        st.caption(
+            f"원장 · 보관 원장 · 이동 이력을 청크 단위로 중복 없이 저장 ({BACKUP_DIR}/, 로컬 + S3). "
+            f"보존: 최근 {BACKUP_KEEP_LAST}개 · 시간별 {BACKUP_KEEP_HOURLY}개 · 일별 {BACKUP_KEEP_DAILY}개 · 주별 {BACKUP_KEEP_WEEKLY}개"
+            + (f" · 자동 백업 {BACKUP_INTERVAL_MIN}분마다" if BACKUP_INTERVAL_MIN > 0 else "")
+        )
+        if st.button("지금 백업", key="backup_now"):
+            submit_ledger_backup()
+        show_job(find_job("backup", ledger_versions()), show_backup_result)
+
+        snapshots = list_backups()
+        if not snapshots:
+            st.write("아직 백업이 없습니다.")
+        else:
+            st.dataframe(backup_table(snapshots), hide_index=True, use_container_width=True)
+            logical = sum(f["size"] for m in snapshots for f in m["files"].values())
+            unique = {c: n for m in snapshots for f in m["files"].values() for c, n in f["chunks"]}
+            st.caption(
+                f"스냅샷 {len(snapshots)}개 · 원본 합계 {logical / 1024 / 1024:,.2f}MB → "
+                f"고유 청크 {len(unique)}개 {sum(unique.values()) / 1024 / 1024:,.2f}MB (압축 전)"
+            )
+
+            snap_id = st.selectbox("스냅샷 선택", [m["id"] for m in snapshots], key="backup_pick")
+            manifest = backup_manifest(snap_id)
+            cols = st.columns(len(manifest["files"]))
+            for col, name in zip(cols, manifest["files"]):
+                col.download_button(
+                    name,
+                    data=lambda name=name: backup_file_bytes(manifest, name),  # 누를 때만 조립
+                    file_name=f"{snap_id}_{name}",
+                    mime="text/csv",
+                    key=f"backup_dl_{name}",
+                )
+
+            confirm = st.checkbox(
+                "현재 원장/보관 원장/이동 이력을 이 스냅샷으로 덮어쓰는 것에 동의합니다.",
+                key="backup_restore_confirm",
+            )
+            if st.button("이 시점으로 복원", key="backup_restore", disabled=not confirm):
+                try:
+                    restored = restore_backup(snap_id)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success(
+                        f"{snap_id} 시점으로 복원했습니다. ("
+                        + ", ".join(f"{n} {b / 1024:,.1f}KB" for n, b in restored.items())
+                        + ")"
+                    )
+
     st.markdown("---")
     st.caption(
         "※ Cloud에서는 세션이 초기화되면 다시 업로드해야 합니다. "
@@ -2556,10 +5558,8 @@ def has_data(sess_key: str, path: str) -> bool:
         return True
     if os.path.exists(path):
         return True
-    b = s3_download_bytes(path)
-    if b is not None:
-        return True
-    return False
+    # 파일을 받지 않고 메타데이터 스냅샷으로 존재만 확인
+    return path in s3_metadata_snapshot()
 
 
 def main():
@@ -2582,7 +5582,23 @@ def main():
         render_file_loader()
         return
 
-    # 3) 사이드바
+    # 3) 세션 시작 시 1회: WAL 복구(프로세스당 1번) → 체크포인트 + 이동 이력 tail 재생으로 원장 동기화
+    if not ss.get("ledger_synced", False):
+        n_recovered = recover_move_log_wal()
+        if n_recovered:
+            st.info(f"저장이 끝나지 않았던 이동 이력 {n_recovered}건을 복구했습니다.")
+        sync_ledger_from_log()
+        if ARCHIVE_AFTER_DAYS.strip():
+            archive_consumed_drums(int(ARCHIVE_AFTER_DAYS))
+        ss["ledger_synced"] = True
+
+    # 4) S3 업로드 실패분 재전송 (S3_RETRY_INTERVAL마다)
+    n_pending = flush_s3_pending()
+
+    # 자동 백업 (BACKUP_INTERVAL_MIN마다, 백그라운드)
+    maybe_auto_backup()
+
+    # 5) 사이드바
     with st.sidebar:
         st.markdown(f"**사용자:** {ss['user_name']} ({ss['user_id']})")
         if st.button("로그아웃", key="logout_btn"):
@@ -2591,37 +5607,56 @@ def main():
                     del st.session_state[k]
             st.rerun()
 
+        if n_pending:
+            st.warning(f"S3 업로드 대기 {n_pending}건 (자동 재시도 중)")
+            if st.button("지금 다시 올리기", key="s3_retry_btn"):
+                if flush_s3_pending(force=True) == 0:
+                    st.success("S3 업로드를 완료했습니다.")
+                st.rerun()
+
+        jobs = job_table()
+        if not jobs.empty:
+            n_active = int(jobs["상태"].isin(list(JOB_ACTIVE)).sum())
+            with st.expander(f"백그라운드 작업 (진행 중 {n_active}건)", expanded=False):
+                st.dataframe(jobs, hide_index=True, use_container_width=True)
+
         if "bulk_csv_bytes" in ss:
             st.download_button(
                 "현재 bulk CSV 다운로드",
-                data=ss["bulk_csv_bytes"],
+                data=lambda: session_bytes("bulk_csv_bytes"),  # 누를 때만 압축 해제
                 file_name="bulk_drums_extended_current.csv",
                 mime="text/csv",
             )
         if "move_log_csv_bytes" in ss:
             st.download_button(
                 "이동 이력 CSV 다운로드",
-                data=ss["move_log_csv_bytes"],
+                data=lambda: session_bytes("move_log_csv_bytes"),
                 file_name="bulk_move_log_current.csv",
                 mime="text/csv",
             )
 
     st.title("🏭 벌크 관리 시스템")
 
-    tab_move, tab_lookup, tab_map, tab_log, tab_data = st.tabs(
-        ["📦 이동", "🔍 조회", "🗺 지도", "📜 이동 이력", "📁 데이터"]
+    # 🔹 선택된 탭만 실행 (on_change="rerun" → tab.open으로 현재 탭 판별)
+    #    각 탭 함수는 fragment라서 탭 안의 클릭은 해당 탭만 다시 실행된다.
+    tabs = st.tabs(
+        ["📦 이동", "🔍 조회", "🗺 지도", "📜 이동 이력", "📁 데이터"],
+        key="main_tab",
+        on_change="rerun",
     )
+    renderers = [
+        render_tab_move,
+        render_tab_lookup,
+        render_tab_map,
+        render_tab_move_log,
+        render_tab_data,
+    ]
 
-    with tab_move:
-        render_tab_move()
-    with tab_lookup:
-        render_tab_lookup()
-    with tab_map:
-        render_tab_map()
-    with tab_log:
-        render_tab_move_log()
-    with tab_data:
-        render_tab_data()
+    for tab, render in zip(tabs, renderers):
+        if tab.open is False:
+            continue
+        with tab:
+            render()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""
+벌크 원장 일괄 작업 CLI (야간 배치용, Streamlit 화면 없이 실행)
+
+    python bulk_cli.py [-C 데이터폴더] [--user 이름] <명령> ...
+
+app.py의 원장 코어(로더/이동 이력/체크포인트/백업)를 그대로 쓰고,
+세션 대신 프로세스 안의 st.session_state(bare 실행)에 사용자 이름만 넣는다.
+시작할 때 WAL 복구 + 원장 동기화를 하고, 끝날 때 백그라운드 저장/S3 업로드를 모두 마친다.
+
+명령:
+  sync                         WAL 복구 + 체크포인트/이동 이력으로 원장 동기화만
+  provision                    production.xlsx / receive.xlsx에서 빠진 로트의 통 생성
+  move 파일.csv                 (로트번호, 통번호, 이동 위치[, 잔량, 상태]) 일괄 이동 (커밋 1회)
+  rollback 커밋ID               일괄 이동 한 번을 통째로 되돌리기
+  check                        데이터 점검
+  reconcile                    원장 ↔ stock.xlsx 대조
+  archive                      소진 통을 보관 원장으로 옮기기
+  backup / backups / restore ID  원장 백업 / 목록 / 복원
+"""
+import argparse
+import logging
+import os
+import sys
+
+
+def load_app(data_dir: str, user: str):
+    os.chdir(data_dir)
+    # bare 실행 경고(ScriptRunContext 없음 등) 숨김
+    from streamlit import config as st_config
+    from streamlit import logger as st_logger
+
+    st_config.set_option("global.showWarningOnDirectExecution", False)
+    st_config.set_option("logger.level", "error")
+    st_logger.set_log_level(logging.ERROR)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    ss = app.st.session_state
+    ss["user_id"] = "cli"
+    ss["user_name"] = user
+    return app
+
+
+def _read_table(path: str):
+    import pandas as pd
+
+    if path.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(path)
+    return pd.read_csv(path, encoding="utf-8-sig")
+
+
+def _write_or_print(df, out: str):
+    if out:
+        df.to_csv(out, index=False, encoding="utf-8-sig")
+        print(f"  → {out} ({len(df)}행)")
+    elif not df.empty:
+        print(df.to_string(index=False, max_rows=50))
+
+
+def cmd_sync(app, args):
+    print("원장 동기화 완료")
+
+
+def cmd_provision(app, args):
+    n = app.materialize_uploaded_lots()
+    print(f"새로 생성한 통: {n}개")
+
+
+def cmd_move(app, args):
+    moves = _read_table(args.file)
+    if "이동 위치" not in moves.columns and args.to:
+        moves["이동 위치"] = args.to
+    missing = [c for c in ["로트번호", "통번호", "이동 위치"] if c not in moves.columns]
+    if missing:
+        print(f"입력 파일에 컬럼이 없습니다: {', '.join(missing)}", file=sys.stderr)
+        return 2
+
+    events, rejected = app.commit_moves(moves, status=args.status)
+    if not events.empty:
+        print(f"이동 반영: {len(events)}통 (커밋ID {events['커밋ID'].iat[0]})")
+    else:
+        print("반영할 이동이 없습니다.")
+    if not rejected.empty:
+        print(f"거절: {len(rejected)}건")
+        _write_or_print(rejected, args.rejected_out)
+    return 0
+
+
+def cmd_rollback(app, args):
+    try:
+        n = app.rollback_commit(args.commit_id)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    if n == 0:
+        print(f"커밋ID {args.commit_id}에 해당하는 이력이 없습니다.", file=sys.stderr)
+        return 1
+    print(f"이력 {n}행을 삭제하고 원장을 되돌렸습니다.")
+    return 0
+
+
+def cmd_check(app, args):
+    problems = app.check_integrity(app.load_drums())
+    if not problems:
+        print("점검 항목에서 문제가 발견되지 않았습니다.")
+        return 0
+    for i, (title, found) in enumerate(problems.items(), start=1):
+        print(f"[{title}] {len(found)}건")
+        _write_or_print(found, os.path.join(args.out, f"check_{i}.csv") if args.out else "")
+    return 1
+
+
+def cmd_reconcile(app, args):
+    if app.stock_index() is None:
+        print("stock.xlsx가 없거나 필요한 컬럼이 없습니다.", file=sys.stderr)
+        return 2
+    rep = app.reconcile_stock(args.tolerance)
+    if rep.empty:
+        print("원장과 전산 재고가 모두 일치합니다.")
+        return 0
+    print(" · ".join(f"{k} {v}건" for k, v in rep["구분"].value_counts().items()))
+    _write_or_print(rep, args.out)
+    return 1
+
+
+def cmd_archive(app, args):
+    n = app.archive_consumed_drums(args.days)
+    print(f"보관 원장으로 옮긴 통: {n}개")
+
+
+def cmd_backup(app, args):
+    result = app.create_backup(app.current_ledger_files(), user=app.st.session_state["user_name"], reason="배치")
+    if result["unchanged"]:
+        print(f"마지막 백업({result['id']})과 내용이 같아 새로 저장하지 않았습니다.")
+    else:
+        print(f"백업 {result['id']} 저장 (새 청크 {result['new_chunks']}개 / {result['new_bytes'] / 1024:,.1f}KB)")
+
+
+def cmd_backups(app, args):
+    table = app.backup_table(app.list_backups())
+    print(table.to_string(index=False) if not table.empty else "백업이 없습니다.")
+
+
+def cmd_restore(app, args):
+    try:
+        restored = app.restore_backup(args.snapshot_id)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"{args.snapshot_id} 시점으로 복원: " + ", ".join(f"{n} {b:,}B" for n, b in restored.items()))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="벌크 원장 일괄 작업 (Streamlit 없이 실행)")
+    parser.add_argument("-C", "--data-dir", default=".", help="원장/엑셀 파일이 있는 폴더 (기본: 현재 폴더)")
+    parser.add_argument("--user", default=os.getenv("BULK_USER", "batch"), help="이동 이력 ID 열에 남길 이름")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("sync", help="WAL 복구 + 원장 동기화").set_defaults(func=cmd_sync)
+    sub.add_parser("provision", help="업로드된 작업/입하 로트의 통 생성").set_defaults(func=cmd_provision)
+
+    p = sub.add_parser("move", help="CSV/엑셀 목록으로 일괄 이동")
+    p.add_argument("file")
+    p.add_argument("--to", help="파일에 '이동 위치' 컬럼이 없을 때 모든 행의 이동 위치")
+    p.add_argument("--status", choices=["잔량", "생산대기", "생산종료"], help="상태 컬럼이 없을 때 적용할 상태")
+    p.add_argument("--rejected-out", default="", help="거절 행을 저장할 CSV 경로")
+    p.set_defaults(func=cmd_move)
+
+    p = sub.add_parser("rollback", help="커밋ID 단위 롤백")
+    p.add_argument("commit_id")
+    p.set_defaults(func=cmd_rollback)
+
+    p = sub.add_parser("check", help="데이터 점검 (문제가 있으면 종료 코드 1)")
+    p.add_argument("--out", default="", help="문제 행을 CSV로 저장할 폴더")
+    p.set_defaults(func=cmd_check)
+
+    p = sub.add_parser("reconcile", help="원장 ↔ stock.xlsx 대조 (불일치가 있으면 종료 코드 1)")
+    p.add_argument("--tolerance", type=float, default=None, help="허용 오차 kg")
+    p.add_argument("--out", default="", help="대조 결과 CSV 경로")
+    p.set_defaults(func=cmd_reconcile)
+
+    p = sub.add_parser("archive", help="소진 통 보관")
+    p.add_argument("--days", type=int, default=0, help="마지막 이력 후 경과일")
+    p.set_defaults(func=cmd_archive)
+
+    sub.add_parser("backup", help="원장 백업").set_defaults(func=cmd_backup)
+    sub.add_parser("backups", help="백업 목록").set_defaults(func=cmd_backups)
+    p = sub.add_parser("restore", help="백업 시점으로 복원")
+    p.add_argument("snapshot_id")
+    p.set_defaults(func=cmd_restore)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    app = load_app(args.data_dir, args.user)
+    if getattr(args, "tolerance", 0) is None:
+        args.tolerance = app.RECONCILE_TOLERANCE_KG
+
+    n_recovered = app.recover_move_log_wal()
+    if n_recovered:
+        print(f"저장이 끝나지 않았던 이동 이력 {n_recovered}건을 복구했습니다.")
+    app.sync_ledger_from_log()
+
+    code = args.func(app, args) or 0
+
+    # 백그라운드 저장 + S3 재전송까지 끝낸 뒤 종료
+    app.wait_for_persist()
+    n_pending = app.flush_s3_pending(force=True)
+    if n_pending:
+        print(f"S3 업로드 실패 {n_pending}건: " + ", ".join(app.s3_pending_filenames()), file=sys.stderr)
+        code = code or 1
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+"""
+스캐너 이동 입력용 로컬 HTTP 서버 (앱과 같은 데이터 폴더를 보고 따로 실행)
+
+    python scan_intake.py [-C 데이터폴더] [--host 127.0.0.1] [--port 8765]
+
+POST /scan          {"barcode" 또는 "lot", "drum", "to", ["qty", "status", "user"]} 또는 그 목록
+                    → 메모리 인덱스(원장 통 / 작업번호·입하번호 → 로트)로 바로 검증 (202 / 422)
+                    → 받은 스캔은 큐에 모았다가 SCAN_BATCH_WINDOW초 또는 SCAN_BATCH_MAX건마다
+                      commit_moves 한 번(이력 1회 추가 + 원장 1회 저장)으로 반영
+GET  /scan/<ticket> 스캔 한 건의 처리 결과 (대기 / 반영 / 거절)
+GET  /health        큐 길이, 커밋 수, 최근 커밋, 커밋 스레드 상태 (스레드가 멈췄으면 503)
+
+SCAN_INTAKE_TOKEN이 설정되어 있으면 X-Scan-Token 헤더가 같아야 받는다.
+원장 읽기/쓰기는 커밋 스레드 하나에서만 하고, 요청 스레드는 인덱스 조회 + 큐 적재만 한다.
+앱/bulk_cli와는 원장 잠금(app.ledger_lock, 데이터 폴더의 잠금 파일)으로 커밋이 겹치지 않고,
+다른 프로세스가 원장/이력 파일을 바꾸면 세션 바이트 대신 파일을 다시 읽는다 (app.session_source).
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from bulk_cli import load_app
+
+SCAN_BATCH_WINDOW = float(os.getenv("SCAN_BATCH_WINDOW", "1.0"))   # 초. 첫 스캔 후 이만큼 모아서 커밋
+SCAN_BATCH_MAX = int(os.getenv("SCAN_BATCH_MAX", "200"))            # 한 커밋 최대 스캔 수
+SCAN_RESULT_KEEP = int(os.getenv("SCAN_RESULT_KEEP", "10000"))      # /scan/<ticket> 조회용 결과 보관 수
+SCAN_INTAKE_TOKEN = os.getenv("SCAN_INTAKE_TOKEN", "")
+SCAN_MAX_BODY = 1024 * 1024
+
+PENDING, COMMITTED, REJECTED = "대기", "반영", "거절"
+
+
+def drum_number(value):
+    """스캔의 통번호 → int. 정수, 정수값 float(2.0), 숫자 문자열만 받고 나머지(1.5, true 등)는 None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str) and value.strip().isdecimal():
+        return int(value.strip())
+    return None
+
+
+class IntakeIndex:
+    """
+    스캔 검증용 메모리 인덱스 (원장/production/receive 버전이 같으면 재사용).
+    - keys: 작업 원장의 (소문자 로트번호, 통번호)
+    - live: 소문자 로트번호 → 살아 있는 통번호 목록 (통번호 없이 스캔했을 때 1통짜리 로트 판단)
+    - barcodes: 대문자 작업번호/입하번호 → 로트번호
+    - zones: 받을 수 있는 이동 위치 (app.known_locations)
+    """
+
+    def __init__(self, app, version):
+        self.version = version
+        df = app.load_drums()
+        lots = df["로트번호"].astype(str).str.strip().str.lower()
+        self.keys = set(zip(lots, df["통번호"].astype(int)))
+        self.zones = app.known_locations(df)
+        self.normalize_location = app.normalize_location
+        live = df[~app.consumed_mask(df)]
+        self.live = (
+            live.groupby(live["로트번호"].astype(str).str.strip().str.lower())["통번호"]
+            .apply(lambda s: sorted(s.astype(int)))
+            .to_dict()
+        )
+
+        self.barcodes = {}
+        for frame, code_col, lot_col in [
+            (app.load_production(), "작업번호", "LOTNO"),
+            (app.load_receive(), "입하번호", "로트번호"),
+        ]:
+            if frame.empty or code_col not in frame.columns or lot_col not in frame.columns:
+                continue
+            codes = frame[code_col].astype(str).str.strip().str.upper()
+            self.barcodes.update(zip(codes, frame[lot_col].astype(str).str.strip().str.upper()))
+
+    def resolve(self, event: dict):
+        """스캔 1건 → (이동 요청 dict, None) 또는 (None, 거절 사유)."""
+        if not isinstance(event, dict):
+            return None, "JSON 객체가 아님"
+        to_zone = self.normalize_location(event.get("to") or "")
+        if not to_zone:
+            return None, "이동 위치(to) 없음"
+        if to_zone not in self.zones:
+            return None, f"알 수 없는 이동 위치: {to_zone}"
+
+        lot = str(event.get("lot") or "").strip().upper()
+        if not lot:
+            barcode = str(event.get("barcode") or "").strip().upper()
+            if not barcode:
+                return None, "barcode 또는 lot 필요"
+            lot = self.barcodes.get(barcode, "")
+            if not lot:
+                return None, f"작업번호/입하번호 {barcode}를 찾을 수 없음"
+
+        drum = event.get("drum")
+        if drum in (None, ""):
+            drums = self.live.get(lot.lower(), [])
+            if len(drums) != 1:
+                return None, f"로트 {lot}의 통이 {len(drums)}개 → 통번호(drum) 필요"
+            drum = drums[0]
+        number = drum_number(drum)
+        if number is None:
+            return None, f"통번호 {drum!r}가 숫자가 아님"
+        drum = number
+        if (lot.lower(), drum) not in self.keys:
+            return None, f"원장에 없는 통: {lot} / {drum}"
+
+        return {
+            "로트번호": lot,
+            "통번호": drum,
+            "이동 위치": to_zone,
+            "잔량": event.get("qty"),
+            "상태": event.get("status"),
+            "ID": event.get("user") or "",
+        }, None
+
+
+class ScanIntake:
+    """스캔 큐 + 마이크로 배치 커밋 스레드."""
+
+    def __init__(self, app, user: str):
+        self.app = app
+        self.user = user
+        self.queue = queue.Queue()
+        self.results = OrderedDict()   # ticket → {"상태", "사유", "커밋ID"}
+        self.lock = threading.Lock()
+        self.index = None
+        self.commits = 0
+        self.committed_scans = 0
+        self.last_commit = None
+        self.last_error = None
+        self.stopping = threading.Event()
+        self.refresh_index()
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="scan-commit")
+
+    # ----- 인덱스 -----
+    def _versions(self):
+        app = self.app
+        return (
+            app.session_source("bulk_csv_bytes", app.CSV_PATH)[0],
+            app.session_source("prod_xlsx_bytes", app.PRODUCTION_FILE)[0],
+            app.session_source("recv_xlsx_bytes", app.RECEIVE_FILE)[0],
+        )
+
+    def refresh_index(self):
+        version = self._versions()
+        if self.index is None or self.index.version != version:
+            self.index = IntakeIndex(self.app, version)
+
+    # ----- 요청 스레드 -----
+    def submit(self, events: list) -> dict:
+        index = self.index
+        accepted, rejected = [], []
+        for i, event in enumerate(events):
+            move, reason = index.resolve(event)
+            if move is None:
+                rejected.append({"index": i, "reason": reason})
+                continue
+            ticket = uuid.uuid4().hex[:12]
+            with self.lock:
+                self.results[ticket] = {"상태": PENDING}
+                while len(self.results) > SCAN_RESULT_KEEP:
+                    self.results.popitem(last=False)
+            self.queue.put((ticket, move))
+            accepted.append({"index": i, "ticket": ticket, "lot": move["로트번호"], "drum": move["통번호"]})
+        return {"accepted": accepted, "rejected": rejected}
+
+    def result(self, ticket: str):
+        with self.lock:
+            return self.results.get(ticket)
+
+    def health(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "commits": self.commits,
+            "committed_scans": self.committed_scans,
+            "last_commit": self.last_commit,
+            "last_error": self.last_error,
+            "commit_thread_alive": self.thread.is_alive(),
+            "batch_window_s": SCAN_BATCH_WINDOW,
+            "batch_max": SCAN_BATCH_MAX,
+        }
+
+    # ----- 커밋 스레드 -----
+    def _collect(self) -> list:
+        """첫 스캔을 기다린 뒤 SCAN_BATCH_WINDOW 동안 또는 SCAN_BATCH_MAX건까지 모은다."""
+        try:
+            batch = [self.queue.get(timeout=SCAN_BATCH_WINDOW)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + SCAN_BATCH_WINDOW
+        while len(batch) < SCAN_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _report_error(self, where: str, e: Exception):
+        """커밋 스레드 오류를 stderr에 남기고 /health에 보여 준다 (스레드는 계속 돈다)."""
+        self.last_error = {"위치": where, "오류": f"{type(e).__name__}: {e}", "시각": self.app.now_kst_str()}
+        print(f"[scan-commit] {where} 실패: {type(e).__name__}: {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+
+    def _commit(self, batch: list):
+        tickets = [t for t, _ in batch]
+        try:
+            events, rejected = self.app.commit_moves(pd.DataFrame([m for _, m in batch]), user=self.user)
+            commit_id = events["커밋ID"].iat[0] if not events.empty else None
+            # 거절 행의 인덱스 = 배치 안 순번
+            reasons = {tickets[i]: reason for i, reason in rejected["사유"].items()} if not rejected.empty else {}
+            outcome = {
+                t: {"상태": REJECTED, "사유": reasons[t]} if t in reasons else {"상태": COMMITTED, "커밋ID": commit_id}
+                for t in tickets
+            }
+            if commit_id:
+                self.commits += 1
+                self.committed_scans += len(events)
+                self.last_commit = {"커밋ID": commit_id, "통": len(events), "시각": self.app.now_kst_str()}
+        except Exception as e:
+            self._report_error("커밋", e)
+            outcome = {t: {"상태": REJECTED, "사유": f"커밋 실패: {type(e).__name__}: {e}"} for t in tickets}
+
+        with self.lock:
+            for t, r in outcome.items():
+                if t in self.results:
+                    self.results[t] = r
+
+    def _loop(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._commit(batch)
+            try:
+                self.refresh_index()
+            except Exception as e:
+                self._report_error("인덱스 갱신", e)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """남은 큐를 모두 커밋하고 저장/S3 업로드까지 마친다."""
+        self.stopping.set()
+        self.thread.join()
+        self.app.wait_for_persist()
+        self.app.flush_s3_pending(force=True)
+
+
+def make_handler(intake: ScanIntake):
+    class ScanHandler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self) -> bool:
+            if SCAN_INTAKE_TOKEN and self.headers.get("X-Scan-Token", "") != SCAN_INTAKE_TOKEN:
+                self._send(401, {"error": "토큰이 올바르지 않습니다."})
+                return False
+            return True
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            if self.path.rstrip("/") != "/scan":
+                self._send(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if length <= 0 or length > SCAN_MAX_BODY:
+                self._send(413 if length > SCAN_MAX_BODY else 400, {"error": "본문 크기가 올바르지 않습니다."})
+                return
+            try:
+                payload = json.loads(self.rfile.read(length))
+            except ValueError:
+                self._send(400, {"error": "JSON 형식이 아닙니다."})
+                return
+            events = payload if isinstance(payload, list) else [payload]
+            result = intake.submit(events)
+            self._send(202 if result["accepted"] else 422, result)
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            path = self.path.rstrip("/")
+            if path == "/health":
+                health = intake.health()
+                self._send(200 if health["commit_thread_alive"] else 503, health)
+            elif path.startswith("/scan/"):
+                r = intake.result(path[len("/scan/"):])
+                self._send(200 if r else 404, r or {"error": "알 수 없는 ticket"})
+            else:
+                self._send(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            # 스캔마다 접근 로그를 찍지 않는다 (교대 시간 수백 건/분)
+            pass
+
+    return ScanHandler
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="스캐너 이동 입력 HTTP 서버")
+    parser.add_argument("-C", "--data-dir", default=".", help="원장/엑셀 파일이 있는 폴더 (기본: 현재 폴더)")
+    parser.add_argument("--host", default=os.getenv("SCAN_INTAKE_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SCAN_INTAKE_PORT", "8765")))
+    parser.add_argument("--user", default=os.getenv("BULK_USER", "scanner"), help="스캔에 user가 없을 때 남길 이름")
+    args = parser.parse_args(argv)
+
+    app = load_app(args.data_dir, args.user)
+    app.recover_move_log_wal()
+    app.sync_ledger_from_log()
+
+    intake = ScanIntake(app, args.user)
+    intake.start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(intake))
+    print(f"스캔 입력 대기: http://{args.host}:{args.port}/scan (배치 {SCAN_BATCH_WINDOW:g}초 / {SCAN_BATCH_MAX}건)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        intake.stop()
+        print(f"종료: 커밋 {intake.commits}회 / 스캔 {intake.committed_scans}건 반영")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 테스트는 S3 없이 로컬 파일만 쓴다
+os.environ["S3_BUCKET_NAME"] = ""
+
+LEDGER = pd.DataFrame(
+    {
+        "품목코드": ["3VTCLOS-000", "3VTCLOS-000", "3VTCLOS-000", "3VTCLOS-001"],
+        "품명": ["제품0", "제품0", "제품0", "제품1"],
+        "로트번호": ["L0000", "L0000", "L0000", "L0001"],
+        "제품라인": ["", "", "", "유상"],
+        "제조일자": ["2026-01-10"] * 4,
+        "상태": ["생산대기", "생산대기", "잔량", "생산종료"],
+        "통번호": [1, 2, 3, 1],
+        "통용량": [500.0, 500.0, 120.0, 300.0],
+        "현재위치": ["창고", "2층 보관", "4층 A1", "5층 B1"],
+    }
+)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """원장 4통 + 빈 이동 이력이 있는 데이터 폴더."""
+    LEDGER.to_csv(tmp_path / "bulk_drums_extended.csv", index=False, encoding="utf-8-sig")
+    return tmp_path
+
+
+@pytest.fixture
+def app(data_dir):
+    """bare 실행으로 불러온 app 모듈 (작업 폴더 = data_dir)."""
+    from bulk_cli import load_app
+
+    cwd = os.getcwd()
+    module = load_app(str(data_dir), "테스트")
+    yield module
+    os.chdir(cwd)
+
+
+def run_cli(data_dir, *args, env=None):
+    """bulk_cli.py를 별도 프로세스로 실행. return: CompletedProcess"""
+    return subprocess.run(
+        [sys.executable, os.path.join(ROOT, "bulk_cli.py"), "-C", str(data_dir), *args],
+        capture_output=True,
+        text=True,
+        env=dict(os.environ, **(env or {})),
+        timeout=120,
+    )
+
+
+def read_ledger(data_dir) -> pd.DataFrame:
+    """작업 원장 CSV를 (로트번호, 통번호) 순으로."""
+    df = pd.read_csv(data_dir / "bulk_drums_extended.csv", keep_default_na=False)
+    return df.sort_values(["로트번호", "통번호"]).reset_index(drop=True)
@@ -0,0 +1,62 @@
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+from conftest import read_ledger, run_cli
+from test_wal import S3_DOWN
+
+
+def test_prune_keeps_recent_unreferenced_chunks(app):
+    old = app._chunk_path("0" * 64)
+    fresh = app._chunk_path("1" * 64)
+    for path in (old, fresh):
+        app._backup_put(path, app.pack_bytes(b"x"))
+    stale = time.time() - (app.BACKUP_CHUNK_GRACE_MIN + 5) * 60
+    os.utime(old, (stale, stale))
+
+    # 보존 정책에서 빠지는 스냅샷이 있어야 청크 정리까지 간다
+    for i in range(app.BACKUP_KEEP_LAST + 2):
+        app.create_backup({"bulk_drums_extended.csv": f"v{i}\n".encode()}, reason="테스트")
+    # 같은 시간대 스냅샷은 보존 정책상 최근 N개만 남는다
+    assert len(app.list_backups()) < app.BACKUP_KEEP_LAST + 2
+
+    assert not os.path.exists(old)
+    assert os.path.exists(fresh)
+
+
+def test_restore_discards_later_moves_and_wal(data_dir):
+    pd.DataFrame({"로트번호": ["L0000"], "통번호": [2], "이동 위치": ["6층 스킨팩"]}).to_csv(
+        data_dir / "moves.csv", index=False, encoding="utf-8-sig"
+    )
+    out = run_cli(data_dir, "backup").stdout
+    snap_id = re.search(r"백업 (\S+) 저장", out).group(1)
+    before = read_ledger(data_dir)
+
+    run_cli(data_dir, "move", "moves.csv", env=S3_DOWN)
+    assert (data_dir / "bulk_move_log.wal").exists()
+
+    assert run_cli(data_dir, "restore", snap_id).returncode == 0
+    assert not (data_dir / "bulk_move_log.wal").exists()
+
+    synced = run_cli(data_dir, "sync")
+    assert "복구" not in synced.stdout
+    assert pd.read_csv(data_dir / "bulk_move_log.csv").empty
+    pd.testing.assert_frame_equal(read_ledger(data_dir), before)
+
+
+def test_snapshot_listing_is_cached_until_backup_changes(app):
+    first = app.create_backup({"bulk_drums_extended.csv": b"v1\n"}, reason="테스트")
+    assert [m["id"] for m in app.list_backups()] == [first["id"]]
+
+    # 다른 프로세스가 만든 스냅샷은 목록 캐시가 지나야 보인다
+    other = dict(first, id="20000101_000000_beef", created="2000-01-01T00:00:00+09:00")
+    app._backup_put(app._snapshot_path(other["id"]), json.dumps(other).encode("utf-8"))
+    assert len(app.list_backups()) == 1
+    assert app.backup_manifest(other["id"])["id"] == other["id"]
+
+    # 이 프로세스의 백업은 바로 보인다
+    second = app.create_backup({"bulk_drums_extended.csv": b"v2\n"}, reason="테스트")
+    assert app.list_backups()[0]["id"] == second["id"]
@@ -0,0 +1,78 @@
+import os
+import shutil
+from datetime import datetime
+
+import pandas as pd
+
+from conftest import LEDGER
+
+
+def test_failed_checkpoint_write_keeps_previous_file(app):
+    df = app.normalize_drums(LEDGER.copy())
+    app.write_checkpoint(df, 0)
+    path = app._checkpoint_path(0)
+    with open(path, "rb") as f:
+        before = f.read()
+
+    os.mkdir(path + ".tmp")  # 임시 파일을 만들 수 없게
+    app.write_checkpoint(df.iloc[:2], 0)
+    with open(path, "rb") as f:
+        assert f.read() == before
+    assert len(app.load_checkpoint(0)) == 4
+
+
+MOVES = [
+    ("2026-02-01 10:00:00", "L0000", 1, "5층 기초", None),
+    ("2026-02-02 10:00:00", "L0000", 2, "6층 보관", None),
+    ("2026-02-03 10:00:00", "L0001", 1, "6층 스킨팩", 100),
+]
+AS_OF = datetime(2026, 2, 1, 12, 0)  # 첫 이동 직후
+
+
+def _history(app):
+    """원장 상태 목록(이동 0~3회 후)과 시간이 고정된 이동 이력."""
+    states = [app.normalize_drums(LEDGER.copy())]
+    events = []
+    for when, lot, drum, to, qty in MOVES:
+        ev, rejected = app.plan_moves(
+            states[-1],
+            pd.DataFrame({"로트번호": [lot], "통번호": [drum], "이동 위치": [to], "잔량": [qty]}),
+            user="테스트",
+        )
+        assert rejected.empty
+        ev = ev.assign(시간=when, 커밋ID=f"c{len(events)}")
+        events.append(ev)
+        states.append(app.apply_log_events(states[-1], ev))
+    app.save_move_log(pd.concat(events, ignore_index=True)[app.MOVE_LOG_COLUMNS])
+    return states
+
+
+def _only_checkpoint(app, state, offset):
+    shutil.rmtree(app.CHECKPOINT_DIR, ignore_errors=True)
+    app._load_checkpoint_core.clear()
+    if state is not None:
+        app.write_checkpoint(state, offset)
+
+
+def test_drums_as_of_replays_from_earlier_checkpoint(app):
+    states = _history(app)
+    # 현재 원장이 틀려도 체크포인트 + 재생으로 복원된다
+    app.save_drums(states[0].assign(통용량=1.0))
+    _only_checkpoint(app, states[0], 0)
+    assert app._same_ledger(app.drums_as_of(AS_OF), states[1])
+
+
+def test_drums_as_of_rewinds_from_later_checkpoint(app):
+    states = _history(app)
+    app.save_drums(states[0].assign(통용량=1.0))
+    _only_checkpoint(app, states[2], 2)
+    assert app._same_ledger(app.drums_as_of(AS_OF), states[1])
+
+
+def test_drums_as_of_rewinds_current_ledger_without_checkpoints(app):
+    states = _history(app)
+    app.save_drums(states[3])
+    _only_checkpoint(app, None, 0)
+    assert app.list_checkpoint_offsets() == []
+    assert app._same_ledger(app.drums_as_of(AS_OF), states[1])
+    assert app._same_ledger(app.drums_as_of(datetime(2026, 1, 1)), states[0])
@@ -0,0 +1,78 @@
+import re
+
+import pandas as pd
+
+from conftest import read_ledger, run_cli
+
+
+def _write_moves(data_dir, rows):
+    pd.DataFrame(rows).to_csv(data_dir / "moves.csv", index=False, encoding="utf-8-sig")
+
+
+def test_move_then_rollback_restores_ledger(data_dir):
+    _write_moves(
+        data_dir,
+        {
+            "로트번호": ["L0000", "l0000", "L0001", "L9999"],
+            "통번호": [1, 2, 1, 1],
+            "이동 위치": ["5층 B1", "외주", "6층 보관", "2층"],
+            "잔량": [200, None, None, None],
+        },
+    )
+    before = read_ledger(data_dir)
+
+    moved = run_cli(data_dir, "move", "moves.csv", "--status", "잔량")
+    assert moved.returncode == 0, moved.stderr
+    assert "이동 반영: 3통" in moved.stdout and "거절: 1건" in moved.stdout
+
+    expected = before.copy()
+    expected.loc[0, ["통용량", "현재위치", "상태"]] = [200.0, "5층 B1", "잔량"]
+    expected.loc[1, ["현재위치", "상태"]] = ["외주", "외주"]
+    expected.loc[3, ["현재위치", "상태"]] = ["6층 보관", "잔량"]
+    pd.testing.assert_frame_equal(read_ledger(data_dir), expected)
+
+    commit_id = re.search(r"커밋ID (\w+)", moved.stdout).group(1)
+    rolled = run_cli(data_dir, "rollback", commit_id)
+    assert rolled.returncode == 0, rolled.stderr
+    pd.testing.assert_frame_equal(read_ledger(data_dir), before)
+    assert pd.read_csv(data_dir / "bulk_move_log.csv").empty
+
+
+def test_rollback_refused_when_drum_moved_again(data_dir):
+    _write_moves(data_dir, {"로트번호": ["L0000"], "통번호": [3], "이동 위치": ["5층 B1"]})
+    first = re.search(r"커밋ID (\w+)", run_cli(data_dir, "move", "moves.csv").stdout).group(1)
+    _write_moves(data_dir, {"로트번호": ["L0000"], "통번호": [3], "이동 위치": ["6층 스킨팩"]})
+    assert run_cli(data_dir, "move", "moves.csv").returncode == 0
+    after = read_ledger(data_dir)
+
+    rolled = run_cli(data_dir, "rollback", first)
+    assert rolled.returncode == 1
+    assert "더 새로운 이력" in rolled.stderr
+    pd.testing.assert_frame_equal(read_ledger(data_dir), after)
+
+
+def test_move_rejects_unknown_zone(data_dir):
+    _write_moves(data_dir, {"로트번호": ["L0000", "L0000"], "통번호": [1, 2], "이동 위치": ["5층 기쵸", "5층 기초"]})
+    before = read_ledger(data_dir)
+
+    moved = run_cli(data_dir, "move", "moves.csv", "--rejected-out", "rejected.csv")
+    assert "이동 반영: 1통" in moved.stdout
+    rejected = pd.read_csv(data_dir / "rejected.csv")
+    assert list(rejected["사유"]) == ["알 수 없는 이동 위치: 5층 기쵸"]
+
+    after = read_ledger(data_dir)
+    assert after.loc[1, "현재위치"] == "5층 기초"
+    pd.testing.assert_frame_equal(after.drop(index=1), before.drop(index=1))
+
+
+def test_move_rejects_fractional_drum_and_dedupes_on_integer(data_dir):
+    _write_moves(
+        data_dir,
+        {"로트번호": ["L0000", "L0000", "L0000"], "통번호": ["2.7", "2", "2.0"], "이동 위치": ["외주", "5층 기초", "6층 보관"]},
+    )
+    moved = run_cli(data_dir, "move", "moves.csv", "--rejected-out", "rejected.csv")
+    assert "이동 반영: 1통" in moved.stdout
+    rejected = pd.read_csv(data_dir / "rejected.csv")
+    assert list(rejected["사유"]) == ["통번호 없음", "같은 통 중복 (마지막 요청만 반영)"]
+    assert read_ledger(data_dir).loc[1, "현재위치"] == "6층 보관"
+    assert len(pd.read_csv(data_dir / "bulk_move_log.csv")) == 1
@@ -0,0 +1,72 @@
+import io
+import os
+
+import pandas as pd
+
+
+def _production(rows):
+    return pd.DataFrame(rows, columns=["작업번호", "품번", "품명", "LOTNO", "지시수량", "제조량", "작업일자"])
+
+
+def _xlsx(df) -> bytes:
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+OLD = _production(
+    [
+        ["W1", "3VTCLOS-000", "제품0", "L0000", 1000, 1000, "2026-01-10"],
+        ["W2", "3VTCLOS-000", "제품0", "L0001", 1000, 900, "2026-01-11"],
+        ["W3", "3VTCLOS-001", "제품1", "L0002", 500, 500, "2026-01-12"],
+    ]
+)
+
+
+def test_diff_classifies_added_modified_removed(app):
+    new = _production(
+        [
+            ["W2", "3VTCLOS-000", "제품0", "L0001", 1000, 950, "2026-01-11"],
+            ["W3", "3VTCLOS-001", "제품1", "L0002", 500, 500, "2026-01-12"],
+            [" W4", "3VTCLOS-002", "제품2", "L0003", 300, 300, "2026-01-13"],
+        ]
+    )
+    changes = app.diff_erp_frames(OLD, new, ["작업번호"])
+    assert dict(zip(changes["작업번호"], changes["변경"])) == {"W4": "추가", "W2": "수정", "W1": "삭제"}
+    # 수정/추가는 새 값, 삭제는 이전 값
+    assert changes.set_index("작업번호").loc["W2", "제조량"] == 950
+    assert changes.set_index("작업번호").loc["W1", "LOTNO"] == "L0000"
+
+
+def test_diff_ignores_int_float_difference(app):
+    new = OLD.assign(지시수량=OLD["지시수량"].astype(float), 제조량=OLD["제조량"].astype(float))
+    assert new.loc[0, "제조량"] == 1000.0
+    changes = app.diff_erp_frames(OLD, new, ["작업번호"])
+    assert changes is not None and changes.empty
+
+
+def test_diff_returns_none_for_duplicate_or_missing_keys(app):
+    dup = pd.concat([OLD, OLD.iloc[[0]]], ignore_index=True)
+    assert app.diff_erp_frames(OLD, dup, ["작업번호"]) is None
+    assert app.diff_erp_frames(dup, OLD, ["작업번호"]) is None
+    assert app.diff_erp_frames(OLD, OLD.drop(columns=["작업번호"]), ["작업번호"]) is None
+
+
+def test_reupload_without_changes_keeps_file(app, data_dir):
+    app.drop_session_bytes("prod_xlsx_bytes")
+    OLD.to_excel(data_dir / app.PRODUCTION_FILE, index=False)
+    path = data_dir / app.PRODUCTION_FILE
+    mtime = path.stat().st_mtime_ns
+
+    same = OLD.assign(제조량=OLD["제조량"].astype(float))
+    _, changes = app.replace_erp_workbook(app.PRODUCTION_FILE, "prod_xlsx_bytes", app._load_production_core, _xlsx(same))
+    assert changes is not None and changes.empty
+    assert path.stat().st_mtime_ns == mtime
+    assert not os.path.exists(data_dir / app.ERP_CHANGE_DIR)
+
+    # 변경이 있으면 파일 교체 + 변경분 저장
+    changed = OLD.assign(제조량=[1000, 800, 500])
+    _, changes = app.replace_erp_workbook(app.PRODUCTION_FILE, "prod_xlsx_bytes", app._load_production_core, _xlsx(changed))
+    assert list(changes["변경"]) == ["수정"]
+    assert pd.read_excel(path)["제조량"].tolist() == [1000, 800, 500]
+    assert len(os.listdir(data_dir / app.ERP_CHANGE_DIR)) == 1
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from conftest import LEDGER, ROOT, read_ledger, run_cli
+
+
+def test_same_ledger_ignores_row_order(app):
+    df = app.normalize_drums(LEDGER.copy())
+    shuffled = df.iloc[[3, 1, 0, 2]]
+    assert app._same_ledger(df, shuffled)
+    assert not app._same_ledger(df, shuffled.assign(통용량=[300.0, 500.0, 500.0, 0.0]))
+
+
+def test_sync_after_archive_does_not_rewrite_ledger(data_dir):
+    pd.DataFrame({"로트번호": ["L0000"], "통번호": [1], "이동 위치": ["소진"], "잔량": [0]}).to_csv(
+        data_dir / "moves.csv", index=False, encoding="utf-8-sig"
+    )
+    assert run_cli(data_dir, "move", "moves.csv").returncode == 0
+    assert "1개" in run_cli(data_dir, "archive").stdout
+
+    ledger = data_dir / "bulk_drums_extended.csv"
+    mtime = ledger.stat().st_mtime_ns
+    assert run_cli(data_dir, "sync").returncode == 0
+    assert run_cli(data_dir, "sync").returncode == 0
+    assert ledger.stat().st_mtime_ns == mtime
+
+
+def _moves(data_dir, lot, drum, to):
+    pd.DataFrame({"로트번호": [lot], "통번호": [drum], "이동 위치": [to]}).to_csv(
+        data_dir / "moves.csv", index=False, encoding="utf-8-sig"
+    )
+    return pd.DataFrame({"로트번호": [lot], "통번호": [drum], "이동 위치": [to]})
+
+
+def test_stale_session_reloads_after_other_process_writes(app, data_dir):
+    # 이 프로세스가 저장 → 세션에 원장/이력 바이트가 남는다
+    events, _ = app.commit_moves(_moves(data_dir, "L0000", 1, "5층 기초"))
+    assert not events.empty
+
+    # 다른 프로세스(CLI)가 같은 폴더의 원장/이력을 바꾼다
+    _moves(data_dir, "L0000", 2, "6층 스킨팩")
+    assert run_cli(data_dir, "move", "moves.csv").returncode == 0
+
+    # 세션 바이트가 아니라 바뀐 파일 기준으로 읽고, 다음 커밋이 CLI 이동을 덮어쓰지 않는다
+    drums = app.load_drums()
+    assert drums.loc[(drums["로트번호"] == "L0000") & (drums["통번호"] == 2), "현재위치"].item() == "6층 스킨팩"
+    app.commit_moves(_moves(data_dir, "L0001", 1, "6층 보관"))
+    app.wait_for_persist()
+
+    ledger = read_ledger(data_dir)
+    assert list(ledger["현재위치"]) == ["5층 기초", "6층 스킨팩", "4층 A1", "6층 보관"]
+    log = pd.read_csv(data_dir / "bulk_move_log.csv")
+    assert log["커밋ID"].nunique() == 3
+
+
+def test_cli_waits_for_ledger_lock(app, data_dir):
+    _moves(data_dir, "L0000", 3, "5층 기초")
+    with app.ledger_lock():
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "bulk_cli.py"), "-C", str(data_dir), "move", "moves.csv"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        with pytest.raises(subprocess.TimeoutExpired):
+            proc.wait(timeout=6)
+        assert read_ledger(data_dir).loc[2, "현재위치"] == "4층 A1"
+    assert proc.wait(timeout=60) == 0
+    assert read_ledger(data_dir).loc[2, "현재위치"] == "5층 기초"
@@ -0,0 +1,67 @@
+import pandas as pd
+
+ONSITE, WAREHOUSE = "WC501", "WH201"
+
+
+def _drum(lot, qty, place, item="P1"):
+    return {
+        "품목코드": item, "품명": "벌크", "로트번호": lot, "제품라인": "", "제조일자": "2026-01-10",
+        "상태": "잔량", "통번호": 1, "통용량": qty, "현재위치": place,
+    }
+
+
+def _stock(lot, qty, code, item="P1"):
+    return {"창고/작업장": code, "창고/작업장명": code, "품번": item, "로트번호": lot, "실재고수량": qty}
+
+
+def _setup(app, data_dir):
+    pd.DataFrame(
+        [
+            _drum("LA", 500, "5층 기초"),     # 일치
+            _drum("LB", 300, "5층 기초"),     # 전산 200 → 수량 차이
+            _drum("LC", 200, "창고"),         # 전산 없음 → 원장만
+            _drum("LE", 400, "6층 보관"),     # 전산은 창고에 400 → 위치 차이
+            _drum("LF", 100, "폐기"),         # 소진/폐기 통은 제외
+            _drum("LG", 100.3, "5층 기초"),   # 허용 오차 안
+        ]
+    ).to_csv(data_dir / app.CSV_PATH, index=False, encoding="utf-8-sig")
+    pd.DataFrame([_drum("LH", 50, "5층 기초")]).to_csv(
+        data_dir / app.ARCHIVE_CSV, index=False, encoding="utf-8-sig"
+    )
+    pd.DataFrame(
+        [
+            _stock("LA", 500, ONSITE),
+            _stock("LB", 200, ONSITE),
+            _stock("LD", 150, ONSITE),        # 원장 없음 → 전산만
+            _stock("LE", 400, WAREHOUSE),
+            _stock("LG", 100, ONSITE),
+            _stock("LZ", 999, ONSITE, item="RAW"),  # 원장에 없는 품번(원료)은 제외
+        ]
+    ).to_excel(data_dir / app.STOCK_FILE, index=False)
+    for key in ["bulk_csv_bytes", "archive_csv_bytes", "stock_xlsx_bytes"]:
+        app.drop_session_bytes(key)
+
+
+def test_reconcile_labels_and_exclusions(app, data_dir):
+    _setup(app, data_dir)
+    rep = app.reconcile_stock()
+    got = {(r.로트번호, r.대분류): (r.구분, r.차이_kg) for r in rep.itertuples()}
+    assert got == {
+        ("LB", "자사"): ("수량 차이", 100.0),
+        ("LC", "창고"): ("원장만", 200.0),
+        ("LD", "자사"): ("전산만", -150.0),
+        ("LE", "자사"): ("위치 차이", 400.0),
+        ("LE", "창고"): ("위치 차이", -400.0),
+    }
+    # 보관 원장(LH) / 폐기 통(LF) / 허용 오차 안(LG) / 원료 품번은 나오지 않는다
+    assert not set(rep["로트번호"]) & {"LF", "LG", "LH", "LZ"}
+
+
+def test_reconcile_tolerance(app, data_dir):
+    _setup(app, data_dir)
+    strict = app.reconcile_stock(tolerance=0.1)
+    row = strict[strict["로트번호"] == "LG"].iloc[0]
+    assert row["구분"] == "수량 차이" and round(row["차이_kg"], 3) == 0.3
+
+    loose = app.reconcile_stock(tolerance=200)
+    assert set(zip(loose["로트번호"], loose["구분"])) == {("LE", "위치 차이")}
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from conftest import LEDGER
+
+
+def _moves(rows):
+    return pd.DataFrame(rows, columns=["로트번호", "통번호", "이동 위치", "잔량", "상태"])
+
+
+def test_revert_log_rows_restores_status_and_line(app):
+    before = app.normalize_drums(LEDGER.copy())
+    prior = app.creation_events(before)
+
+    events, rejected = app.plan_moves(
+        before,
+        _moves(
+            [
+                ["L0000", 1, "5층 기초", 200, "잔량"],
+                ["L0000", 2, "외주", None, None],
+                ["L0001", 1, "6층 보관", 0, "생산대기"],
+            ]
+        ),
+        user="테스트",
+    )
+    assert rejected.empty
+    events["제품라인"] = "무상"
+    after = app.apply_log_events(before, events)
+    assert after.loc[0, "상태"] == "잔량" and after.loc[1, "상태"] == "외주"
+
+    reverted = app.revert_log_rows(after, events, prior)
+    assert app._same_ledger(reverted, before)
+
+
+def test_revert_log_rows_drops_created_drums(app):
+    before = app.normalize_drums(LEDGER.copy())
+    created = app.creation_events(before.iloc[[3]])
+    reverted = app.revert_log_rows(before, created, app.creation_events(before.iloc[:3]))
+    assert list(reverted["로트번호"]) == ["L0000", "L0000", "L0000"]
@@ -0,0 +1,49 @@
+import time
+
+from conftest import read_ledger
+
+
+def _wait(intake, ticket, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        r = intake.result(ticket)
+        if r["상태"] != "대기":
+            return r
+        time.sleep(0.05)
+    raise AssertionError(f"{ticket} 처리 대기 시간 초과")
+
+
+def test_failed_batch_is_rejected_and_thread_keeps_running(app, data_dir):
+    from scan_intake import ScanIntake
+
+    intake = ScanIntake(app, "테스트")
+    intake.start()
+    try:
+        # 이동 컬럼이 없는 배치 → commit_moves에서 예외
+        intake.results["broken"] = {"상태": "대기"}
+        intake.queue.put(("broken", {"바코드": "???"}))
+        r = _wait(intake, "broken")
+        assert r["상태"] == "거절" and r["사유"].startswith("커밋 실패")
+
+        health = intake.health()
+        assert health["commit_thread_alive"] and health["last_error"]["위치"] == "커밋"
+
+        # 다음 배치는 정상 반영
+        ticket = intake.submit([{"lot": "L0000", "drum": 1, "to": "5층 기초"}])["accepted"][0]["ticket"]
+        assert _wait(intake, ticket)["상태"] == "반영"
+    finally:
+        intake.stop()
+    assert read_ledger(data_dir).loc[0, "현재위치"] == "5층 기초"
+
+
+def test_resolve_rejects_non_integer_drums(app):
+    from scan_intake import IntakeIndex
+
+    index = IntakeIndex(app, None)
+    scan = {"lot": "L0000", "to": "5층 기초"}
+    for drum in [1.5, "1.5", True, "1e0", [1]]:
+        move, reason = index.resolve(dict(scan, drum=drum))
+        assert move is None and "숫자가 아님" in reason, drum
+    for drum in [1, 1.0, "1", " 1 "]:
+        move, reason = index.resolve(dict(scan, drum=drum))
+        assert reason is None and move["통번호"] == 1, drum
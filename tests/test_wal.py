@@ -0,0 +1,47 @@
+import re
+
+import pandas as pd
+
+from conftest import LEDGER, read_ledger, run_cli
+
+# S3 업로드가 항상 실패하도록 (WAL 기록이 정리되지 않고 남는다)
+S3_DOWN = {
+    "S3_BUCKET_NAME": "bulk-test",
+    "S3_ENDPOINT_URL": "http://127.0.0.1:9",
+    "S3_MAX_ATTEMPTS": "1",
+    "AWS_ACCESS_KEY_ID": "test",
+    "AWS_SECRET_ACCESS_KEY": "test",
+    "AWS_DEFAULT_REGION": "ap-northeast-2",
+}
+
+
+def test_rolled_back_commit_is_not_recovered_from_wal(data_dir):
+    pd.DataFrame({"로트번호": ["L0001"], "통번호": [1], "이동 위치": ["6층 스킨팩"]}).to_csv(
+        data_dir / "moves.csv", index=False, encoding="utf-8-sig"
+    )
+    before = read_ledger(data_dir)
+
+    moved = run_cli(data_dir, "move", "moves.csv", env=S3_DOWN)
+    commit_id = re.search(r"커밋ID (\w+)", moved.stdout).group(1)
+    assert (data_dir / "bulk_move_log.wal").exists()
+
+    rolled = run_cli(data_dir, "rollback", commit_id, env=S3_DOWN)
+    assert "되돌렸습니다" in rolled.stdout
+
+    synced = run_cli(data_dir, "sync", env=S3_DOWN)
+    assert "복구" not in synced.stdout
+    log = pd.read_csv(data_dir / "bulk_move_log.csv")
+    assert not (log["커밋ID"].astype(str) == commit_id).any()
+    pd.testing.assert_frame_equal(read_ledger(data_dir), before)
+    assert "6층 스킨팩" not in set(read_ledger(data_dir)["현재위치"])
+
+
+def test_wal_discard_keeps_other_commits(app):
+    rows = app.creation_events(app.normalize_drums(LEDGER.copy()))
+    app.wal_append(rows.iloc[:2].assign(커밋ID="a"), "a")
+    app.wal_append(rows.iloc[2:].assign(커밋ID="b"), "b")
+
+    app.wal_discard(rows.iloc[[0, 1, 3]].assign(커밋ID=["a", "a", "b"]))
+    records = app.wal_records()
+    assert [r["커밋ID"] for r in records] == ["b"]
+    assert [row["통번호"] for row in records[0]["rows"]] == [3]